@@ -0,0 +1,241 @@
+from typing import List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import math
+import os
+from PIL import Image, ImageTk
+import customtkinter as ctk
+import numpy as np
+import cv2
+from display import DisplayMapper
+from renderer import ViewportRenderer, FAST, FINE
+from roi_masks import roi_shape, roi_points
+from memory import memory, photo_nbytes
+
+# Gap between panes in canvas pixels
+PANE_GAP = 2
+
+
+class ComparePane:
+    '''
+    One image of the compare view with its own pyramid and display window.
+    '''
+    def __init__(self, path: str, max_value: Optional[float] = None):
+        self.path = path
+        self.title = os.path.basename(path)
+        self.pil_image = Image.open(path)
+        self.renderer = ViewportRenderer()
+        self.renderer.set_image(self.pil_image)
+        self.display = DisplayMapper()
+        self.display.set_data_range(self.pil_image, max_value)
+
+    def close(self) -> None:
+        self.pil_image.close()
+
+
+class CompareCanvas(ctk.CTkCanvas):
+    '''
+    Shows several images side by side in a grid, all through one shared mat_affine.
+
+    Panning or zooming in any pane changes the shared transform, so every pane shows
+    the same region of its image. Each pane renders only its own visible pixels from
+    its own cached pyramid, and the panes render concurrently on a thread pool
+    (cv2 releases the GIL). The pane images and the ROI outlines are composed into a
+    single frame, so a redraw costs one Tk image regardless of the number of panes
+    or ROIs.
+    '''
+    def __init__(self, master, max_workers: Optional[int] = None, **kwargs):
+        super().__init__(master, **kwargs)
+        self.panes: List[ComparePane] = []
+        self.rois: List[dict] = []
+        self.flat_field = None
+        self.mat_affine = np.eye(3)
+        self.refine_delay_ms = 150
+        self.roi_colour = (34, 59, 201)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or min(8, os.cpu_count() or 2), thread_name_prefix="floro-compare")
+        self._frame: Optional[np.ndarray] = None
+        self._refine_after_id = None
+        self._old_event = None
+        memory.register(
+            "photo_images", self,
+            measure=lambda canvas: photo_nbytes(getattr(canvas, "image", None)) + (canvas._frame.nbytes if canvas._frame is not None else 0),
+        )
+
+        self.bind("<Button-1>", self._mouse_down_left)
+        self.bind("<B1-Motion>", self._mouse_move_left)
+        self.bind("<Double-Button-1>", self._mouse_double_left)
+        self.bind("<MouseWheel>", self._mouse_wheel)
+        self.bind("<Configure>", lambda event: self._draw_image())
+
+    def set_images(self, paths: List[str], max_values: Optional[List[Optional[float]]] = None) -> None:
+        '''
+        Show the given images, zoomed to fit the first one into a pane.
+
+        max_values are the images' precomputed maxima, None where there are none.
+        '''
+        self.clear()
+        max_values = max_values or [None] * len(paths)
+        self.panes = [ComparePane(path, max_value) for path, max_value in zip(paths, max_values)]
+        self._zoom_fit()
+        self._draw_image()
+
+    def clear(self) -> None:
+        for pane in self.panes:
+            pane.close()
+        self.panes = []
+        self.delete("all")
+
+    def shutdown(self) -> None:
+        self.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def layout(self) -> Tuple[int, int, int, int]:
+        '''
+        Return the grid's columns and rows and the size of one pane in canvas pixels.
+        '''
+        count = max(1, len(self.panes))
+        columns = math.ceil(math.sqrt(count))
+        rows = math.ceil(count / columns)
+        pane_width = max(1, (self.winfo_width() - PANE_GAP * (columns - 1)) // columns)
+        pane_height = max(1, (self.winfo_height() - PANE_GAP * (rows - 1)) // rows)
+        return columns, rows, pane_width, pane_height
+
+    def _pane_origin(self, index: int) -> Tuple[int, int]:
+        columns, _, pane_width, pane_height = self.layout()
+        row, column = divmod(index, columns)
+        return column * (pane_width + PANE_GAP), row * (pane_height + PANE_GAP)
+
+    def _pane_at(self, x: int, y: int) -> Optional[Tuple[int, int]]:
+        '''
+        Return the origin of the pane under a canvas point, or None if the point is in a gap.
+        '''
+        _, _, pane_width, pane_height = self.layout()
+        for index in range(len(self.panes)):
+            left, top = self._pane_origin(index)
+            if left <= x < left + pane_width and top <= y < top + pane_height:
+                return left, top
+        return None
+
+    def _render_pane(self, pane: ComparePane, mat_affine: np.ndarray, size: Tuple[int, int], quality: str) -> np.ndarray:
+        '''
+        Render one pane to an RGB array with its ROIs drawn in. Runs on the thread pool.
+
+        Every pane of a frame gets the same copy of the shared transform, and the flat-field
+        viewport gain it shares with the other panes is cached under the FlatField's lock.
+        '''
+        view = pane.renderer.render(mat_affine, size, quality)
+        flat_field = self.flat_field
+        if flat_field is not None and flat_field.matches(pane.pil_image.width, pane.pil_image.height):
+            flat_field.apply_viewport(view, mat_affine)
+        rgb = np.asarray(pane.display.render(Image.fromarray(view)).convert("RGB")).copy()
+        self._draw_rois(rgb, mat_affine)
+        return rgb
+
+    def _draw_rois(self, rgb: np.ndarray, mat_affine: np.ndarray) -> None:
+        '''
+        Rasterise the ROI outlines into a pane; cv2 clips them to the pane.
+        '''
+        # Drawing with 4 fractional bits keeps outlines in place at high zoom
+        shift = 4
+        scale = 1 << shift
+        for roi in self.rois:
+            points = roi_points(roi)
+            canvas_points = points @ mat_affine[:2, :2].T + mat_affine[:2, 2]
+            fixed = np.round(canvas_points * scale).astype(np.int32)
+            shape = roi_shape(roi)
+            if shape == "polygon":
+                cv2.polylines(rgb, [fixed], True, self.roi_colour, 2, cv2.LINE_AA, shift)
+            elif shape == "ellipse":
+                center = tuple(int(v) for v in (fixed[0] + fixed[1]) // 2)
+                axes = tuple(int(v) for v in np.abs(fixed[1] - fixed[0]) // 2)
+                cv2.ellipse(rgb, center, axes, 0, 0, 360, self.roi_colour, 2, cv2.LINE_AA, shift)
+            else:
+                cv2.rectangle(rgb, tuple(int(v) for v in fixed[0]), tuple(int(v) for v in fixed[1]), self.roi_colour, 2, cv2.LINE_AA, shift)
+
+    def _draw_image(self, quality: str = FAST) -> None:
+        '''
+        Render every pane concurrently and show them as one frame.
+        '''
+        self.delete("all")
+        if not self.panes:
+            return
+        width, height = self.winfo_width(), self.winfo_height()
+        if width <= 1 or height <= 1:
+            return
+        _, _, pane_width, pane_height = self.layout()
+
+        mat_affine = self.mat_affine.copy()
+        futures = [
+            self._executor.submit(self._render_pane, pane, mat_affine, (pane_width, pane_height), quality)
+            for pane in self.panes
+        ]
+        if self._frame is None or self._frame.shape[:2] != (height, width):
+            self._frame = np.empty((height, width, 3), dtype=np.uint8)
+        self._frame[...] = 0
+        for index, future in enumerate(futures):
+            left, top = self._pane_origin(index)
+            self._frame[top:top + pane_height, left:left + pane_width] = future.result()
+
+        self.image = ImageTk.PhotoImage(image=Image.fromarray(self._frame))
+        self.create_image(0, 0, anchor="nw", image=self.image)
+        for index, pane in enumerate(self.panes):
+            left, top = self._pane_origin(index)
+            self.create_text(left + 6, top + 4, text=pane.title, anchor="nw", fill="white")
+
+        if quality == FAST:
+            self._schedule_refine()
+        else:
+            memory.enforce()
+
+    def _schedule_refine(self) -> None:
+        if self._refine_after_id is not None:
+            self.after_cancel(self._refine_after_id)
+        self._refine_after_id = self.after(self.refine_delay_ms, self._refine)
+
+    def _refine(self) -> None:
+        self._refine_after_id = None
+        self.after_idle(self._draw_image, FINE)
+
+    def _zoom_fit(self) -> None:
+        '''
+        Fit the first image into a pane.
+        '''
+        if not self.panes:
+            return
+        _, _, pane_width, pane_height = self.layout()
+        image = self.panes[0].pil_image
+        scale = min(pane_width / image.width, pane_height / image.height)
+        self.mat_affine = np.array([
+            [scale, 0.0, (pane_width - image.width * scale) / 2],
+            [0.0, scale, (pane_height - image.height * scale) / 2],
+            [0.0, 0.0, 1.0],
+        ])
+
+    def _mouse_down_left(self, event) -> None:
+        self._old_event = event
+
+    def _mouse_move_left(self, event) -> None:
+        if self._old_event is None:
+            return
+        mat = np.eye(3)
+        mat[0, 2] = float(event.x - self._old_event.x)
+        mat[1, 2] = float(event.y - self._old_event.y)
+        self.mat_affine = mat @ self.mat_affine
+        self._old_event = event
+        self._draw_image()
+
+    def _mouse_double_left(self, _) -> None:
+        self._zoom_fit()
+        self._draw_image()
+
+    def _mouse_wheel(self, event) -> None:
+        '''
+        Zoom every pane about the cursor position within the pane under it.
+        '''
+        origin = self._pane_at(event.x, event.y)
+        if origin is None:
+            return
+        cx, cy = event.x - origin[0], event.y - origin[1]
+        scale = 1.25 if event.delta < 0 else 0.8
+        mat = np.array([[scale, 0.0, cx * (1 - scale)], [0.0, scale, cy * (1 - scale)], [0.0, 0.0, 1.0]])
+        self.mat_affine = mat @ self.mat_affine
+        self._draw_image()
@@ -4,7 +4,7 @@ import sv_ttk
 
 
 class CustomTreeview(ttk.Treeview):
-    def __init__(self, parent, columns, headings, data=None, *args, **kwargs):
+    def __init__(self, parent, columns, headings, data=None, *args, read_only=False, **kwargs):
         super().__init__(parent, *args, **kwargs)
         self.columns = columns
         self.headings = headings
@@ -16,8 +16,10 @@ class CustomTreeview(ttk.Treeview):
         if self.data:
             self.insert_data()
 
-        self.bind("<BackSpace>", self.delete_selected_row)
-        self.bind("<Double-1>", self.on_double_click)
+        # Read only tables (e.g. results) can't be edited or have rows deleted
+        if not read_only:
+            self.bind("<BackSpace>", self.delete_selected_row)
+            self.bind("<Double-1>", self.on_double_click)
 
         # Set the theme to "Sun Valley"
         sv_ttk.set_theme("dark")
@@ -39,6 +41,11 @@ class CustomTreeview(ttk.Treeview):
         for row in self.data:
             self.insert(parent="", index="end", values=row)
 
+    def insert_rows(self, rows):
+        # Tk redraws on idle, so the whole batch is laid out once after the loop
+        for row in rows:
+            self.insert(parent="", index="end", values=row)
+
     def delete_selected_row(self, event):
         selected_item = self.selection()
         if selected_item:
@@ -49,7 +56,7 @@ class CustomTreeview(ttk.Treeview):
         region = self.identify("region", event.x, event.y)
         if region == "cell":
             column = self.identify_column(event.x)
-            if column == "#2":  # Assuming "Name" is the second column
+            if column in ("#2", "#4"):  # Drug name and concentration are editable
                 item = self.identify_row(event.y)
                 self.edit_cell(item, column)
 
@@ -88,6 +95,9 @@ class CustomTreeview(ttk.Treeview):
         if column == "#2":  # Assuming "Drug Name" is the second column
             roi_id = self.set(item, "#1")  # Get the ROI ID from the first column
             self.master.master.master.update_drug_name(roi_id, new_value)
+        elif column == "#4":  # Concentration
+            roi_id = self.set(item, "#1")
+            self.master.master.master.update_concentration(roi_id, new_value)
 
 if __name__ == "__main__":
     # Create the main window
@@ -1,6 +1,67 @@
-from typing import List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 import sqlite3
+import json
 import os
+import re
+import numpy as np
+from PIL import Image
+from image_stats import PERCENTILES, percentile_column
+
+# File extensions recognised as images when scanning a folder
+IMAGE_EXTENSIONS = [".bmp", ".png", ".jpg", ".tif"]
+
+# Header fields captured per image when the folder is scanned
+IMAGE_COLUMNS = ["width", "height", "mode", "format", "n_pages"]
+
+# Producers of measurement rows: whole frame segmentation, time series tracking, wells
+# segmented inside ROIs and whole ROI means. Each replaces only its own rows of an image.
+MEASUREMENT_SOURCES = ["wells", "tracking", "roi_wells", "roi_masks"]
+
+# Scalar columns of the image_stats table, in storage order
+STATS_COLUMNS = ["min", "max", "mean"] + [percentile_column(p) for p in PERCENTILES] + ["otsu", "saturated_fraction", "focus"]
+
+def natural_key(path: str) -> list:
+    """Sort key ordering file names the way people number them, e.g. frame_2 before frame_10."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", os.path.basename(path))]
+
+def format_roi_points(roi: dict) -> str:
+    """Serialises an ROI for the roi_points column as JSON, with point arrays stored as lists.
+    
+    Args:
+        roi (dict): The ROI, e.g. {"start": array([x, y, 1.]), "end": array([x, y, 1.])}.
+    
+    Returns:
+        str: The JSON text. Coordinates are stored as floats at full precision, so an ROI
+            reloaded with parse_roi_points serialises to the same text.
+    """
+    return json.dumps({key: np.asarray(value, dtype=np.float64).tolist() if isinstance(value, (np.ndarray, list, tuple)) else value for key, value in roi.items()})
+
+def parse_roi_points(roi_points: str) -> dict:
+    """Parses an ROI stored by save_roi/save_rois back into a dict of points.
+    
+    Args:
+        roi_points (str): The stored JSON text, or the repr written by older versions,
+            e.g. "{'start': array([x, y, 1.]), 'end': array([x, y, 1.])}".
+    
+    Returns:
+        dict: The ROI with its point arrays (e.g. "start", "end" or "points") and string fields such as "well" and "shape".
+    """
+    try:
+        stored = json.loads(roi_points)
+    except ValueError:
+        stored = None
+    if isinstance(stored, dict):
+        return {key: np.array(value, dtype=np.float64) if isinstance(value, list) else value for key, value in stored.items()}
+
+    # Older versions stored the ROI's repr, which numpy rounds to 8 significant digits
+    roi = {
+        key: np.array([float(value) for value in values.split(",")])
+        for key, values in re.findall(r"'(\w+)': array\(\[([^\]]*)\]\)", roi_points)
+    }
+    # String fields such as the well ID and the ROI shape
+    for key, value in re.findall(r"'(\w+)': '([^']*)'", roi_points):
+        roi[key] = value
+    return roi
 
 class DatabaseManager:
     """Manages all database interactions for the application."""
@@ -27,24 +88,37 @@ class DatabaseManager:
             cursor = conn.cursor()
             cursor.execute("DROP TABLE IF EXISTS images")
             cursor.execute("DROP TABLE IF EXISTS roi_table")
+            cursor.execute("DROP TABLE IF EXISTS image_stats")
+            cursor.execute("DROP TABLE IF EXISTS measurements")
+            cursor.execute("DROP TABLE IF EXISTS project_metadata")
             cursor.execute("""
                 CREATE TABLE images (
                     image_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    image_path TEXT
+                    image_path TEXT,
+                    width INTEGER,
+                    height INTEGER,
+                    mode TEXT,
+                    format TEXT,
+                    n_pages INTEGER
                 )
             """)
             cursor.execute("""
                 CREATE TABLE roi_table (
                     roi_id INTEGER PRIMARY KEY AUTOINCREMENT,
                     drug_name TEXT,
-                    roi_points TEXT
+                    roi_points TEXT,
+                    well TEXT,
+                    concentration REAL
                 )
             """)
+            self._ensure_stats_table(conn)
+            self._ensure_measurements_table(conn)
+            self._ensure_metadata_table(conn)
             image_paths = self.get_image_paths(folder_path)
             self.insert_image_paths(image_paths, conn)
 
     def insert_image_paths(self, image_paths: List[str], conn: sqlite3.Connection) -> None:
-        """Insert image paths into the images table.
+        """Insert image paths and their header metadata into the images table.
         
         Args:
             image_paths (List[str]): List of image paths to insert.
@@ -52,11 +126,48 @@ class DatabaseManager:
         """
         cursor = conn.cursor()
         cursor.executemany(
-            "INSERT INTO images (image_path) VALUES (?)",
-            [(image_path,) for image_path in image_paths]
+            "INSERT INTO images (image_path, width, height, mode, format, n_pages) VALUES (?, ?, ?, ?, ?, ?)",
+            [(image_path, *self.read_image_header(image_path)) for image_path in image_paths]
         )
         conn.commit()
 
+    def add_images(self, image_paths: List[str]) -> List[int]:
+        """Registers new images in an existing project without touching the rest of the database.
+        
+        Args:
+            image_paths (List[str]): Paths of the images to add.
+        
+        Returns:
+            List[int]: The new images' primary key IDs, in the same order as image_paths.
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            self._ensure_image_columns(conn)
+            cursor = conn.cursor()
+            image_ids = []
+            for image_path in image_paths:
+                cursor.execute(
+                    "INSERT INTO images (image_path, width, height, mode, format, n_pages) VALUES (?, ?, ?, ?, ?, ?)",
+                    (image_path, *self.read_image_header(image_path))
+                )
+                image_ids.append(cursor.lastrowid)
+            conn.commit()
+        return image_ids
+
+    def read_image_header(self, image_path: str) -> Tuple:
+        """Reads the size, mode, format and page count of an image without decoding its pixels.
+        
+        Args:
+            image_path (str): Path to the image file.
+        
+        Returns:
+            Tuple: (width, height, mode, format, n_pages), all None if the file cannot be read.
+        """
+        try:
+            with Image.open(image_path) as img:
+                return img.width, img.height, img.mode, img.format, getattr(img, "n_frames", 1)
+        except OSError:
+            return None, None, None, None, None
+
     def get_image_paths(self, folder_path: str) -> List[str]:
         """Extracts all image file paths from the given folder.
         
@@ -64,21 +175,20 @@ class DatabaseManager:
             folder_path (str): The path to the folder to scan for images.
         
         Returns:
-            List[str]: List of image file paths.
+            List[str]: List of image file paths, in natural file name order.
         """
-        image_extensions = [".bmp", ".png", ".jpg", ".tif"]
-        return [
+        return sorted((
             os.path.join(folder_path, filename)
             for filename in os.listdir(folder_path)
-            if os.path.splitext(filename)[1].lower() in image_extensions
-        ]
+            if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+        ), key=natural_key)
 
-    def save_roi(self, drug_name: str, roi_points: list) -> int:
+    def save_roi(self, drug_name: str, roi_points: dict) -> int:
         """Saves the ROI data to the database.
         
         Args:
             drug_name (str): Name of the drug associated with the ROI.
-            roi_points (list): List of points defining the ROI.
+            roi_points (dict): The ROI's points, e.g. {"start": array, "end": array}.
         
         Returns:
             int: The newly created ROI's primary key ID.
@@ -87,27 +197,63 @@ class DatabaseManager:
             cursor = conn.cursor()
             cursor.execute(
                 "INSERT INTO roi_table (drug_name, roi_points) VALUES (?, ?)",
-                (drug_name, str(roi_points))
+                (drug_name, format_roi_points(roi_points))
             )
             roi_id = cursor.lastrowid
             conn.commit()
         return roi_id
 
-    def delete_roi(self, roi_points: List[Tuple[int, int]]) -> Optional[int]:
+    def save_rois(self, drug_name: str, rois: List[dict]) -> List[int]:
+        """Saves many ROIs to the database in a single transaction.
+        
+        Args:
+            drug_name (str): Name of the drug associated with the ROIs.
+            rois (List[dict]): ROIs to save. The optional "well" key is stored in the well column.
+        
+        Returns:
+            List[int]: The newly created ROIs' primary key IDs, in the same order as rois.
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            self._ensure_roi_columns(conn)
+            cursor = conn.cursor()
+            roi_ids = []
+            for roi in rois:
+                cursor.execute(
+                    "INSERT INTO roi_table (drug_name, roi_points, well) VALUES (?, ?, ?)",
+                    (drug_name, format_roi_points(roi), roi.get("well"))
+                )
+                roi_ids.append(cursor.lastrowid)
+            conn.commit()
+        return roi_ids
+
+    def _ensure_roi_columns(self, conn: sqlite3.Connection) -> None:
+        """Adds columns missing from roi_table in databases created by older versions.
+        
+        Args:
+            conn (sqlite3.Connection): Active SQLite connection object.
+        """
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(roi_table)")]
+        if "well" not in columns:
+            conn.execute("ALTER TABLE roi_table ADD COLUMN well TEXT")
+        if "concentration" not in columns:
+            conn.execute("ALTER TABLE roi_table ADD COLUMN concentration REAL")
+
+    def delete_roi(self, roi_points: dict) -> Optional[int]:
         """Deletes the ROI data from the database based on the given ROI points and returns the primary key of the deleted row.
         
         Args:
-            roi_points (List[Tuple[int, int]]): The list of points defining the ROI to delete.
+            roi_points (dict): The points defining the ROI to delete.
         
         Returns:
             Optional[int]: The primary key of the deleted row, or None if no row was deleted.
         """
-        roi_points_str = str(roi_points)  # Convert list of points to a string as stored in the database
+        # Match the JSON written now as well as the repr written by older versions
+        stored_forms = (format_roi_points(roi_points), str(roi_points))
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
             
             # First, fetch the primary key of the row that matches the ROI points
-            cursor.execute("SELECT roi_id FROM roi_table WHERE roi_points = ?", (roi_points_str,))
+            cursor.execute("SELECT roi_id FROM roi_table WHERE roi_points IN (?, ?)", stored_forms)
             row = cursor.fetchone()
             if row is None:
                 return None  # No matching row found
@@ -115,7 +261,7 @@ class DatabaseManager:
             roi_id = row[0]
             
             # Proceed with deletion
-            cursor.execute("DELETE FROM roi_table WHERE roi_points = ?", (roi_points_str,))
+            cursor.execute("DELETE FROM roi_table WHERE roi_points IN (?, ?)", stored_forms)
             conn.commit()
             
             return roi_id  # Return the primary key of the deleted row
@@ -154,3 +300,335 @@ class DatabaseManager:
         )
         conn.commit()
         conn.close()
+
+    def update_concentration(self, roi_id: int, concentration: Optional[float]) -> None:
+        """Updates the drug concentration of an ROI.
+        
+        Args:
+            roi_id (int): ID of the ROI.
+            concentration (Optional[float]): The concentration, or None to clear it.
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            self._ensure_roi_columns(conn)
+            conn.execute("UPDATE roi_table SET concentration = ? WHERE roi_id = ?", (concentration, roi_id))
+            conn.commit()
+
+    def get_dose_response_data(self, source: str = "roi_masks", page: int = 0) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """Retrieves the drug, concentration and mean intensity of every ROI measurement with a concentration.
+        
+        Measurements saved before sources were recorded are included whatever their source,
+        since an image then only held the rows of one producer.
+        
+        Args:
+            source (str): Producer of the measurements to use, one of MEASUREMENT_SOURCES.
+            page (int): Page (channel) of the images the measurements were made on.
+        
+        Returns:
+            Tuple[List[str], np.ndarray, np.ndarray]: Drug names, concentrations and responses, one entry per measurement.
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            self._ensure_roi_columns(conn)
+            self._ensure_measurements_table(conn)
+            rows = conn.execute(
+                """
+                SELECT roi_table.drug_name, roi_table.concentration, measurements.mean_intensity
+                FROM measurements JOIN roi_table ON measurements.roi_id = roi_table.roi_id
+                WHERE roi_table.concentration IS NOT NULL AND roi_table.drug_name IS NOT NULL
+                  AND (measurements.source = ? OR measurements.source IS NULL)
+                  AND COALESCE(measurements.page, 0) = ?
+                """,
+                (source, page)
+            ).fetchall()
+        drugs = [row[0] for row in rows]
+        concentrations = np.array([row[1] for row in rows], dtype=np.float64)
+        responses = np.array([row[2] for row in rows], dtype=np.float64)
+        return drugs, concentrations, responses
+
+    def get_images(self) -> List[Tuple[int, str]]:
+        """Retrieves the ID and path of every image in the database.
+        
+        Returns:
+            List[Tuple[int, str]]: A list of (image_id, image_path) tuples.
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT image_id, image_path FROM images ORDER BY image_id")
+            return cursor.fetchall()
+
+    def get_images_without_stats(self) -> List[Tuple[int, str]]:
+        """Retrieves the images that have no precomputed statistics yet.
+        
+        Returns:
+            List[Tuple[int, str]]: A list of (image_id, image_path) tuples.
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            self._ensure_stats_table(conn)
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT images.image_id, images.image_path FROM images
+                LEFT JOIN image_stats ON images.image_id = image_stats.image_id
+                WHERE image_stats.image_id IS NULL
+                ORDER BY images.image_id
+            """)
+            return cursor.fetchall()
+
+    def save_image_stats(self, stats_by_image: Dict[int, Dict]) -> None:
+        """Saves the statistics of many images in a single transaction.
+        
+        Args:
+            stats_by_image (Dict[int, Dict]): Statistics from compute_image_stats keyed by image ID.
+        """
+        columns = ", ".join(STATS_COLUMNS)
+        placeholders = ", ".join("?" for _ in STATS_COLUMNS)
+        with sqlite3.connect(self.db_path) as conn:
+            self._ensure_stats_table(conn)
+            conn.executemany(
+                f"INSERT OR REPLACE INTO image_stats (image_id, {columns}, histogram) VALUES (?, {placeholders}, ?)",
+                [
+                    (image_id, *(stats[column] for column in STATS_COLUMNS), stats["histogram"].astype(np.uint64).tobytes())
+                    for image_id, stats in stats_by_image.items()
+                ]
+            )
+            conn.commit()
+
+    def get_image_stats(self, image_path: str) -> Optional[Dict]:
+        """Retrieves the precomputed statistics of an image.
+        
+        Args:
+            image_path (str): Path of the image as stored in the images table.
+        
+        Returns:
+            Optional[Dict]: The statistics with the histogram as a numpy array, or None if not computed yet.
+        """
+        columns = ", ".join(f"image_stats.{column}" for column in STATS_COLUMNS)
+        with sqlite3.connect(self.db_path) as conn:
+            self._ensure_stats_table(conn)
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT {columns}, image_stats.histogram FROM image_stats
+                JOIN images ON images.image_id = image_stats.image_id
+                WHERE images.image_path = ?
+                """,
+                (image_path,)
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        stats = dict(zip(STATS_COLUMNS, row[:-1]))
+        stats["histogram"] = np.frombuffer(row[-1], dtype=np.uint64)
+        return stats
+
+    def _ensure_stats_table(self, conn: sqlite3.Connection) -> None:
+        """Creates the image_stats table if it does not exist.
+        
+        Args:
+            conn (sqlite3.Connection): Active SQLite connection object.
+        """
+        column_defs = ",\n".join(f"{column} REAL" for column in STATS_COLUMNS)
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS image_stats (
+                image_id INTEGER PRIMARY KEY REFERENCES images(image_id),
+                {column_defs},
+                histogram BLOB
+            )
+        """)
+
+    def save_measurements(self, image_id: int, measurements: List[Tuple], source: str, page: int = 0) -> None:
+        """Replaces the measurements one producer made of one page of an image in a single transaction.
+        
+        Rows of other sources and other pages are kept. Rows saved before sources were
+        recorded are replaced by whichever source measures the image's first page next.
+        
+        Args:
+            image_id (int): ID of the measured image.
+            measurements (List[Tuple]): Rows of (well_index, roi_id, center_x, center_y, area, mean_intensity).
+                well_index starts at 1 and roi_id may be None for wells not assigned to an ROI.
+            source (str): Producer of the rows, one of MEASUREMENT_SOURCES.
+            page (int): Page (channel) of the image that was measured.
+        """
+        if source not in MEASUREMENT_SOURCES:
+            raise ValueError(f"Unknown measurement source: {source}")
+        with sqlite3.connect(self.db_path) as conn:
+            self._ensure_measurements_table(conn)
+            conn.execute(
+                "DELETE FROM measurements WHERE image_id = ? AND (source = ? OR source IS NULL) AND COALESCE(page, 0) = ?",
+                (image_id, source, page)
+            )
+            conn.executemany(
+                """
+                INSERT INTO measurements (image_id, source, page, well_index, roi_id, center_x, center_y, area, mean_intensity)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [(image_id, source, page, *row) for row in measurements]
+            )
+            conn.commit()
+
+    def count_measurements(self) -> int:
+        """Returns the number of stored measurements."""
+        with sqlite3.connect(self.db_path) as conn:
+            self._ensure_measurements_table(conn)
+            return conn.execute("SELECT COUNT(*) FROM measurements").fetchone()[0]
+
+    def iter_measurements(self, chunk_size: int = 50000) -> Iterator[Tuple[List[str], List[Tuple]]]:
+        """Streams all measurements joined with their image path and drug name, one chunk at a time.
+        
+        Only one chunk of rows is held in memory at once, regardless of the table size.
+        
+        Args:
+            chunk_size (int): Number of rows fetched per chunk.
+        
+        Yields:
+            Tuple[List[str], List[Tuple]]: The column names and a chunk of rows.
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            self._ensure_measurements_table(conn)
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT images.image_path, measurements.source, COALESCE(measurements.page, 0) AS page, measurements.well_index, measurements.roi_id, roi_table.drug_name,
+                       measurements.center_x, measurements.center_y, measurements.area, measurements.mean_intensity
+                FROM measurements
+                JOIN images ON images.image_id = measurements.image_id
+                LEFT JOIN roi_table ON roi_table.roi_id = measurements.roi_id
+                ORDER BY measurements.measurement_id
+            """)
+            columns = [description[0] for description in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield columns, rows
+
+    def _ensure_measurements_table(self, conn: sqlite3.Connection) -> None:
+        """Creates the measurements table if it does not exist and adds the source and page columns to older ones.
+        
+        Args:
+            conn (sqlite3.Connection): Active SQLite connection object.
+        """
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS measurements (
+                measurement_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                image_id INTEGER REFERENCES images(image_id),
+                source TEXT,
+                page INTEGER,
+                well_index INTEGER,
+                roi_id INTEGER REFERENCES roi_table(roi_id),
+                center_x REAL,
+                center_y REAL,
+                area REAL,
+                mean_intensity REAL
+            )
+        """)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(measurements)")]
+        if "source" not in columns:
+            conn.execute("ALTER TABLE measurements ADD COLUMN source TEXT")
+        if "page" not in columns:
+            # Older rows were all measured on the first page
+            conn.execute("ALTER TABLE measurements ADD COLUMN page INTEGER")
+        conn.execute("CREATE INDEX IF NOT EXISTS measurements_image ON measurements (image_id)")
+
+    def get_image_records(self) -> List[Dict]:
+        """Retrieves every image with the header metadata captured when the folder was scanned.
+        
+        Returns:
+            List[Dict]: One dict per image with image_id, image_path and the IMAGE_COLUMNS fields.
+        """
+        columns = ["image_id", "image_path"] + IMAGE_COLUMNS
+        with sqlite3.connect(self.db_path) as conn:
+            self._ensure_image_columns(conn)
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {', '.join(columns)} FROM images ORDER BY image_id")
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def get_roi_records(self) -> List[Tuple[int, str, dict, Optional[str], Optional[float]]]:
+        """Retrieves every ROI with its parsed points.
+        
+        Returns:
+            List[Tuple[int, str, dict, Optional[str], Optional[float]]]: (roi_id, drug_name, roi, well, concentration)
+                tuples ordered by ID.
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            self._ensure_roi_columns(conn)
+            cursor = conn.cursor()
+            cursor.execute("SELECT roi_id, drug_name, roi_points, well, concentration FROM roi_table ORDER BY roi_id")
+            return [
+                (roi_id, drug_name, parse_roi_points(roi_points), well, concentration)
+                for roi_id, drug_name, roi_points, well, concentration in cursor.fetchall()
+            ]
+
+    def set_metadata(self, **values: str) -> None:
+        """Stores project level key/value metadata such as the project name and view state.
+        
+        Args:
+            **values (str): Keys and values to store. Values are stored as text.
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            self._ensure_metadata_table(conn)
+            conn.executemany(
+                "INSERT OR REPLACE INTO project_metadata (key, value) VALUES (?, ?)",
+                [(key, str(value)) for key, value in values.items()]
+            )
+            conn.commit()
+
+    def get_metadata(self) -> Dict[str, str]:
+        """Retrieves all project level metadata.
+        
+        Returns:
+            Dict[str, str]: The stored keys and values, empty if the project has none.
+        """
+        if not os.path.exists(self.db_path):
+            return {}
+        with sqlite3.connect(self.db_path) as conn:
+            self._ensure_metadata_table(conn)
+            return dict(conn.execute("SELECT key, value FROM project_metadata").fetchall())
+
+    def migrate_legacy_project(self, json_path: str) -> Dict[str, str]:
+        """Moves the project name and folder of an older project from its JSON file into the metadata table.
+        
+        Older versions kept them in a project_data.json file next to the database. The file is read
+        only while the metadata table has no project name, so it is read once per project.
+        
+        Args:
+            json_path (str): Path of the legacy project_data.json file.
+        
+        Returns:
+            Dict[str, str]: The project metadata after the migration, unchanged if there was nothing to migrate.
+        """
+        metadata = self.get_metadata()
+        if "project_name" in metadata or not os.path.exists(self.db_path):
+            return metadata
+        try:
+            with open(json_path, "r") as file:
+                project_data = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return metadata
+        legacy = {key: project_data[key] for key in ("folder_path", "project_name") if project_data.get(key)}
+        if "project_name" not in legacy:
+            return metadata
+        self.set_metadata(**legacy)
+        return self.get_metadata()
+
+    def _ensure_metadata_table(self, conn: sqlite3.Connection) -> None:
+        """Creates the project_metadata table if it does not exist.
+        
+        Args:
+            conn (sqlite3.Connection): Active SQLite connection object.
+        """
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS project_metadata (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+
+    def _ensure_image_columns(self, conn: sqlite3.Connection) -> None:
+        """Adds image metadata columns missing in databases created by older versions.
+        
+        Args:
+            conn (sqlite3.Connection): Active SQLite connection object.
+        """
+        types = {"width": "INTEGER", "height": "INTEGER", "mode": "TEXT", "format": "TEXT", "n_pages": "INTEGER"}
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(images)")]
+        for column in IMAGE_COLUMNS:
+            if column not in columns:
+                conn.execute(f"ALTER TABLE images ADD COLUMN {column} {types[column]}")
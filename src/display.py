@@ -0,0 +1,184 @@
+from typing import Optional, Tuple
+from collections import OrderedDict
+from PIL import Image
+import numpy as np
+import cv2
+from memory import memory
+
+# Colormaps available for single channel images
+COLORMAPS = {
+    "gray": None,
+    "hot": cv2.COLORMAP_HOT,
+    "inferno": cv2.COLORMAP_INFERNO,
+    "magma": cv2.COLORMAP_MAGMA,
+    "viridis": cv2.COLORMAP_VIRIDIS,
+}
+
+def bit_depth(img: Image.Image) -> int:
+    """Return the number of bits per sample used for display of the given PIL image mode."""
+    if img.mode in ("1", "L", "P", "RGB", "RGBA", "LA", "CMYK", "YCbCr"):
+        return 8
+    return 16
+
+def effective_bit_depth(max_value: float, depth: int) -> int:
+    """Return the bits the data actually uses, e.g. 12 for 12-bit camera data stored in 16-bit images.
+
+    Args:
+        max_value (float): Largest sample of the data.
+        depth (int): Bits per sample of the storage format.
+
+    Returns:
+        int: Between 8 and depth.
+    """
+    return min(depth, max(8, int(max_value).bit_length()))
+
+def to_display_array(img: Image.Image) -> np.ndarray:
+    """Return the pixel data as uint8 or uint16 without rescaling, so it can index a LUT."""
+    if img.mode in ("1", "P", "CMYK", "YCbCr", "LA"):
+        img = img.convert("RGB")
+    arr = np.asarray(img)
+    if img.mode == "RGBA":
+        arr = arr[..., :3]
+    if arr.dtype == np.uint8 or arr.dtype == np.uint16:
+        return arr
+    # 32-bit integer and float images are shown through the 16-bit range
+    return np.clip(arr, 0, 65535).astype(np.uint16)
+
+def build_lut(depth: int, low: float, high: float, gamma: float = 1.0, colormap: str = "gray") -> np.ndarray:
+    """Build a lookup table mapping raw sample values to display values.
+
+    Args:
+        depth (int): Bits per sample of the raw data (8 or 16).
+        low (float): Raw value shown as black.
+        high (float): Raw value shown as white.
+        gamma (float): Gamma applied to the windowed values.
+        colormap (str): Name of a colormap in COLORMAPS.
+
+    Returns:
+        np.ndarray: A (2**depth,) uint8 table, or (2**depth, 3) for colormaps other than gray.
+    """
+    values = np.arange(2 ** depth, dtype=np.float32)
+    scaled = np.clip((values - low) / max(high - low, 1e-6), 0.0, 1.0)
+    if gamma != 1.0:
+        scaled = scaled ** (1.0 / gamma)
+    lut = np.round(scaled * 255).astype(np.uint8)
+    if COLORMAPS.get(colormap) is not None:
+        ramp = np.arange(256, dtype=np.uint8).reshape(-1, 1)
+        palette = cv2.applyColorMap(ramp, COLORMAPS[colormap]).reshape(256, 3)[:, ::-1]
+        lut = palette[lut]
+    return lut
+
+
+class DisplayMapper:
+    '''
+    Maps raw image data to 8-bit display data with window/level, gamma and colormap.
+
+    The source image is never modified; the mapping is applied with a lookup table to
+    the already transformed viewport only. LUTs are cached per setting, so switching
+    between recently used settings (e.g. while dragging a slider) costs a single
+    table lookup per visible pixel.
+    '''
+    def __init__(self, max_luts: int = 32):
+        self.window: Optional[Tuple[float, float]] = None
+        # Largest value of the effective bit depth, shown as white while no window is set
+        self.data_max: Optional[int] = None
+        self.gamma = 1.0
+        self.colormap = "gray"
+        self.max_luts = max_luts
+        self._luts: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        memory.register("display_luts", self)
+
+    def set_window(self, low: float, high: float) -> None:
+        '''
+        Set the raw values shown as black and white.
+        '''
+        self.window = (float(low), float(high))
+
+    def set_data_range(self, img: Image.Image, max_value: Optional[float] = None) -> None:
+        '''
+        Take the range shown while no window is set from the effective bit depth of an image.
+
+        The depth follows from max_value, normally the "max" of the precomputed image
+        statistics, so 12-bit data in 16-bit images fills the display instead of showing
+        nearly black. Only when no statistics exist (images outside the project, pages other
+        than the first) is the image's own maximum read, which scans every pixel.
+        '''
+        depth = bit_depth(img)
+        if depth == 8:
+            self.data_max = None
+            return
+        if max_value is None:
+            extrema = img.getextrema()
+            max_value = max(high for _, high in extrema) if isinstance(extrema[0], tuple) else extrema[1]
+        self.data_max = 2 ** effective_bit_depth(max_value, depth) - 1
+
+    def full_range(self, depth: int) -> Tuple[float, float]:
+        '''
+        Return the raw values shown as black and white while no window is set.
+        '''
+        if depth > 8 and self.data_max is not None:
+            return 0.0, float(self.data_max)
+        return 0.0, float(2 ** depth - 1)
+
+    def reset(self) -> None:
+        '''
+        Reset to the full range of the data.
+        '''
+        self.window = None
+        self.gamma = 1.0
+        self.colormap = "gray"
+
+    def is_identity(self, depth: int, colormap: str) -> bool:
+        '''
+        True if the current settings leave 8-bit data unchanged.
+        '''
+        return (
+            depth == 8
+            and self.window in (None, (0.0, 255.0))
+            and self.gamma == 1.0
+            and COLORMAPS.get(colormap) is None
+        )
+
+    def lut(self, depth: int, colormap: Optional[str] = None) -> np.ndarray:
+        '''
+        Return the cached LUT for the current settings and bit depth.
+        '''
+        colormap = colormap or self.colormap
+        low, high = self.window if self.window is not None else self.full_range(depth)
+        key = (depth, low, high, self.gamma, colormap)
+        lut = self._luts.get(key)
+        if lut is None:
+            lut = build_lut(depth, low, high, self.gamma, colormap)
+            self._luts[key] = lut
+            if len(self._luts) > self.max_luts:
+                self._luts.popitem(last=False)
+        else:
+            self._luts.move_to_end(key)
+        return lut
+
+    def nbytes(self) -> int:
+        return sum(lut.nbytes for lut in list(self._luts.values()))
+
+    def trim(self, max_bytes: int) -> int:
+        '''
+        Drop the least recently used LUTs until at most max_bytes are held.
+        '''
+        before = held = self.nbytes()
+        while held > max_bytes and self._luts:
+            _, lut = self._luts.popitem(last=False)
+            held -= lut.nbytes
+        return before - held
+
+    def render(self, img: Image.Image) -> Image.Image:
+        '''
+        Map a (viewport sized) image to an 8-bit image suitable for ImageTk.PhotoImage.
+        '''
+        depth = bit_depth(img)
+        # Colormaps only apply to single channel data
+        colormap = self.colormap if img.mode not in ("RGB", "RGBA") else "gray"
+        if self.is_identity(depth, colormap):
+            return img
+        arr = to_display_array(img)
+        if arr.ndim == 3:
+            colormap = "gray"
+        return Image.fromarray(self.lut(depth, colormap)[arr])
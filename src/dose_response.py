@@ -0,0 +1,267 @@
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import numpy as np
+
+def logistic4(log_conc: np.ndarray, params: np.ndarray) -> np.ndarray:
+    """Evaluate four parameter logistic curves.
+
+    Args:
+        log_conc (np.ndarray): (D, N) log10 concentrations.
+        params (np.ndarray): (D, 4) bottom, top, log10 EC50 and Hill slope per curve.
+
+    Returns:
+        np.ndarray: (D, N) responses.
+    """
+    bottom, top, log_ec50, hill = (params[:, i:i + 1] for i in range(4))
+    return bottom + (top - bottom) / (1.0 + 10.0 ** ((log_ec50 - log_conc) * hill))
+
+def _jacobian(log_conc: np.ndarray, params: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Return the model values (D, N) and their derivatives with respect to the parameters (D, N, 4).
+    '''
+    bottom, top, log_ec50, hill = (params[:, i:i + 1] for i in range(4))
+    # Clip the exponent so flat or extreme curves cannot overflow
+    exponent = np.clip((log_ec50 - log_conc) * hill, -30.0, 30.0)
+    power = 10.0 ** exponent
+    denominator = 1.0 + power
+    span = top - bottom
+    model = bottom + span / denominator
+
+    # d/d(exponent) of span / (1 + 10**exponent)
+    d_exponent = -span * power * np.log(10.0) / denominator ** 2
+    jacobian = np.empty(log_conc.shape + (4,))
+    jacobian[..., 0] = 1.0 - 1.0 / denominator
+    jacobian[..., 1] = 1.0 / denominator
+    jacobian[..., 2] = d_exponent * hill
+    jacobian[..., 3] = d_exponent * (log_ec50 - log_conc)
+    return model, jacobian
+
+def _initial_params(log_conc: np.ndarray, response: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    '''
+    Starting guesses per curve: plateaus from the lowest and highest dose, EC50 at the middle dose.
+    '''
+    valid = weights > 0
+    n = valid.sum(axis=1)
+    rows = np.arange(len(log_conc))
+    # Points are sorted by concentration with padding at the end of each row
+    low = response[:, 0]
+    high = response[rows, n - 1]
+    params = np.empty((len(log_conc), 4))
+    params[:, 0] = low
+    params[:, 1] = high
+    params[:, 2] = (log_conc[:, 0] + log_conc[rows, n - 1]) / 2
+    params[:, 3] = 1.0
+    return params
+
+def fit_logistic4_batch(
+    log_conc: np.ndarray,
+    response: np.ndarray,
+    weights: np.ndarray,
+    max_iter: int = 200,
+    tol: float = 1e-10,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Fit many four parameter logistic curves at once with a batched Levenberg-Marquardt solver.
+
+    Every iteration solves all D normal equation systems together with one batched
+    np.linalg.solve call, with a damping factor per curve, so the cost is a handful of
+    array operations per iteration regardless of the number of curves.
+
+    Args:
+        log_conc (np.ndarray): (D, N) log10 concentrations sorted ascending per row, padded at the end.
+        response (np.ndarray): (D, N) responses.
+        weights (np.ndarray): (D, N) least squares weights, 0 for padding.
+        max_iter (int): Maximum number of iterations.
+        tol (float): Relative cost improvement below which a curve is considered converged.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (D, 4) parameters and (D,) weighted residual sums of squares.
+    """
+    params = _initial_params(log_conc, response, weights)
+    damping = np.full(len(params), 1e-3)
+    model, jacobian = _jacobian(log_conc, params)
+    cost = np.sum(weights * (response - model) ** 2, axis=1)
+    active = np.ones(len(params), dtype=bool)
+    identity = np.eye(4)
+
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        residual = weights * (response - model)
+        jtj = np.einsum("dni,dnj->dij", jacobian * weights[..., None], jacobian)
+        jtr = np.einsum("dni,dn->di", jacobian, residual)
+        diagonal = np.einsum("dii->di", jtj)[:, :, None] * identity
+        system = jtj + damping[:, None, None] * (diagonal + 1e-12 * identity)
+        try:
+            step = np.linalg.solve(system, jtr[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            # A singular system anywhere in the batch, e.g. a perfectly flat curve
+            step = (np.linalg.pinv(system) @ jtr[..., None])[..., 0]
+        step[~active] = 0.0
+
+        candidate = params + step
+        candidate_model, candidate_jacobian = _jacobian(log_conc, candidate)
+        candidate_cost = np.sum(weights * (response - candidate_model) ** 2, axis=1)
+        improved = active & np.isfinite(candidate_cost) & (candidate_cost < cost)
+
+        converged = improved & (cost - candidate_cost <= tol * np.maximum(cost, 1e-300))
+        params[improved] = candidate[improved]
+        model[improved] = candidate_model[improved]
+        jacobian[improved] = candidate_jacobian[improved]
+        cost[improved] = candidate_cost[improved]
+        damping = np.where(improved, damping / 10.0, damping * 10.0)
+        # A curve stops once its steps no longer help or the damping has blown up
+        active &= ~converged & (damping < 1e12)
+
+    return params, cost
+
+def group_dose_response(drugs: List[str], concentrations: np.ndarray, responses: np.ndarray) -> Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Average replicate measurements per drug and concentration.
+
+    Measurements without a positive concentration cannot be placed on the log axis and are skipped.
+
+    Args:
+        drugs (List[str]): Drug name per measurement.
+        concentrations (np.ndarray): Concentration per measurement.
+        responses (np.ndarray): Response (e.g. mean intensity) per measurement.
+
+    Returns:
+        Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]: Per drug the sorted unique
+        concentrations, the mean response and the replicate count per concentration.
+    """
+    drugs = np.asarray(drugs, dtype=object)
+    concentrations = np.asarray(concentrations, dtype=np.float64)
+    responses = np.asarray(responses, dtype=np.float64)
+    keep = np.isfinite(concentrations) & (concentrations > 0) & np.isfinite(responses)
+    drugs, concentrations, responses = drugs[keep], concentrations[keep], responses[keep]
+    if len(drugs) == 0:
+        return {}
+
+    names, drug_codes = np.unique(drugs.astype(str), return_inverse=True)
+    order = np.lexsort((concentrations, drug_codes))
+    drug_codes, concentrations, responses = drug_codes[order], concentrations[order], responses[order]
+    # One group per (drug, concentration) pair, in sorted order
+    starts = np.flatnonzero(np.r_[True, (np.diff(drug_codes) != 0) | (np.diff(concentrations) != 0)])
+    counts = np.diff(np.r_[starts, len(drug_codes)])
+    means = np.add.reduceat(responses, starts) / counts
+    group_drugs = drug_codes[starts]
+    group_concentrations = concentrations[starts]
+
+    # Every drug has at least one group, so the drug boundaries split the groups by drug
+    boundaries = np.flatnonzero(np.diff(group_drugs)) + 1
+    return {
+        str(name): group
+        for name, group in zip(names, zip(
+            np.split(group_concentrations, boundaries),
+            np.split(means, boundaries),
+            np.split(counts, boundaries),
+        ))
+    }
+
+def fit_groups(groups: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]) -> Dict[str, Optional[Dict]]:
+    """Fit every drug's grouped dose-response data in one batch.
+
+    Args:
+        groups (Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]): Output of group_dose_response.
+
+    Returns:
+        Dict[str, Optional[Dict]]: Per drug a dict with bottom, top, ec50, hill, r2 and n,
+        or None for drugs with fewer than four concentrations.
+    """
+    fits: Dict[str, Optional[Dict]] = {name: None for name in groups}
+    names = [name for name, (conc, _, _) in groups.items() if len(conc) >= 4]
+    if not names:
+        return fits
+
+    # Pad every drug to the same number of points; padding has zero weight
+    width = max(len(groups[name][0]) for name in names)
+    log_conc = np.zeros((len(names), width))
+    response = np.zeros((len(names), width))
+    weights = np.zeros((len(names), width))
+    for row, name in enumerate(names):
+        conc, mean, count = groups[name]
+        n = len(conc)
+        log_conc[row, :n] = np.log10(conc)
+        response[row, :n] = mean
+        weights[row, :n] = count
+        # Repeat the last point so padded columns stay on a sensible x range
+        log_conc[row, n:] = log_conc[row, n - 1]
+        response[row, n:] = mean[-1]
+
+    params, cost = fit_logistic4_batch(log_conc, response, weights)
+
+    mean_response = np.sum(weights * response, axis=1) / np.sum(weights, axis=1)
+    total = np.sum(weights * (response - mean_response[:, None]) ** 2, axis=1)
+    r2 = np.where(total > 0, 1.0 - cost / np.where(total > 0, total, 1.0), np.nan)
+    for row, name in enumerate(names):
+        bottom, top, log_ec50, hill = params[row]
+        fits[name] = {
+            "bottom": float(bottom),
+            "top": float(top),
+            "ec50": float(10.0 ** log_ec50),
+            "hill": float(hill),
+            "r2": float(r2[row]),
+            "n": int(weights[row].sum()),
+        }
+    return fits
+
+def _digest(group: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> str:
+    digest = hashlib.sha1()
+    for array in group:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+class DoseResponseCache:
+    '''
+    Keeps the curve fit of every drug until the drug's grouped data changes.
+
+    Fits are keyed on a digest of each drug's concentrations, mean responses and
+    replicate counts, so editing one ROI or re-measuring one image only refits the
+    drugs whose data actually changed, and all of those are refitted in one batch.
+    '''
+    def __init__(self):
+        self._fits: Dict[str, Tuple[str, Optional[Dict]]] = {}
+
+    def fits(self, groups: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]) -> Dict[str, Optional[Dict]]:
+        '''
+        Return the fit of every drug in groups, fitting only the ones that are new or changed.
+        '''
+        digests = {name: _digest(group) for name, group in groups.items()}
+        stale = {
+            name: group for name, group in groups.items()
+            if name not in self._fits or self._fits[name][0] != digests[name]
+        }
+        for name, fit in fit_groups(stale).items():
+            self._fits[name] = (digests[name], fit)
+        # Forget drugs that no longer exist
+        for name in list(self._fits):
+            if name not in groups:
+                del self._fits[name]
+        return {name: self._fits[name][1] for name in groups}
+
+    def clear(self) -> None:
+        self._fits.clear()
+
+
+def fit_project(token, progress, db_manager, cache: DoseResponseCache, source: str = "roi_masks", page: int = 0) -> Dict[str, Optional[Dict]]:
+    """Scheduler job fitting the dose-response curves of every drug in the project.
+
+    Args:
+        token (CancelToken): Cancellation token of the job.
+        progress (Callable[[int, int], None]): Progress callback of the job.
+        db_manager (DatabaseManager): The project database.
+        cache (DoseResponseCache): Fits kept between runs.
+        source (str): Measurements to fit, "roi_masks" for whole ROI means or "roi_wells"
+            for the wells segmented inside the ROIs.
+        page (int): Page (channel) the measurements were made on.
+
+    Returns:
+        Dict[str, Optional[Dict]]: The fit per drug, see fit_groups.
+    """
+    drugs, concentrations, responses = db_manager.get_dose_response_data(source, page)
+    progress(0, 1)
+    groups = group_dose_response(drugs, concentrations, responses)
+    token.raise_if_cancelled()
+    fits = cache.fits(groups)
+    progress(1, 1)
+    return fits
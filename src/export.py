@@ -0,0 +1,109 @@
+from typing import Callable, Optional
+import argparse
+import csv
+from db_manager import DatabaseManager
+
+# Rows fetched from SQLite and written per chunk (and per Parquet row group)
+DEFAULT_CHUNK_SIZE = 50000
+
+def export_measurements(
+    db_manager: DatabaseManager,
+    path: str,
+    file_format: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    progress: Optional[Callable[[int, int], None]] = None,
+    cancelled: Optional[Callable[[], bool]] = None,
+) -> int:
+    """Stream all measurements from the project database to a CSV or Parquet file.
+
+    Rows are read with a chunked cursor and written chunk by chunk, so memory use is
+    bounded by the chunk size rather than the number of measurements.
+
+    Args:
+        db_manager (DatabaseManager): The project database.
+        path (str): Output file path.
+        file_format (Optional[str]): "csv" or "parquet". Inferred from the file extension if None.
+        chunk_size (int): Number of rows per chunk (and Parquet row group).
+        progress (Optional[Callable[[int, int], None]]): Called with (rows written, total rows) after each chunk.
+        cancelled (Optional[Callable[[], bool]]): Polled between chunks; return True to stop early.
+
+    Returns:
+        int: The number of rows written.
+    """
+    if file_format is None:
+        file_format = "parquet" if path.lower().endswith((".parquet", ".pq")) else "csv"
+    total = db_manager.count_measurements()
+    chunks = db_manager.iter_measurements(chunk_size)
+
+    if file_format == "csv":
+        return _write_csv(path, chunks, total, progress, cancelled)
+    if file_format == "parquet":
+        return _write_parquet(path, chunks, total, progress, cancelled)
+    raise ValueError(f"Unsupported export format: {file_format}")
+
+def _write_csv(path, chunks, total, progress, cancelled) -> int:
+    written = 0
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        header_written = False
+        for columns, rows in chunks:
+            if cancelled is not None and cancelled():
+                break
+            if not header_written:
+                writer.writerow(columns)
+                header_written = True
+            writer.writerows(rows)
+            written += len(rows)
+            if progress is not None:
+                progress(written, total)
+    return written
+
+def _write_parquet(path, chunks, total, progress, cancelled) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    schema = pa.schema([
+        ("image_path", pa.string()),
+        ("source", pa.string()),
+        ("page", pa.int64()),
+        ("well_index", pa.int64()),
+        ("roi_id", pa.int64()),
+        ("drug_name", pa.string()),
+        ("center_x", pa.float64()),
+        ("center_y", pa.float64()),
+        ("area", pa.float64()),
+        ("mean_intensity", pa.float64()),
+    ])
+    written = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for columns, rows in chunks:
+            if cancelled is not None and cancelled():
+                break
+            # Each chunk becomes one row group
+            table = pa.Table.from_arrays(
+                [pa.array(values, type=schema.field(name).type) for name, values in zip(columns, zip(*rows))],
+                schema=schema,
+            )
+            writer.write_table(table)
+            written += len(rows)
+            if progress is not None:
+                progress(written, total)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export FLORO measurements to CSV or Parquet.")
+    parser.add_argument("output", help="Output file (.csv or .parquet)")
+    parser.add_argument("--db", default=None, help="Project database (defaults to project.sqlite3 next to this script)")
+    parser.add_argument("--format", choices=["csv", "parquet"], default=None, help="Output format (inferred from the extension by default)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per chunk / row group")
+    args = parser.parse_args()
+
+    def print_progress(written, total):
+        print(f"\rExported {written}/{total} rows", end="", flush=True)
+
+    count = export_measurements(DatabaseManager(args.db), args.output, args.format, args.chunk_size, print_progress)
+    print(f"\nWrote {count} rows to {args.output}")
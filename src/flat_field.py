@@ -0,0 +1,224 @@
+from typing import Callable, List, Optional, Tuple
+import os
+import threading
+import numpy as np
+import cv2
+from multipage import read_page
+from memory import memory, LOCKED_SUBSYSTEMS
+
+# Size of the longest side of the frames the background model is estimated from
+MODEL_SIZE = 256
+
+def apply_gain(img: np.ndarray, gain: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Multiply an image by a per-pixel gain, keeping its dtype.
+
+    Integer images are rounded and saturated to their dtype's range. Colour images
+    share one gain for all channels.
+
+    Args:
+        img (np.ndarray): Grayscale (H, W) or colour (H, W, C) image.
+        gain (np.ndarray): (H, W) gain.
+        out (Optional[np.ndarray]): Output array, may be img itself for in-place correction.
+
+    Returns:
+        np.ndarray: The corrected image.
+    """
+    if img.ndim == 3:
+        gain = gain[..., None]
+    corrected = np.multiply(img, gain, dtype=np.float32)
+    if np.issubdtype(img.dtype, np.integer):
+        info = np.iinfo(img.dtype)
+        np.rint(corrected, out=corrected)
+        np.clip(corrected, info.min, info.max, out=corrected)
+    if out is None:
+        return corrected.astype(img.dtype)
+    out[...] = corrected
+    return out
+
+def _to_model_frame(arr: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    '''
+    Average colour channels and downsample a frame to the model size.
+    '''
+    if arr.ndim == 3:
+        arr = arr[..., :3].mean(axis=2, dtype=np.float32)
+    return cv2.resize(arr.astype(np.float32), size, interpolation=cv2.INTER_AREA)
+
+def estimate_flat_field(
+    paths: List[str],
+    output_path: str,
+    percentile: float = 50.0,
+    max_frames: int = 64,
+    strip_height: int = 512,
+    progress: Optional[Callable[[int, int], None]] = None,
+    cancelled: Optional[Callable[[], bool]] = None,
+    page: int = 0,
+) -> Optional[str]:
+    """Estimate a project's flat-field from its images and store the gain as a memory-mappable .npy file.
+
+    Every frame is reduced to a small model frame as it is read, and a reservoir of at
+    most max_frames model frames is kept, so memory does not grow with the number of
+    images. The per-pixel percentile over the reservoir (the median by default) removes
+    the wells themselves and leaves the illumination profile, which is smoothed and
+    turned into a gain normalised to a mean of 1. The full resolution gain is written
+    strip by strip, so it is never held in memory either.
+
+    Only images with the size of the first readable image are used.
+
+    Args:
+        paths (List[str]): Image paths of the project.
+        output_path (str): Path of the .npy file to write.
+        percentile (float): Per-pixel percentile over frames used as background.
+        max_frames (int): Number of model frames kept in the reservoir.
+        strip_height (int): Rows of the full resolution gain written at a time.
+        progress (Optional[Callable[[int, int], None]]): Called with (done, total) after every image.
+        cancelled (Optional[Callable[[], bool]]): Polled between images, returns True to abort.
+        page (int): Page (channel) of the images to estimate the flat-field of.
+
+    Returns:
+        Optional[str]: output_path, or None if cancelled or no image could be read.
+    """
+    rng = np.random.default_rng(0)
+    reservoir = None
+    shape = None
+    seen = 0
+    for done, path in enumerate(paths, start=1):
+        if cancelled is not None and cancelled():
+            return None
+        try:
+            arr = read_page(path, page)
+        except OSError as e:
+            print(f"Could not read {path}: {e}")
+            continue
+        if shape is None:
+            shape = arr.shape[:2]
+            factor = MODEL_SIZE / max(shape)
+            model_size = (max(1, round(shape[1] * factor)), max(1, round(shape[0] * factor)))
+            reservoir = np.empty((max_frames, model_size[1], model_size[0]), dtype=np.float32)
+        if arr.shape[:2] != shape:
+            continue
+
+        # Reservoir sampling keeps a uniform sample of the frames seen so far
+        if seen < max_frames:
+            reservoir[seen] = _to_model_frame(arr, model_size)
+        else:
+            slot = rng.integers(0, seen + 1)
+            if slot < max_frames:
+                reservoir[slot] = _to_model_frame(arr, model_size)
+        seen += 1
+        # Keep the budgets of the caches worker threads may trim between frames
+        memory.enforce(LOCKED_SUBSYSTEMS)
+        if progress is not None:
+            progress(done, len(paths))
+
+    if seen == 0:
+        return None
+
+    background = np.percentile(reservoir[:min(seen, max_frames)], percentile, axis=0).astype(np.float32)
+    sigma = max(background.shape) / 32
+    background = cv2.GaussianBlur(background, (0, 0), sigma, borderType=cv2.BORDER_REFLECT)
+    background = np.maximum(background, max(float(background.mean()) * 1e-3, 1e-6))
+    coarse_gain = (background.mean() / background).astype(np.float32)
+
+    height, width = shape
+    # Written next to the target and swapped in, so a gain that is still memory mapped stays valid
+    temp_path = os.path.splitext(output_path)[0] + ".tmp.npy"
+    gain = np.lib.format.open_memmap(temp_path, mode="w+", dtype=np.float32, shape=(height, width))
+    scale_x = coarse_gain.shape[1] / width
+    scale_y = coarse_gain.shape[0] / height
+    for top in range(0, height, strip_height):
+        rows = min(strip_height, height - top)
+        # Maps full resolution pixel centres of the strip to coarse pixel centres
+        mat = np.array([
+            [scale_x, 0.0, 0.5 * scale_x - 0.5],
+            [0.0, scale_y, (top + 0.5) * scale_y - 0.5],
+        ])
+        gain[top:top + rows] = cv2.warpAffine(
+            coarse_gain, mat, (width, rows),
+            flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+            borderMode=cv2.BORDER_REPLICATE,
+        )
+    gain.flush()
+    del gain
+    os.replace(temp_path, output_path)
+    return output_path
+
+
+class FlatField:
+    '''
+    A project's flat-field gain, memory mapped from disk.
+
+    apply corrects whole frames for analysis. The viewer instead uses apply_viewport,
+    which only corrects the rendered viewport with the gain warped by the same
+    transform; since the gain is smooth, it is warped from a small subsampled copy and
+    reused while the view does not change. The compare view corrects its panes on a thread
+    pool, so the cached viewport gain is guarded by a lock.
+    '''
+    def __init__(self, gain: np.ndarray):
+        self.gain = gain
+        step = max(1, max(gain.shape) // MODEL_SIZE)
+        self._step = step
+        self._coarse = np.ascontiguousarray(gain[::step, ::step], dtype=np.float32)
+        self._viewport_lock = threading.Lock()
+        self._viewport_key = None
+        self._viewport_gain: Optional[np.ndarray] = None
+
+    @classmethod
+    def load(cls, path: str) -> Optional["FlatField"]:
+        '''
+        Memory map a gain written by estimate_flat_field, or return None if there is none.
+        '''
+        if not path or not os.path.exists(path):
+            return None
+        return cls(np.load(path, mmap_mode="r"))
+
+    def matches(self, width: int, height: int) -> bool:
+        return self.gain.shape == (height, width)
+
+    def apply(self, img: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        '''
+        Correct a full frame of the gain's size.
+        '''
+        return apply_gain(img, self.gain, out)
+
+    def region(self, box: Tuple[int, int, int, int], size: Tuple[int, int]) -> np.ndarray:
+        '''
+        Return the gain of an image box resized to size, e.g. for a preview of the visible region.
+        '''
+        left, top, right, bottom = box
+        width, height = size
+        return self._warp(np.array([
+            [width / (right - left), 0.0, -left * width / (right - left)],
+            [0.0, height / (bottom - top), -top * height / (bottom - top)],
+            [0.0, 0.0, 1.0],
+        ]), size)
+
+    def apply_viewport(self, view: np.ndarray, mat_affine: np.ndarray) -> np.ndarray:
+        '''
+        Correct a rendered viewport in place, given the image to canvas transform it was rendered with.
+        '''
+        height, width = view.shape[:2]
+        key = (mat_affine.tobytes(), width, height)
+        with self._viewport_lock:
+            if key != self._viewport_key:
+                self._viewport_gain = self._warp(mat_affine, (width, height))
+                self._viewport_key = key
+            gain = self._viewport_gain
+        return apply_gain(view, gain, out=view)
+
+    def _warp(self, mat_affine: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+        '''
+        Warp the coarse gain by an image to target transform, with the same pixel conventions as ViewportRenderer.
+        '''
+        to_center = np.array([[1.0, 0.0, -0.5], [0.0, 1.0, -0.5], [0.0, 0.0, 1.0]])
+        # Coarse samples sit on every step-th full resolution pixel centre
+        coarse_to_image = np.array([
+            [self._step, 0.0, 0.5],
+            [0.0, self._step, 0.5],
+            [0.0, 0.0, 1.0],
+        ])
+        mat = to_center @ mat_affine @ coarse_to_image
+        return cv2.warpAffine(
+            self._coarse, mat[:2], size,
+            flags=cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_REPLICATE,
+        )
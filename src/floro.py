@@ -2,12 +2,28 @@ import os
 import json
 from tkinter import filedialog
 from PIL import Image
+import numpy as np
 import customtkinter as ctk
 from front_end import FrontEnd
 from db_manager import DatabaseManager
+from image_stats import compute_missing_stats
+from multipage import MultiPageImage
+from export import export_measurements
+from roi_masks import extract_roi_measurements
+from dose_response import DoseResponseCache, fit_project
+from flat_field import FlatField, estimate_flat_field
+from replay import InteractionRecorder
+from pipeline import segment_project, segment_project_rois
+from tracking import track_project
+from memory import memory, format_report
+from watch_folder import WatchFolderIngest
+from scheduler import JobScheduler, CURRENT_IMAGE, BATCH
 
 Image.MAX_IMAGE_PIXELS = None
 
+# Where projects created by older versions stored their name and folder
+LEGACY_PROJECT_FILE = "project_data.json"
+
 class Application(ctk.CTk):
     def __init__(self):
         super().__init__(fg_color="#151518")
@@ -16,11 +32,31 @@ class Application(ctk.CTk):
 
         self.frontend = FrontEnd(self)
         self.db_manager = DatabaseManager()
+        self.scheduler = JobScheduler(self, on_status=self.frontend.update_status)
 
         self.current_view = "roi"
         self.pil_image = None
+        self.stack = None
+        self.image_stats = None
+        self.stats_job = None
+        self.dose_response_job = None
+        self.dose_response_cache = DoseResponseCache()
+        # Measurements the dose-response curves are fitted to, see DatabaseManager.get_dose_response_data
+        self.dose_response_source = "roi_masks"
+        self.images = {}
+        self.watcher = None
+        self.flat_field = None
+        self.flat_field_enabled = True
+        # Treat watched images as a time series and track wells from frame to frame
+        self.tracking_enabled = False
+        # Page (channel) of multi-page images that every analysis job reads, the one last shown on its own
+        self.analysis_page = 0
+        self.recorder = None
+        self.current_image_path = None
 
         self.bind_events()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.load_project()
 
     def configure_root(self):
         self.title("FLORO")
@@ -33,6 +69,8 @@ class Application(ctk.CTk):
     def bind_events(self):
         self.bind_all("<Control-o>", self.menu_open_clicked)
         self.bind_all("<Control-n>", self.frontend.new_project_window)
+        # Only on the image, so Ctrl+A keeps its meaning in entries and tables
+        self.frontend.image_canvas.bind("<Control-a>", self.auto_contrast)
 
     def menu_open_clicked(self, event=None):
         filetypes = [
@@ -52,16 +90,12 @@ class Application(ctk.CTk):
 
     def create_project(self, folder_path, project_name, new_project_window):
         if folder_path and project_name:
-            project_data = {
-                "folder_path": folder_path,
-                "project_name": project_name
-            }
-            with open("project_data.json", "w") as file:
-                json.dump(project_data, file)
             new_project_window.destroy()
             self.db_manager.create_database(folder_path)
+            self.db_manager.set_metadata(folder_path=folder_path, project_name=project_name)
             self.load_project()
             self.display_first_image()
+            self.start_stats_job()
         else:
             self.frontend.show_message("Error", "Please enter a folder path and project name.")
 
@@ -74,35 +108,437 @@ class Application(ctk.CTk):
             self.frontend.show_message("Error", "No images found in the selected folder.")
 
     def load_project(self):
-        try:
-            with open("project_data.json", "r") as file:
-                project_data = json.load(file)
-                project_name = project_data["project_name"]
-                self.frontend.update_project_name(project_name)
-        except FileNotFoundError:
-            pass
+        '''
+        Restore the project name, image list, ROIs and view state from the project database
+        without opening any image file.
+        '''
+        metadata = self.db_manager.get_metadata()
+        if "project_name" not in metadata:
+            # Projects created by older versions keep their name in project_data.json
+            metadata = self.db_manager.migrate_legacy_project(LEGACY_PROJECT_FILE)
+        if "project_name" not in metadata:
+            return
+        self.frontend.update_project_name(metadata["project_name"])
+
+        # The flat-field gain is memory mapped, so loading it does not read the file
+        self.flat_field = FlatField.load(metadata.get("flat_field"))
+        self.set_flat_field_enabled(self.flat_field_enabled)
+        self.configure_memory(metadata)
+
+        self.images = {record["image_path"]: record for record in self.db_manager.get_image_records()}
+
+        roi_records = self.db_manager.get_roi_records()
+        self.frontend.roi_table.delete(*self.frontend.roi_table.get_children())
+        self.frontend.roi_table.insert_rows(
+            (roi_id, drug_name, well or "", "" if concentration is None else f"{concentration:g}")
+            for roi_id, drug_name, _, well, concentration in roi_records
+        )
+        self.frontend.image_canvas.rois = [
+            roi for _, _, roi, _, _ in roi_records if "points" in roi or ("start" in roi and "end" in roi)
+        ]
+
+        # Only the image that was on screen is opened, once the canvas has its size
+        current_image = metadata.get("current_image")
+        if current_image in self.images:
+            canvas = self.frontend.image_canvas
+            if canvas.winfo_ismapped() and canvas.winfo_width() > 1:
+                self.restore_view(current_image, metadata)
+            else:
+                def on_first_configure(event):
+                    canvas.unbind("<Configure>", binding)
+                    self.restore_view(current_image, metadata)
+                binding = canvas.bind("<Configure>", on_first_configure, add="+")
+
+    def configure_memory(self, metadata):
+        '''
+        Apply the project's memory budgets, stored as JSON in MB, e.g. {"budget": 8192, "pages": 2048}.
+        '''
+        if not metadata.get("memory_budgets"):
+            return
+        budgets = {name: int(mb * 2 ** 20) for name, mb in json.loads(metadata["memory_budgets"]).items()}
+        memory.configure(budgets.pop("budget", memory.budget), **budgets)
+        memory.enforce()
+
+    def show_memory_usage(self, event=None):
+        '''
+        Show the bytes held per subsystem against their budgets.
+        '''
+        report = format_report(memory.report())
+        print(report)
+        self.frontend.show_message("Memory Usage", report)
+
+    def restore_view(self, image_path, metadata):
+        '''
+        Show the image that was open when the project was closed, with its saved zoom, pan and contrast.
+        '''
+        self.set_image(image_path)
+        canvas = self.frontend.image_canvas
+        if "view_affine" in metadata:
+            canvas.mat_affine = np.array(json.loads(metadata["view_affine"]))
+        if metadata.get("display_window"):
+            canvas.display.set_window(*json.loads(metadata["display_window"]))
+        canvas._draw_image()
+
+    def save_view_state(self):
+        '''
+        Store the current image, zoom/pan and display window in the project database.
+        '''
+        if self.current_image_path is None or not self.db_manager.get_metadata():
+            return
+        canvas = self.frontend.image_canvas
+        self.db_manager.set_metadata(
+            current_image=self.current_image_path,
+            view_affine=json.dumps(canvas.mat_affine.tolist()),
+            display_window=json.dumps(canvas.display.window) if canvas.display.window else ""
+        )
+
+    def on_close(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        self.frontend.compare_canvas.shutdown()
+        self.save_view_state()
+        self.scheduler.shutdown()
+        self.destroy()
+
+    def start_stats_job(self):
+        '''
+        Precompute histograms and QC statistics of all images in the background.
+        '''
+        if self.stats_job is not None:
+            self.stats_job.cancel()
+        self.stats_job = self.scheduler.submit(
+            "Image statistics", compute_missing_stats, self.db_manager, priority=BATCH
+        )
+
+    def toggle_watch_folder(self, event=None):
+        '''
+        Start or stop ingesting new images written to the project folder.
+        '''
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.after(500, self.report_stopped_watcher, self.watcher)
+            self.watcher = None
+            self.frontend.update_status("Stopping the watch folder, finishing the queued images")
+            return
+
+        folder_path = self.db_manager.get_metadata().get("folder_path")
+        if not folder_path or not os.path.isdir(folder_path):
+            self.frontend.show_message("Error", "Create or open a project to watch its folder.")
+            return
+        self.watcher = WatchFolderIngest(
+            self.db_manager, folder_path, tracking=self.tracking_enabled, scheduler=self.scheduler,
+            page=self.analysis_page
+        )
+        self.watcher.flat_field = self.active_flat_field()
+        self.watcher.start()
+        self.after(500, self.poll_watch_folder, 0)
+
+    def poll_watch_folder(self, registered):
+        '''
+        Show ingestion progress and pick up newly registered images.
+        '''
+        watcher = self.watcher
+        if watcher is None:
+            return
+        if watcher.registered != registered:
+            self.images = {record["image_path"]: record for record in self.db_manager.get_image_records()}
+        self.frontend.update_status(
+            f"Watching folder: {watcher.analysed}/{watcher.registered} analysed, {watcher.pending()} queued"
+        )
+        self.after(500, self.poll_watch_folder, watcher.registered)
+
+    def report_stopped_watcher(self, watcher):
+        '''
+        Show what a stopped watch folder ingested once its queued images are written.
+        '''
+        if self.watcher is not None:
+            return
+        if watcher.is_running():
+            self.after(500, self.report_stopped_watcher, watcher)
+            return
+        status = f"Stopped watching: {watcher.analysed}/{watcher.registered} analysed"
+        if watcher.failed:
+            status += f", {watcher.failed} failed"
+        self.frontend.update_status(status)
+        self.images = {record["image_path"]: record for record in self.db_manager.get_image_records()}
+
+    def export_measurements(self, event=None):
+        '''
+        Stream all measurements to a CSV or Parquet file in a background thread.
+        '''
+        filetypes = [("CSV", ".csv"), ("Parquet", ".parquet")]
+        path = filedialog.asksaveasfilename(filetypes=filetypes, defaultextension=".csv")
+        if not path:
+            return
+
+        def run_export(token, progress):
+            return export_measurements(self.db_manager, path, progress=progress, cancelled=lambda: token.cancelled)
+
+        def export_done(job):
+            if job.state == "done":
+                self.frontend.show_message("Export", f"Exported {job.result} measurements to {path}")
+            elif job.state == "failed":
+                self.frontend.show_message("Error", f"Export failed: {job.error}")
+
+        self.scheduler.submit("Exporting measurements", run_export, priority=BATCH, on_done=export_done)
+
+    def extract_rois(self):
+        '''
+        Measure every ROI on every project image in a background job.
+        '''
+        def extract_done(job):
+            if job.state == "done":
+                self.frontend.show_message("Extract ROIs", f"Measured the ROIs on {job.result} images")
+            elif job.state == "failed":
+                self.frontend.show_message("Error", f"ROI extraction failed: {job.error}")
+
+        self.scheduler.submit(
+            "Extracting ROIs", extract_roi_measurements, self.db_manager, self.active_flat_field(), self.analysis_page,
+            priority=BATCH, on_done=extract_done
+        )
+
+    def segment_rois(self):
+        '''
+        Segment the wells inside the ROIs of every project image in a background job,
+        analysing only the padded ROI regions instead of whole frames.
+        '''
+        def segment_done(job):
+            if job.state == "done":
+                self.frontend.show_message("Segment ROIs", f"Segmented the ROIs on {job.result} images")
+            elif job.state == "failed":
+                self.frontend.show_message("Error", f"ROI segmentation failed: {job.error}")
+
+        self.scheduler.submit(
+            "Segmenting ROIs", segment_project_rois, self.db_manager, self.active_flat_field(), self.analysis_page,
+            priority=BATCH, on_done=segment_done
+        )
+
+    def segment_all_images(self, event=None):
+        '''
+        Segment every project image as a whole frame in worker processes, in a background job.
+        '''
+        def segment_done(job):
+            if job.state == "done":
+                self.frontend.show_message("Segment Images", f"Segmented {job.result} images")
+            elif job.state == "failed":
+                self.frontend.show_message("Error", f"Segmentation failed: {job.error}")
+
+        self.scheduler.submit(
+            "Segmenting images", segment_project, self.db_manager, self.active_flat_field(), None, self.analysis_page,
+            priority=BATCH, on_done=segment_done
+        )
+
+    def track_time_series(self, event=None):
+        '''
+        Segment the project's images as one time-lapse in a background job, keeping well IDs stable across frames.
+        '''
+        def track_done(job):
+            if job.state == "done":
+                self.frontend.show_message("Track Time Series", f"Tracked the wells over {job.result} frames")
+            elif job.state == "failed":
+                self.frontend.show_message("Error", f"Tracking failed: {job.error}")
+
+        self.scheduler.submit(
+            "Tracking wells", track_project, self.db_manager, self.active_flat_field(), None, self.analysis_page,
+            priority=BATCH, on_done=track_done
+        )
+
+    def estimate_flat_field(self, event=None):
+        '''
+        Estimate the project's flat-field from all its images in a background job and start applying it.
+        '''
+        if not self.images:
+            self.frontend.show_message("Error", "Create or open a project to estimate its flat-field.")
+            return
+        paths = list(self.images)
+        page = self.analysis_page
+        output_path = os.path.splitext(self.db_manager.db_path)[0] + "_flat_field.npy"
+
+        def run_estimate(token, progress):
+            return estimate_flat_field(paths, output_path, progress=progress, cancelled=lambda: token.cancelled, page=page)
+
+        def estimate_done(job):
+            if job.state == "done" and job.result:
+                self.db_manager.set_metadata(flat_field=job.result)
+                self.flat_field = FlatField.load(job.result)
+                self.set_flat_field_enabled(True)
+            elif job.state == "failed":
+                self.frontend.show_message("Error", f"Flat-field estimation failed: {job.error}")
+
+        self.scheduler.submit("Estimating flat-field", run_estimate, priority=BATCH, on_done=estimate_done)
+
+    def active_flat_field(self):
+        '''
+        Return the FlatField to apply, or None if there is none or correction is switched off.
+        '''
+        return self.flat_field if self.flat_field_enabled else None
+
+    def set_flat_field_enabled(self, enabled):
+        '''
+        Switch flat-field correction of the viewer, the preview and the watch folder pipeline on or off.
+        '''
+        self.flat_field_enabled = enabled
+        if enabled and self.flat_field is not None:
+            self.frontend.flat_field_switch.select()
+        else:
+            self.frontend.flat_field_switch.deselect()
+        flat_field = self.active_flat_field()
+        self.frontend.image_canvas.set_flat_field(flat_field)
+        self.frontend.compare_canvas.flat_field = flat_field
+        if self.watcher is not None:
+            self.watcher.flat_field = flat_field
+
+    def set_tracking_enabled(self, enabled):
+        '''
+        Switch time series tracking of the watch folder pipeline on or off.
+        '''
+        self.tracking_enabled = enabled
+        if self.watcher is not None:
+            self.watcher.tracking = enabled
+
+    def fit_dose_response(self):
+        '''
+        Fit the dose-response curves of all drugs in a background job and show them in the data view.
+        Fits are cached per drug, so only drugs whose measurements changed are refitted.
+        '''
+        if self.dose_response_job is not None:
+            self.dose_response_job.cancel()
+
+        def fit_done(job):
+            if job.state == "done":
+                self.frontend.update_dose_response(job.result)
+            elif job.state == "failed":
+                self.frontend.show_message("Error", f"Dose-response fit failed: {job.error}")
+
+        self.dose_response_job = self.scheduler.submit(
+            "Fitting dose-response", fit_project, self.db_manager, self.dose_response_cache, self.dose_response_source,
+            self.analysis_page, priority=CURRENT_IMAGE, on_done=fit_done
+        )
+
+    def set_dose_response_source(self, source):
+        '''
+        Fit the dose-response curves to whole ROI means ("roi_masks") or to the wells segmented inside the ROIs ("roi_wells").
+        '''
+        self.dose_response_source = source
+        self.fit_dose_response()
+
+    def toggle_recording(self, event=None):
+        '''
+        Start or stop recording canvas input for replay with replay.py.
+        '''
+        if self.recorder is not None:
+            self.recorder.close()
+            self.frontend.update_status(f"Recorded {self.recorder.count} events to {self.recorder.path}")
+            self.recorder = None
+            return
+        path = filedialog.asksaveasfilename(filetypes=[("Recording", ".jsonl")], defaultextension=".jsonl")
+        if not path:
+            return
+        self.recorder = InteractionRecorder(self.frontend.image_canvas, path, self.current_image_path)
+        self.frontend.update_status("Recording interaction")
+
+    def auto_contrast(self, event=None):
+        '''
+        Set the display window from the precomputed percentiles of the current image.
+        '''
+        if self.image_stats is None:
+            return
+        self.frontend.image_canvas.display.set_window(self.image_stats["p0_5"], self.image_stats["p99_5"])
+        self.frontend.image_canvas._draw_image()
 
     def set_image(self, filename):
         if not filename:
             return
-        self.pil_image = Image.open(filename)
-        self.frontend.image_canvas.set_image(self.pil_image)
+        if self.stack is not None:
+            self.stack.close()
+            self.stack = None
+        self.image_stats = self.db_manager.get_image_stats(filename)
 
-        image_info = f"{self.pil_image.format}: {self.pil_image.width}x{self.pil_image.height} {self.pil_image.mode}"
+        # Multi-page files are decoded lazily, one page at a time
+        # The statistics describe the first page; other pages read their own range
+        max_value = self.image_stats["max"] if self.image_stats is not None else None
+        stack = MultiPageImage(filename)
+        if stack.n_pages > 1:
+            self.stack = stack
+            self.frontend.image_canvas.set_stack(stack, max_value)
+            # Stay on the page being analysed when moving between images
+            page = self.analysis_page if self.analysis_page < stack.n_pages else 0
+            if page:
+                self.frontend.image_canvas.show_page(page)
+            self.pil_image = stack.page(page)
+        else:
+            stack.close()
+            page = 0
+            self.pil_image = Image.open(filename)
+            self.frontend.image_canvas.set_image(self.pil_image, max_value)
+        self.frontend.update_page_menu(stack.n_pages, page)
+        self.current_image_path = filename
+
+        # Prefer the header captured during the project scan, which also knows the page count
+        record = self.images.get(filename)
+        if record is not None and record["width"] is not None:
+            image_info = f"{record['format']}: {record['width']}x{record['height']} {record['mode']}"
+            if record["n_pages"] and record["n_pages"] > 1:
+                image_info += f" ({record['n_pages']} pages)"
+        else:
+            image_info = f"{self.pil_image.format}: {self.pil_image.width}x{self.pil_image.height} {self.pil_image.mode}"
         self.frontend.update_image_info(image_info)
-        os.chdir(os.path.dirname(filename))
+
+    def select_page(self, page):
+        '''
+        Show one page of the current multi-page image, or all of them as a composite.
+
+        A page shown on its own becomes the page analysis jobs and the watch folder read.
+        '''
+        if page == "Composite":
+            self.frontend.image_canvas.show_composite()
+            return
+        self.analysis_page = int(page.split()[-1]) - 1
+        self.pil_image = self.stack.page(self.analysis_page) if self.stack is not None else self.pil_image
+        first_page_max = self.image_stats["max"] if self.image_stats is not None and self.analysis_page == 0 else None
+        self.frontend.image_canvas.show_page(self.analysis_page, first_page_max)
+        if self.watcher is not None:
+            self.watcher.page = self.analysis_page
 
     def switch_view(self, view):
-        if view == "roi" and self.current_view != "roi":
-            self.current_view = "roi"
+        if view == self.current_view:
+            return
+        self.current_view = view
+        self.frontend.canvas_view_frame.grid_forget()
+        self.frontend.data_view_frame.grid_forget()
+        self.frontend.compare_view_frame.grid_forget()
+        if view == "roi":
             self.frontend.canvas_view_frame.grid(row=0, column=1, sticky="nsew")
             self.frontend.setup_roi_selector()
-            self.frontend.switch_view_buttons("roi")
-        elif view == "data" and self.current_view != "data":
-            self.current_view = "data"
-            self.frontend.canvas_view_frame.grid_forget()
+        elif view == "data":
             self.frontend.setup_data_view()
-            self.frontend.switch_view_buttons("data")
+            if self.images:
+                self.fit_dose_response()
+        elif view == "compare":
+            self.frontend.setup_compare_view()
+        self.frontend.switch_view_buttons(view)
+
+    def compare_images(self, event=None):
+        '''
+        Pick several images and show them side by side with the project's ROIs, sharing one viewport.
+        '''
+        initial_dir = self.db_manager.get_metadata().get("folder_path") if self.images else None
+        filetypes = [("Image file", ".bmp .png .jpg .tif .tiff")]
+        paths = filedialog.askopenfilenames(filetypes=filetypes, initialdir=initial_dir)
+        if not paths:
+            return
+        self.switch_view("compare")
+        compare_canvas = self.frontend.compare_canvas
+        compare_canvas.rois = self.frontend.image_canvas.rois
+        compare_canvas.flat_field = self.active_flat_field()
+        max_values = []
+        for path in paths:
+            stats = self.db_manager.get_image_stats(path) if self.images else None
+            max_values.append(stats["max"] if stats is not None else None)
+        # Wait for the frame to be laid out so the panes get their real size
+        self.after(50, compare_canvas.set_images, list(paths), max_values)
 
     def add_roi(self, roi_points):
         '''
@@ -114,18 +550,41 @@ class Application(ctk.CTk):
             # Assign anonymous drug name for initialization
             drug_name = "Drug X"
             # Save the ROI data to the database
-            roi_id = self.db_manager.save_roi(drug_name, str(roi_points))
+            roi_id = self.db_manager.save_roi(drug_name, roi_points)
             # Insert the ROI data into the table
-            self.frontend.roi_table.insert(parent="", index="end", values=(roi_id, drug_name))
+            self.frontend.roi_table.insert(parent="", index="end", values=(roi_id, drug_name, "", ""))
         else:
             print("No ROI points provided.")
 
+    def add_rois(self, rois):
+        '''
+        Save many ROIs (e.g. a generated plate layout) in one transaction and add them to the ROI table in bulk.
+        '''
+        if not rois:
+            return
+        drug_name = "Drug X"
+        roi_ids = self.db_manager.save_rois(drug_name, rois)
+        self.frontend.roi_table.insert_rows(
+            (roi_id, drug_name, roi.get("well", ""), "") for roi_id, roi in zip(roi_ids, rois)
+        )
+
     def update_drug_name(self, roi_id, new_drug_name):
         '''
         Update the drug name in the database.
         '''
         self.db_manager.update_drug_name(roi_id, new_drug_name)
 
+    def update_concentration(self, roi_id, value):
+        '''
+        Update the drug concentration of an ROI in the database. An empty value clears it.
+        '''
+        try:
+            concentration = float(value) if value.strip() else None
+        except ValueError:
+            self.frontend.show_message("Error", f"Invalid concentration: {value}")
+            return
+        self.db_manager.update_concentration(roi_id, concentration)
+
     def delete_roi(self, roi_points):
         """
         Delete the ROI data from the database and update the table.
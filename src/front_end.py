@@ -2,6 +2,7 @@ import customtkinter as ctk
 from PIL import Image
 from custom_treeview import CustomTreeview
 from image_canvas import ImageCanvas
+from compare_view import CompareCanvas
 from CTkMessagebox import CTkMessagebox
 from CTkMenuBar import *
 import os
@@ -21,6 +22,8 @@ class FrontEnd:
         self.create_status_bar()
         self.setup_sidebar()
         self.create_canvas_view()
+        self.create_data_view()
+        self.create_compare_view()
         self.root.bind("<BackSpace>", self.image_canvas._delete_selected_roi)
 
     def create_menu(self):
@@ -32,8 +35,16 @@ class FrontEnd:
         file_dropdown.add_option(option="Open", command=self.root.menu_open_clicked)
         file_dropdown.add_separator()
         file_dropdown.add_option(option="New Project", command=self.new_project_window)
+        file_dropdown.add_option(option="Watch Folder", command=self.root.toggle_watch_folder)
+        file_dropdown.add_option(option="Compare Images", command=self.root.compare_images)
+        file_dropdown.add_option(option="Segment Images", command=self.root.segment_all_images)
+        file_dropdown.add_option(option="Track Time Series", command=self.root.track_time_series)
+        file_dropdown.add_option(option="Export Measurements", command=self.root.export_measurements)
+        file_dropdown.add_option(option="Estimate Flat Field", command=self.root.estimate_flat_field)
+        file_dropdown.add_option(option="Record Interaction", command=self.root.toggle_recording)
+        file_dropdown.add_option(option="Memory Usage", command=self.root.show_memory_usage)
         file_dropdown.add_separator()
-        file_dropdown.add_option(option="Exit", command=self.root.destroy)
+        file_dropdown.add_option(option="Exit", command=self.root.on_close)
 
     def create_canvas_view(self):
         self.canvas_view_frame = ctk.CTkFrame(
@@ -56,22 +67,98 @@ class FrontEnd:
         self.roi_table_frame.pack(side="right", fill="y", padx=5, pady=5)
         self.roi_table_frame.pack_propagate(False)
 
-        columns = ("ID", "Drug Name")
-        headings = ("ID", "Drug Name")
+        columns = ("ID", "Drug Name", "Well", "Conc")
+        headings = ("ID", "Drug Name", "Well", "Conc")
         self.roi_table = CustomTreeview(self.roi_table_frame, columns=columns, headings=headings)
         self.roi_table.column("#1", width=40, minwidth=40)
+        self.roi_table.column("#3", width=50, minwidth=50)
+        self.roi_table.column("#4", width=60, minwidth=60)
         self.roi_table.pack(fill="both", expand=True)
 
         ctk.set_default_color_theme("assets/style.json")
 
+        # Page selector for multi-page images, only shown when there is more than one page
+        self.page_menu = ctk.CTkOptionMenu(
+            self.roi_table_frame,
+            values=["Page 1"],
+            command=self.root.select_page
+        )
+
+        # Display window sliders, as fractions of the image's bit depth range
+        self.white_slider = ctk.CTkSlider(
+            self.roi_table_frame,
+            from_=0,
+            to=1,
+            command=lambda _: self.image_canvas.set_window(self.black_slider.get(), self.white_slider.get())
+        )
+        self.white_slider.set(1)
+        self.white_slider.pack(side="bottom", fill="x", padx=5, pady=5, anchor="s")
+
+        self.black_slider = ctk.CTkSlider(
+            self.roi_table_frame,
+            from_=0,
+            to=1,
+            command=lambda _: self.image_canvas.set_window(self.black_slider.get(), self.white_slider.get())
+        )
+        self.black_slider.set(0)
+        self.black_slider.pack(side="bottom", fill="x", padx=5, pady=5, anchor="s")
+
+        ctk.CTkLabel(self.roi_table_frame, text="Contrast").pack(side="bottom", anchor="w", padx=5)
+
+        # Plate format used when dragging out a plate layout with Shift+drag
+        self.plate_format_menu = ctk.CTkOptionMenu(
+            self.roi_table_frame,
+            values=["96", "384", "1536"],
+            command=lambda value: setattr(self.image_canvas, "plate_format", int(value))
+        )
+        self.plate_format_menu.pack(side="bottom", fill="x", padx=5, pady=5, anchor="s")
+
+        # Shape drawn with Ctrl+drag, polygons are clicked out vertex by vertex with Ctrl+click
+        self.roi_shape_menu = ctk.CTkOptionMenu(
+            self.roi_table_frame,
+            values=["Rectangle", "Ellipse", "Polygon"],
+            command=lambda value: setattr(self.image_canvas, "roi_shape", value.lower())
+        )
+        self.roi_shape_menu.pack(side="bottom", fill="x", padx=5, pady=5, anchor="s")
+
+        self.preview_switch = ctk.CTkSwitch(
+            self.roi_table_frame,
+            text="Live preview",
+            command=lambda: self.image_canvas.set_preview_enabled(self.preview_switch.get() == 1)
+        )
+        self.preview_switch.pack(side="bottom", fill="x", padx=5, pady=5, anchor="s")
+
+        self.flat_field_switch = ctk.CTkSwitch(
+            self.roi_table_frame,
+            text="Flat-field correction",
+            command=lambda: self.root.set_flat_field_enabled(self.flat_field_switch.get() == 1)
+        )
+        self.flat_field_switch.pack(side="bottom", fill="x", padx=5, pady=5, anchor="s")
+
+        self.tracking_switch = ctk.CTkSwitch(
+            self.roi_table_frame,
+            text="Time series tracking",
+            command=lambda: self.root.set_tracking_enabled(self.tracking_switch.get() == 1)
+        )
+        self.tracking_switch.pack(side="bottom", fill="x", padx=5, pady=5, anchor="s")
+
         self.extract_button = ctk.CTkButton(
             self.roi_table_frame,
             text="Extract ROIs",
             fg_color="#3F8047",
             hover_color="#2B5530",
+            command=self.root.extract_rois
         )
         self.extract_button.pack(side="bottom", fill="x", padx=5, pady=5, anchor="s")
 
+        # Segments wells inside the ROIs only, instead of measuring the ROIs as a whole
+        self.segment_button = ctk.CTkButton(
+            self.roi_table_frame,
+            text="Segment ROIs",
+            command=self.root.segment_rois
+        )
+        self.segment_button.pack(side="bottom", fill="x", padx=5, pady=5, anchor="s")
+
     def create_status_bar(self):
         frame_statusbar = ctk.CTkFrame(self.root, corner_radius=0)
         frame_statusbar.grid(row=1, column=0, columnspan=2, sticky="ew")
@@ -79,8 +166,8 @@ class FrontEnd:
         self.project_name_label = ctk.CTkLabel(frame_statusbar, text="")
         self.project_name_label.pack(side="left", padx=5, anchor="w")
 
-        status = ctk.CTkLabel(frame_statusbar, text="Idle")
-        status.pack(side="left", padx=5, anchor="center", expand=True, fill="x")
+        self.status_label = ctk.CTkLabel(frame_statusbar, text="Idle")
+        self.status_label.pack(side="left", padx=5, anchor="center", expand=True, fill="x")
 
         self.label_image_info = ctk.CTkLabel(frame_statusbar, text="Image info")
         self.label_image_info.pack(side="right", padx=5, anchor="e")
@@ -171,8 +258,57 @@ class FrontEnd:
         )
         create_project_button.pack(pady=10)
 
+    def create_data_view(self):
+        self.data_view_frame = ctk.CTkFrame(
+            self.root,
+            corner_radius=0,
+            border_width=-2,
+            border_color="#1c1c1c"
+        )
+
+        # Measurements the curves are fitted to
+        sources = {"ROI means": "roi_masks", "Wells in ROIs": "roi_wells"}
+        self.dose_response_source_menu = ctk.CTkOptionMenu(
+            self.data_view_frame,
+            values=list(sources),
+            command=lambda value: self.root.set_dose_response_source(sources[value])
+        )
+        self.dose_response_source_menu.pack(fill="x", padx=5, pady=5)
+
+        # One row per drug with its four parameter logistic fit
+        columns = ("Drug", "EC50", "Hill", "R2", "N")
+        headings = ("Drug", "EC50", "Hill", "R²", "N")
+        self.dose_response_table = CustomTreeview(
+            self.data_view_frame, columns=columns, headings=headings, read_only=True
+        )
+        self.dose_response_table.pack(fill="both", expand=True, padx=5, pady=5)
+
     def setup_data_view(self):
-        pass
+        self.data_view_frame.grid(row=0, column=1, sticky="nsew")
+
+    def update_dose_response(self, fits):
+        '''
+        Show the fitted EC50, Hill slope and R² per drug. Drugs with too few concentrations are listed without a fit.
+        '''
+        self.dose_response_table.delete(*self.dose_response_table.get_children())
+        self.dose_response_table.insert_rows(
+            (drug, f"{fit['ec50']:.4g}", f"{fit['hill']:.3g}", f"{fit['r2']:.3f}", fit["n"])
+            if fit is not None else (drug, "-", "-", "-", "-")
+            for drug, fit in sorted(fits.items())
+        )
+
+    def create_compare_view(self):
+        self.compare_view_frame = ctk.CTkFrame(
+            self.root,
+            corner_radius=0,
+            border_width=-2,
+            border_color="#1c1c1c"
+        )
+        self.compare_canvas = CompareCanvas(self.compare_view_frame, background="black", highlightthickness=0)
+        self.compare_canvas.pack(expand=True, fill="both", padx=5, pady=5)
+
+    def setup_compare_view(self):
+        self.compare_view_frame.grid(row=0, column=1, sticky="nsew")
 
     def setup_roi_selector(self):
         pass
@@ -187,6 +323,9 @@ class FrontEnd:
         elif view == "data":
             self.data_button.configure(fg_color="#27272a")
             self.home_button.configure(fg_color=self.fg_color1)
+        else:
+            self.home_button.configure(fg_color=self.fg_color1)
+            self.data_button.configure(fg_color=self.fg_color1)
     
     def update_project_name(self, project_name):
         '''
@@ -194,6 +333,23 @@ class FrontEnd:
         '''
         self.project_name_label.configure(text=project_name)
     
+    def update_page_menu(self, n_pages, page=0):
+        '''
+        Fill the page selector for an image with the given number of pages.
+        '''
+        if n_pages > 1:
+            self.page_menu.configure(values=["Composite"] + [f"Page {i + 1}" for i in range(n_pages)])
+            self.page_menu.set(f"Page {page + 1}")
+            self.page_menu.pack(side="bottom", fill="x", padx=5, pady=5, anchor="s")
+        else:
+            self.page_menu.pack_forget()
+
+    def update_status(self, status):
+        '''
+        Update the status label in the middle of the status bar.
+        '''
+        self.status_label.configure(text=status)
+
     def update_image_info(self, image_info):
         '''
         Update the image info label with the given image info.
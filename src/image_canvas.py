@@ -1,6 +1,13 @@
 from PIL import Image, ImageTk
 import customtkinter as ctk
 import numpy as np
+from preview import SegmentationPreview
+from overlay import WellOverlay
+from plate_layout import generate_plate_rois
+from display import DisplayMapper, bit_depth
+from renderer import ViewportRenderer, FAST, FINE
+from roi_masks import is_complete_roi, roi_shape
+from memory import memory, photo_nbytes
 
 
 class ImageCanvas(ctk.CTkCanvas):
@@ -14,8 +21,22 @@ class ImageCanvas(ctk.CTkCanvas):
         self.rois = []
         self.current_roi = None
         self.is_drawing_roi = False
+        self.is_drawing_plate = False
+        self.plate_format = 96
+        self.roi_shape = "rectangle"
+        self.current_polygon = None
         self.mat_affine = np.eye(3)
         self.selected_roi_index = None
+        self.preview = None
+        self.well_overlay = WellOverlay()
+        self.display = DisplayMapper()
+        self.stack = None
+        self.channels = None
+        self.renderer = ViewportRenderer()
+        self.flat_field = None
+        self.refine_delay_ms = 150
+        self._refine_after_id = None
+        memory.register("photo_images", self, measure=lambda canvas: photo_nbytes(getattr(canvas, "image", None)))
 
         self.roi_colour = "#223BC9"
         self.hover_colour = "#067FD0"
@@ -23,14 +44,104 @@ class ImageCanvas(ctk.CTkCanvas):
 
         self._bind_events()
 
-    def set_image(self, pil_image):
+    def set_image(self, pil_image, max_value=None):
         '''
         Set the image to be displayed on the canvas.
+
+        max_value is the image's precomputed maximum; without it the display range is
+        taken from a scan of the image.
         '''
         self.pil_image = pil_image
+        self.current_polygon = None
+        self.display.set_data_range(pil_image, max_value)
+        self.renderer.set_image(pil_image)
+        self.stack = None
+        self.channels = None
+        self.well_overlay.clear()
         self._zoom_fit(self.pil_image.width, self.pil_image.height)
         self._draw_image()
 
+    def set_stack(self, stack, max_value=None):
+        '''
+        Set the multi-page image the displayed pages come from, showing its first page.
+        '''
+        self.set_image(stack.page(0), max_value)
+        self.stack = stack
+
+    def show_page(self, index, max_value=None):
+        '''
+        Show a single page of the current stack.
+        '''
+        if self.stack is None:
+            return
+        self.channels = None
+        self.pil_image = self.stack.page(index)
+        # Pages differ in brightness; a dim page windowed for a bright one would render black
+        self.display.set_data_range(self.pil_image, max_value)
+        self.renderer.set_image(self.pil_image)
+        self._draw_image()
+
+    def show_composite(self, channels=None):
+        '''
+        Show several pages of the current stack as a colour composite (all pages by default).
+        '''
+        if self.stack is None:
+            return
+        self.channels = list(range(self.stack.n_pages)) if channels is None else list(channels)
+        self._draw_image()
+
+    def set_window(self, black, white):
+        '''
+        Set the display window as fractions of the image's effective bit depth range. Raw data is left untouched.
+        '''
+        if self.pil_image is None:
+            return
+        max_value = self.display.full_range(bit_depth(self.pil_image))[1]
+        self.display.set_window(black * max_value, max(white, black) * max_value)
+        self._draw_image()
+
+    def set_display(self, gamma=None, colormap=None):
+        '''
+        Set the display gamma and/or colormap.
+        '''
+        if gamma is not None:
+            self.display.gamma = gamma
+        if colormap is not None:
+            self.display.colormap = colormap
+        self._draw_image()
+
+    def set_wells(self, wells_and_centers):
+        '''
+        Show segmented wells as a tile-cached overlay layer.
+        '''
+        self.well_overlay.set_wells(wells_and_centers)
+        self._draw_image()
+
+    def toggle_wells(self):
+        '''
+        Show or hide the well overlay layer.
+        '''
+        self.well_overlay.visible = not self.well_overlay.visible
+        self._draw_image()
+
+    def set_flat_field(self, flat_field):
+        '''
+        Set the FlatField used to correct the displayed image and the preview, or None to show raw data.
+        '''
+        self.flat_field = flat_field
+        self._draw_image()
+
+    def set_preview_enabled(self, enabled):
+        '''
+        Toggle the live segmentation overlay of the visible region.
+        '''
+        if enabled and self.preview is None:
+            self.preview = SegmentationPreview(self, self.frontend.root.scheduler)
+        elif not enabled and self.preview is not None:
+            self.preview.shutdown()
+            self.preview = None
+        self._draw_image()
+
     def _bind_events(self):
         '''
         Bind ui input events to functions
@@ -41,6 +152,11 @@ class ImageCanvas(ctk.CTkCanvas):
         self.bind("<Double-Button-1>", self._mouse_double_left)
         self.bind("<MouseWheel>", self._mouse_wheel)
 
+        # ROI items share one set of bindings, resolved to an index from the item tags
+        self.tag_bind("roi", "<Enter>", lambda event: self._on_roi_event(self._on_roi_hover))
+        self.tag_bind("roi", "<Leave>", lambda event: self._on_roi_event(self._on_roi_leave))
+        self.tag_bind("roi", "<Button-1>", lambda event: self._on_roi_event(self._on_roi_click))
+
     def _delete_selected_roi(self, _):
         '''
         Delete the selected ROI on Backspace key press.
@@ -52,9 +168,22 @@ class ImageCanvas(ctk.CTkCanvas):
             self.selected_roi_index = None
             self._draw_image()
 
-    def _draw_image(self):
+    def _schedule_refine(self):
+        '''
+        Redraw at full quality once the user has stopped interacting for refine_delay_ms.
+        '''
+        if self._refine_after_id is not None:
+            self.after_cancel(self._refine_after_id)
+        self._refine_after_id = self.after(self.refine_delay_ms, self._refine)
+
+    def _refine(self):
+        self._refine_after_id = None
+        self.after_idle(self._draw_image, FINE)
+
+    def _draw_image(self, quality=FAST):
         '''
         Draw the image on the canvas and the ROIs on the image.
+        Fast frames are followed by a full quality frame once interaction stops.
         '''
         # Check if an image is loaded
         if self.pil_image is None:
@@ -78,12 +207,26 @@ class ImageCanvas(ctk.CTkCanvas):
             mat_inv[1, 2],
         )
 
-        dst = self.pil_image.transform(
-            (canvas_width, canvas_height),
-            Image.AFFINE,
-            affine_inv,
-            Image.NEAREST,
-        )
+        if self.stack is not None and self.channels is not None:
+            # Composite of several pages, each mapped through its own LUT
+            dst = self.stack.render_composite((canvas_width, canvas_height), affine_inv, self.channels)
+        else:
+            view = self.renderer.render(self.mat_affine, (canvas_width, canvas_height), quality)
+            # Flat-field correct only the pixels on screen, in the renderer's buffer
+            if self.flat_field is not None and self.flat_field.matches(self.pil_image.width, self.pil_image.height):
+                self.flat_field.apply_viewport(view, self.mat_affine)
+            dst = Image.fromarray(view)
+
+            # Map raw (possibly 16-bit) viewport data to display values
+            dst = self.display.render(dst)
+
+        # Overlay the cached well outlines and labels
+        dst = self.well_overlay.composite(dst, self.mat_affine)
+
+        # Overlay the live segmentation preview of the visible region
+        if self.preview is not None:
+            self.preview.request(self.pil_image, self.mat_affine, (canvas_width, canvas_height), self.flat_field)
+            dst = self.preview.composite(dst, self.mat_affine)
 
         # Display the tranformed image
         self.image = ImageTk.PhotoImage(image=dst)
@@ -92,61 +235,147 @@ class ImageCanvas(ctk.CTkCanvas):
         # Redraw the ROIs for transformed image
         self._draw_all_rois()
 
+        # Redraw the ROI or plate layout being dragged, which may also be refined mid-drag
+        if self.is_drawing_roi:
+            self._draw_current_roi()
+        elif self.is_drawing_plate:
+            self._draw_current_plate()
+        if self.current_polygon is not None:
+            self._draw_current_polygon()
+
+        if quality == FAST:
+            self._schedule_refine()
+        else:
+            # Evict over-budget caches once the view has settled, not on every interactive frame
+            memory.enforce()
+
     def _draw_all_rois(self):
         '''
         Draw all the ROIs on the canvas.
         '''
         for index, roi in enumerate(self.rois):
-            if roi["start"] is not None and roi["end"] is not None and len(roi["start"]) > 0 and len(roi["end"]) > 0:
-                x1 = max(0, min(roi["start"][0], self.pil_image.width))
-                y1 = max(0, min(roi["start"][1], self.pil_image.height))
-                x2 = max(0, min(roi["end"][0], self.pil_image.width))
-                y2 = max(0, min(roi["end"][1], self.pil_image.height))
-
-                roi_start_canvas = self._to_canvas_point(x1, y1)
-                roi_end_canvas = self._to_canvas_point(x2, y2)
-
-                color = self.selected_colour if index == self.selected_roi_index else self.roi_colour
-                self.create_rectangle(
-                    roi_start_canvas[0],
-                    roi_start_canvas[1],
-                    roi_end_canvas[0],
-                    roi_end_canvas[1],
-                    outline=color,
-                    width=2,
-                    tags=f"roi_{index}"
-                )
-
-                self.tag_bind(f"roi_{index}", "<Enter>", lambda event, i=index: self._on_roi_hover(i))
-                self.tag_bind(f"roi_{index}", "<Leave>", lambda event, i=index: self._on_roi_leave(i))
-                self.tag_bind(f"roi_{index}", "<Button-1>", lambda event, i=index: self._on_roi_click(i))
+            color = self.selected_colour if index == self.selected_roi_index else self.roi_colour
+            self._create_roi_item(roi, color, ("roi", f"roi_{index}"))
+
+    def _create_roi_item(self, roi, color, tags):
+        '''
+        Create the canvas item for a rectangle, ellipse or polygon ROI, clamped to the image.
+        '''
+        if roi_shape(roi) == "polygon":
+            points = np.asarray(roi["points"], dtype=float).reshape(-1, 2)
+            if len(points) < 3:
+                return
+            coords = []
+            for x, y in points:
+                x = max(0, min(x, self.pil_image.width))
+                y = max(0, min(y, self.pil_image.height))
+                coords.extend(self._to_canvas_point(x, y))
+            self.create_polygon(*coords, outline=color, fill="", width=2, tags=tags)
+            return
+
+        if roi["start"] is None or roi["end"] is None or len(roi["start"]) == 0 or len(roi["end"]) == 0:
+            return
+        x1 = max(0, min(roi["start"][0], self.pil_image.width))
+        y1 = max(0, min(roi["start"][1], self.pil_image.height))
+        x2 = max(0, min(roi["end"][0], self.pil_image.width))
+        y2 = max(0, min(roi["end"][1], self.pil_image.height))
+
+        roi_start_canvas = self._to_canvas_point(x1, y1)
+        roi_end_canvas = self._to_canvas_point(x2, y2)
+
+        create = self.create_oval if roi_shape(roi) == "ellipse" else self.create_rectangle
+        create(
+            roi_start_canvas[0],
+            roi_start_canvas[1],
+            roi_end_canvas[0],
+            roi_end_canvas[1],
+            outline=color,
+            width=2,
+            tags=tags
+        )
 
     def _draw_current_roi(self):
         '''
         Draw the current ROI being drawn on the canvas.
         '''
         # Check if the current ROI is not None
-        if self.current_roi is not None:
-            start_x, start_y = self.current_roi["start"][:2]
-            end_x, end_y = self.current_roi["end"][:2]
+        if self.current_roi is not None and self.current_roi["end"] is not None:
+            self._create_roi_item(self.current_roi, self.roi_colour, "current_roi")
+
+    def _draw_current_polygon(self):
+        '''
+        Draw the open outline of the polygon ROI being clicked out.
+        '''
+        coords = []
+        for point in self.current_polygon:
+            coords.extend(self._to_canvas_point(point[0], point[1]))
+        if len(coords) >= 4:
+            self.create_line(*coords, fill=self.roi_colour, width=2, tags="current_roi")
+        x, y = coords[:2]
+        self.create_oval(x - 4, y - 4, x + 4, y + 4, outline=self.hover_colour, width=2, tags="current_roi")
 
-            x1 = max(0, min(start_x, self.pil_image.width))
-            y1 = max(0, min(start_y, self.pil_image.height))
-            x2 = max(0, min(end_x, self.pil_image.width))
-            y2 = max(0, min(end_y, self.pil_image.height))
+    def _add_polygon_point(self, event, image_point):
+        '''
+        Add a vertex to the polygon ROI being drawn. Clicking near the first vertex closes it.
+        '''
+        if self.current_polygon is None:
+            self.current_polygon = [image_point[:2]]
+        else:
+            first_x, first_y = self._to_canvas_point(*self.current_polygon[0])
+            if len(self.current_polygon) >= 3 and abs(event.x - first_x) <= 8 and abs(event.y - first_y) <= 8:
+                roi = {"shape": "polygon", "points": np.concatenate(self.current_polygon)}
+                self.current_polygon = None
+                self.current_roi = roi
+                self.rois.append(roi)
+                self._draw_image()
+                self.master.master.add_roi(roi)
+                return
+            self.current_polygon.append(image_point[:2])
+        self._draw_image()
 
-            roi_start_canvas = self._to_canvas_point(x1, y1)
-            roi_end_canvas = self._to_canvas_point(x2, y2)
+    def _draw_current_plate(self):
+        '''
+        Draw the outline of the plate layout being dragged from the first to the last well centre.
+        '''
+        if self.current_roi is not None and self.current_roi["end"] is not None:
+            start_canvas = self._to_canvas_point(*self.current_roi["start"][:2])
+            end_canvas = self._to_canvas_point(*self.current_roi["end"][:2])
             self.create_rectangle(
-                roi_start_canvas[0],
-                roi_start_canvas[1],
-                roi_end_canvas[0],
-                roi_end_canvas[1],
-                outline=self.roi_colour,
+                start_canvas[0],
+                start_canvas[1],
+                end_canvas[0],
+                end_canvas[1],
+                outline=self.hover_colour,
                 width=2,
+                dash=(4, 4),
                 tags="current_roi"
             )
 
+    def add_plate_layout(self, first_center, last_center):
+        '''
+        Generate ROIs for every well of the current plate format and add them in one pass.
+
+        A layout too small to hold the plate's wells (e.g. a click without a drag) adds nothing.
+        '''
+        try:
+            rois = generate_plate_rois(self.plate_format, first_center, last_center)
+        except ValueError as error:
+            self.master.master.frontend.update_status(str(error))
+            self._draw_image()
+            return
+        self.rois.extend(rois)
+        self._draw_image()
+        self.master.master.add_rois(rois)
+
+    def _on_roi_event(self, handler):
+        '''
+        Call the handler with the index of the ROI under the mouse.
+        '''
+        for tag in self.gettags("current"):
+            if tag.startswith("roi_"):
+                handler(int(tag[4:]))
+                return
+
     def _on_roi_hover(self, index):
         '''
         Change the colour of the ROI to the hover colour if the ROI is not selected.
@@ -174,18 +403,34 @@ class ImageCanvas(ctk.CTkCanvas):
         '''
         If the Ctrl key is pressed, start the ROI drawing process.
         '''
+        # Take the keyboard focus so canvas shortcuts such as Ctrl+A for auto-contrast apply
+        self.focus_set()
         # Capture and save current mouse position (event) for translation
         self.__old_event = event
 
+        # Check if Shift key is pressed to drag out a plate layout from A1 to the last well
+        if event.state & 0x0001:
+            start_point = self._to_image_point(event.x, event.y)
+            if len(start_point) > 0:
+                self.current_roi = {"start": start_point, "end": None}
+                self.is_drawing_plate = True
+            self.is_drawing_roi = False
         # Check if Ctrl key is pressed
-        if event.state & 0x0004:
+        elif event.state & 0x0004:
 
             # Get the start point of the ROI being drawn (current x,y position of the mouse)
             start_point = self._to_image_point(event.x, event.y)
 
+            # Polygons are clicked out one vertex at a time
+            if self.roi_shape == "polygon":
+                self.is_drawing_roi = False
+                if len(start_point) > 0:
+                    self._add_polygon_point(event, start_point)
             # If the start point is valid, start the ROI drawing process
-            if len(start_point) > 0:
+            elif len(start_point) > 0:
                 self.current_roi = {"start": self._to_image_point(event.x, event.y), "end": None}
+                if self.roi_shape == "ellipse":
+                    self.current_roi["shape"] = "ellipse"
                 self.is_drawing_roi = True
         else:
             self.is_drawing_roi = False
@@ -198,8 +443,16 @@ class ImageCanvas(ctk.CTkCanvas):
         # Check if an image is loaded
         if self.pil_image is None:
             return
+        # Don't pan while a polygon is being clicked out
+        if self.current_polygon is not None:
+            return
+        if self.is_drawing_plate:
+            end_point = self._to_image_point(event.x, event.y)
+            if len(end_point) > 0:
+                self.current_roi["end"] = end_point
+                self._draw_image()
         # Check if the Ctrl key is pressed
-        if self.is_drawing_roi:
+        elif self.is_drawing_roi:
             # Get current end point of the ROI being drawn (current x,y position of the mouse)
             end_point = self._to_image_point(event.x, event.y)
             # If the end point is valid, update the current ROI being drawn
@@ -208,7 +461,6 @@ class ImageCanvas(ctk.CTkCanvas):
                 self.current_roi["end"] = self._to_image_point(event.x, event.y)
                 # Redraw the image
                 self._draw_image()
-                self._draw_current_roi()  # Add this line to draw the current ROI being drawn
         else:
             try:
                 # Translate the image
@@ -221,16 +473,28 @@ class ImageCanvas(ctk.CTkCanvas):
     def _mouse_up_left(self, event):
         '''
         If the Ctrl key is pressed, stop ROI drawing process.
+        If a plate layout is being dragged, generate its ROIs.
         '''
-        if self.is_drawing_roi:
+        if self.is_drawing_plate:
+            self.is_drawing_plate = False
             end_point = self._to_image_point(event.x, event.y)
             if len(end_point) > 0:
                 self.current_roi["end"] = end_point
+            if self.current_roi["end"] is not None:
+                self.add_plate_layout(self.current_roi["start"], self.current_roi["end"])
+            self.current_roi = None
+        elif self.is_drawing_roi:
+            end_point = self._to_image_point(event.x, event.y)
+            if len(end_point) > 0:
+                self.current_roi["end"] = end_point
+            # A click without a drag, or a release outside the image, leaves nothing to save
+            if is_complete_roi(self.current_roi):
                 self.rois.append(self.current_roi)
-                self._draw_image()
-
-            # Save current ROI to the database
-            self.master.master.add_roi(self.current_roi)
+                # Save current ROI to the database
+                self.master.master.add_roi(self.current_roi)
+            else:
+                self.current_roi = None
+            self._draw_image()
             self.is_drawing_roi = False
 
     def _mouse_double_left(self, _):
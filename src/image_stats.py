@@ -0,0 +1,153 @@
+from typing import Callable, Dict, Optional
+from PIL import Image
+import numpy as np
+import cv2
+from display import bit_depth, to_display_array
+
+# Number of bins of the histogram stored in the database
+HISTOGRAM_BINS = 256
+# Percentiles stored per image, used for auto-contrast
+PERCENTILES = (0.5, 1, 50, 99, 99.5)
+
+def _strip_array(img: Image.Image, top: int, bottom: int) -> np.ndarray:
+    """Return rows [top, bottom) of the image as a single channel uint8/uint16 array."""
+    strip = img.crop((0, top, img.width, bottom))
+    if strip.mode in ("RGB", "RGBA", "P", "CMYK", "YCbCr", "LA", "1"):
+        strip = strip.convert("L")
+    return to_display_array(strip)
+
+def percentile_from_histogram(histogram: np.ndarray, percentile: float) -> int:
+    """Return the value below which the given percentage of the counted pixels fall."""
+    cumulative = np.cumsum(histogram)
+    return int(np.searchsorted(cumulative, cumulative[-1] * percentile / 100.0))
+
+def otsu_from_histogram(histogram: np.ndarray) -> int:
+    """Return Otsu's threshold computed from a histogram of raw values."""
+    values = np.arange(len(histogram), dtype=np.float64)
+    weight_bg = np.cumsum(histogram).astype(np.float64)
+    weight_fg = weight_bg[-1] - weight_bg
+    sum_bg = np.cumsum(histogram * values)
+    mean_bg = sum_bg / np.maximum(weight_bg, 1)
+    mean_fg = (sum_bg[-1] - sum_bg) / np.maximum(weight_fg, 1)
+    between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(between))
+
+def compute_image_stats(path: str, strip_height: int = 512, cancelled: Optional[Callable[[], bool]] = None) -> Optional[Dict]:
+    """Compute histogram based statistics of an image, one strip of rows at a time.
+
+    PIL decodes the whole frame when the first strip is cropped, so the frame itself
+    is held once. The statistics are then computed per strip, so the temporary arrays
+    on top of it (the float Laplacian in particular) are bounded by the strip size.
+
+    Args:
+        path (str): Path to the image file.
+        strip_height (int): Number of rows processed per step.
+        cancelled (Optional[Callable[[], bool]]): Polled between strips; return True to abort.
+
+    Returns:
+        Optional[Dict]: The statistics, or None if cancelled. Keys are min, max, mean,
+        the p<percentile> values, otsu, saturated_fraction, focus and histogram (a
+        HISTOGRAM_BINS long uint64 array over the full range of the bit depth). All
+        values are in the image's raw units, so otsu is not the segmentation pipeline's
+        threshold, which is in the uint8 units of its "gray" stage (see
+        threshold_to_gray).
+    """
+    with Image.open(path) as img:
+        depth = bit_depth(img)
+        max_value = 2 ** depth - 1
+        histogram = np.zeros(2 ** depth, dtype=np.int64)
+        lap_sum = 0.0
+        lap_sq_sum = 0.0
+        lap_count = 0
+
+        previous_rows = None
+        for top in range(0, img.height, strip_height):
+            if cancelled is not None and cancelled():
+                return None
+            strip = _strip_array(img, top, min(top + strip_height, img.height))
+            histogram += np.bincount(strip.ravel(), minlength=len(histogram))
+
+            # Focus: variance of the Laplacian, with two rows of context from the previous strip
+            # so every row except the image borders is counted exactly once
+            context = strip if previous_rows is None else np.vstack([previous_rows, strip])
+            laplacian = cv2.Laplacian(context.astype(np.float32), cv2.CV_32F)
+            interior = laplacian[1:-1] if len(laplacian) > 2 else laplacian
+            lap_sum += float(interior.sum(dtype=np.float64))
+            lap_sq_sum += float(np.square(interior, dtype=np.float64).sum())
+            lap_count += interior.size
+            previous_rows = strip[-2:]
+
+    total = histogram.sum()
+    nonzero = np.flatnonzero(histogram)
+    lap_mean = lap_sum / max(lap_count, 1)
+    stats = {
+        "min": int(nonzero[0]) if len(nonzero) else 0,
+        "max": int(nonzero[-1]) if len(nonzero) else 0,
+        "mean": float((histogram * np.arange(len(histogram))).sum() / max(total, 1)),
+        "otsu": otsu_from_histogram(histogram),
+        "saturated_fraction": float(histogram[max_value] / max(total, 1)),
+        "focus": lap_sq_sum / max(lap_count, 1) - lap_mean ** 2,
+        "histogram": histogram.reshape(HISTOGRAM_BINS, -1).sum(axis=1).astype(np.uint64),
+    }
+    for percentile in PERCENTILES:
+        stats[percentile_column(percentile)] = percentile_from_histogram(histogram, percentile)
+    return stats
+
+def threshold_to_gray(threshold: float, low: float, high: float) -> float:
+    """Convert a threshold in raw units to the uint8 units of the segmentation pipeline's "gray" stage.
+
+    Args:
+        threshold (float): Threshold in raw units, e.g. the stored otsu value.
+        low (float): Raw value mapped to 0, the image minimum unless the pipeline's intensity_range
+            is set. 8-bit images without intensity_range pass through unscaled, so use 0 and 255.
+        high (float): Raw value mapped to 255, the image maximum unless intensity_range is set.
+
+    Returns:
+        float: The threshold in 0-255.
+    """
+    if high <= low:
+        return 0.0
+    return float(np.clip((threshold - low) * 255.0 / (high - low), 0, 255))
+
+def percentile_column(percentile: float) -> str:
+    """Return the database column name used for a percentile, e.g. p99_5 for 99.5."""
+    return "p" + f"{percentile:g}".replace(".", "_")
+
+
+def compute_missing_stats(token, progress, db_manager, batch_size: int = 16) -> int:
+    """Scheduler job computing statistics for every project image that has none yet.
+
+    Results are written to the database in batches, so a cancelled run keeps what it finished.
+
+    Args:
+        token (CancelToken): Cancellation token of the job.
+        progress (Callable[[int, int], None]): Progress callback of the job.
+        db_manager (DatabaseManager): The project database.
+        batch_size (int): Number of images per database write.
+
+    Returns:
+        int: The number of images processed.
+    """
+    images = db_manager.get_images_without_stats()
+    batch = {}
+    done = 0
+    try:
+        for image_id, image_path in images:
+            try:
+                stats = compute_image_stats(image_path, cancelled=lambda: token.cancelled)
+            except OSError as e:
+                print(f"Could not compute statistics for {image_path}: {e}")
+                stats = None
+            if token.cancelled:
+                break
+            if stats is not None:
+                batch[image_id] = stats
+            done += 1
+            if len(batch) >= batch_size:
+                db_manager.save_image_stats(batch)
+                batch = {}
+            progress(done, len(images))
+    finally:
+        if batch:
+            db_manager.save_image_stats(batch)
+    return done
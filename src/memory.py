@@ -0,0 +1,321 @@
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+import argparse
+import os
+import threading
+import tracemalloc
+import weakref
+from PIL import Image
+import numpy as np
+
+# Subsystems trimmed when the global budget is exceeded, cheapest to rebuild first.
+# Anything not listed (PhotoImages, shared frames, tracker label maps) is reported but never evicted.
+EVICTION_ORDER = ("overlay_tiles", "display_luts", "roi_masks", "pipeline", "pyramids", "pages")
+
+# Subsystems whose members lock themselves, so worker threads may measure and trim them.
+# The canvas caches and Tk photo images may only be touched from the Tk thread.
+LOCKED_SUBSYSTEMS = ("roi_masks", "pipeline", "pages")
+
+def image_nbytes(img: Image.Image) -> int:
+    """Return the approximate number of bytes held by a decoded PIL image."""
+    bytes_per_sample = {"I;16": 2, "I;16B": 2, "I;16L": 2, "I": 4, "F": 4}.get(img.mode, 1)
+    return img.width * img.height * len(img.getbands()) * bytes_per_sample
+
+def photo_nbytes(photo) -> int:
+    """Return the bytes of a Tk photo image, which Tk keeps as 32-bit RGBA."""
+    if photo is None:
+        return 0
+    return photo.width() * photo.height() * 4
+
+def nbytes_of(value: Any) -> int:
+    """Return the bytes held by arrays and images in a value, looking into lists, tuples and dicts.
+
+    Memory mapped arrays are backed by their file and count as 0.
+    """
+    if isinstance(value, np.memmap):
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, Image.Image):
+        return image_nbytes(value)
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes_of(item) for item in value)
+    if isinstance(value, dict):
+        return sum(nbytes_of(item) for item in value.values())
+    return 0
+
+def rss_bytes() -> Optional[int]:
+    """Return the resident set size of the process, or None where it cannot be read."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def peak_rss_bytes() -> Optional[int]:
+    """Return the highest resident set size the process has reached, or None where it is unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+def default_budget() -> Optional[int]:
+    """Half of the physical memory, or None if it cannot be determined."""
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def profile_call(func: Callable, *args, **kwargs) -> Tuple[Any, Dict[str, Optional[int]]]:
+    """Call a function and measure the memory it needed.
+
+    The peak is taken from tracemalloc, which NumPy, PIL and the cv2 bindings all
+    allocate their arrays through, and is the highest traced usage during the call
+    above the usage before it. tracemalloc is global, so allocations made by other
+    threads meanwhile are included. Tracing is stopped again afterwards unless it was
+    already running. The RSS is sampled before and after the call.
+
+    Args:
+        func (Callable): Function to call.
+        *args: Positional arguments of the call.
+        **kwargs: Keyword arguments of the call.
+
+    Returns:
+        Tuple[Any, Dict[str, Optional[int]]]: The result and a dict with peak_bytes,
+        output_bytes, rss_bytes and rss_delta.
+    """
+    # Tracing slows every allocation, so it only runs for the call unless someone else started it
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        rss_before = rss_bytes()
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+        rss_after = rss_bytes()
+    finally:
+        if started:
+            tracemalloc.stop()
+    return result, {
+        "peak_bytes": max(0, peak - before),
+        "output_bytes": nbytes_of(result),
+        "rss_bytes": rss_after,
+        "rss_delta": rss_after - rss_before if rss_after is not None and rss_before is not None else None,
+    }
+
+
+class MemoryTracker:
+    '''
+    Accounts for the bytes held per subsystem and enforces global and per-subsystem budgets.
+
+    Caches register themselves under a subsystem name. They are only weakly
+    referenced, so short-lived pipelines or panes drop out on their own. A member
+    reports its size through nbytes() and, if it can give memory back, frees it
+    through trim(max_bytes), which evicts its least recently used entries until it
+    holds at most max_bytes and returns the bytes freed.
+
+    enforce first brings every subsystem within its own budget, largest member
+    first, and then, if the total is still over the global budget, trims subsystems
+    in EVICTION_ORDER. The Tk thread calls it once the view has settled and after
+    jobs finish. Jobs call it between frames restricted to LOCKED_SUBSYSTEMS, since
+    the canvas caches are not locked; the other subsystems then count with the size
+    they had when last measured.
+    '''
+    def __init__(self, budget: Optional[int] = None):
+        self.budget = budget
+        self.budgets: Dict[str, int] = {}
+        self.evicted: Dict[str, int] = {}
+        self._members: Dict[str, "weakref.WeakKeyDictionary"] = {}
+        # Bytes per subsystem at its last measurement
+        self._measured: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._enforcing = False
+
+    def register(
+        self,
+        subsystem: str,
+        member: object,
+        measure: Optional[Callable[[Any], int]] = None,
+        trim: Optional[Callable[[Any, int], int]] = None,
+    ) -> None:
+        """Account for an object under a subsystem.
+
+        Args:
+            subsystem (str): Subsystem name, e.g. "pages" or "pyramids".
+            member (object): The object holding the memory.
+            measure (Optional[Callable[[Any], int]]): Returns the member's bytes, defaults to member.nbytes().
+            trim (Optional[Callable[[Any, int], int]]): Shrinks the member to a byte limit and returns the
+                bytes freed, defaults to member.trim if the member has one.
+        """
+        measure = measure or type(member).nbytes
+        if trim is None:
+            trim = getattr(type(member), "trim", None)
+        with self._lock:
+            self._members.setdefault(subsystem, weakref.WeakKeyDictionary())[member] = (measure, trim)
+
+    def configure(self, budget: Optional[int] = None, **budgets: Optional[int]) -> None:
+        """Set the global budget and per-subsystem budgets in bytes. None removes a budget.
+
+        Args:
+            budget (Optional[int]): Budget over all subsystems.
+            **budgets: Budgets by subsystem name.
+        """
+        with self._lock:
+            self.budget = budget
+            for subsystem, max_bytes in budgets.items():
+                if max_bytes is None:
+                    self.budgets.pop(subsystem, None)
+                else:
+                    self.budgets[subsystem] = max_bytes
+
+    def budget_for(self, subsystem: str) -> Optional[int]:
+        """Return the budget a subsystem may use on its own: its own budget, else the global one."""
+        with self._lock:
+            return self.budgets.get(subsystem, self.budget)
+
+    def usage(self) -> Dict[str, int]:
+        """Return the bytes currently held per subsystem."""
+        return {subsystem: sum(size for _, size, _ in self._sizes(subsystem)) for subsystem in self._subsystems()}
+
+    def total(self) -> int:
+        return sum(self.usage().values())
+
+    def enforce(self, subsystems: Optional[Iterable[str]] = None) -> int:
+        """Evict cached data until every budget is met as far as possible.
+
+        Args:
+            subsystems (Optional[Iterable[str]]): Only measure and trim these subsystems, e.g.
+                LOCKED_SUBSYSTEMS from a worker thread. Defaults to all of them.
+
+        Returns:
+            int: The bytes freed.
+        """
+        allowed = None if subsystems is None else set(subsystems)
+        with self._lock:
+            if self._enforcing:
+                return 0
+            self._enforcing = True
+            try:
+                freed = 0
+                for subsystem, max_bytes in list(self.budgets.items()):
+                    if allowed is None or subsystem in allowed:
+                        freed += self._trim_subsystem(subsystem, max_bytes)
+                if self.budget is not None:
+                    total = sum(
+                        sum(size for _, size, _ in self._sizes(subsystem))
+                        if allowed is None or subsystem in allowed else self._measured.get(subsystem, 0)
+                        for subsystem in self._subsystems()
+                    )
+                    excess = total - self.budget
+                    for subsystem in EVICTION_ORDER:
+                        if excess <= 0:
+                            break
+                        if allowed is not None and subsystem not in allowed:
+                            continue
+                        held = sum(size for _, size, _ in self._sizes(subsystem))
+                        released = self._trim_subsystem(subsystem, max(0, held - excess))
+                        excess -= released
+                        freed += released
+                return freed
+            finally:
+                self._enforcing = False
+
+    def report(self) -> Dict[str, Any]:
+        """Return the bytes, member count and budget per subsystem together with process wide figures."""
+        subsystems = {}
+        for subsystem in self._subsystems():
+            sizes = self._sizes(subsystem)
+            subsystems[subsystem] = {
+                "bytes": sum(size for _, size, _ in sizes),
+                "members": len(sizes),
+                "budget": self.budgets.get(subsystem),
+                "evicted": self.evicted.get(subsystem, 0),
+            }
+        return {
+            "subsystems": subsystems,
+            "total": sum(entry["bytes"] for entry in subsystems.values()),
+            "budget": self.budget,
+            "rss": rss_bytes(),
+            "peak_rss": peak_rss_bytes(),
+        }
+
+    def _subsystems(self):
+        with self._lock:
+            return sorted(name for name, members in self._members.items() if len(members))
+
+    def _sizes(self, subsystem: str):
+        '''
+        Return (member, bytes, trim) of every live member of a subsystem, largest first.
+        '''
+        with self._lock:
+            members = list(self._members.get(subsystem, {}).items())
+        sizes = [(member, measure(member), trim) for member, (measure, trim) in members]
+        self._measured[subsystem] = sum(size for _, size, _ in sizes)
+        return sorted(sizes, key=lambda entry: -entry[1])
+
+    def _trim_subsystem(self, subsystem: str, max_bytes: int) -> int:
+        sizes = self._sizes(subsystem)
+        excess = sum(size for _, size, _ in sizes) - max_bytes
+        freed = 0
+        for member, size, trim in sizes:
+            if excess <= 0:
+                break
+            if trim is None or size == 0:
+                continue
+            released = trim(member, max(0, size - excess))
+            excess -= released
+            freed += released
+        self._measured[subsystem] = self._measured.get(subsystem, 0) - freed
+        if freed:
+            self.evicted[subsystem] = self.evicted.get(subsystem, 0) + freed
+        return freed
+
+
+# Tracker every cache registers with
+memory = MemoryTracker(default_budget())
+
+
+def format_bytes(nbytes: Optional[int]) -> str:
+    if nbytes is None:
+        return "-"
+    return f"{nbytes / (1 << 20):.1f} MB"
+
+def format_report(report: Dict[str, Any], stage_memory: Optional[Dict[str, Dict[str, Optional[int]]]] = None) -> str:
+    """Format a MemoryTracker report, and optionally per-stage pipeline peaks, as a text table."""
+    lines = [f"{'Subsystem':<16} {'Held':>10} {'Budget':>10} {'Evicted':>10}  Members"]
+    for subsystem, entry in report["subsystems"].items():
+        lines.append(
+            f"{subsystem:<16} {format_bytes(entry['bytes']):>10} {format_bytes(entry['budget']):>10} "
+            f"{format_bytes(entry['evicted']):>10}  {entry['members']}"
+        )
+    lines.append(f"{'Total':<16} {format_bytes(report['total']):>10} {format_bytes(report['budget']):>10}")
+    lines.append(f"RSS {format_bytes(report['rss'])}, peak {format_bytes(report['peak_rss'])}")
+    if stage_memory:
+        lines.append("")
+        lines.append(f"{'Stage':<16} {'Peak':>10} {'Output':>10} {'RSS delta':>10}")
+        for stage, entry in stage_memory.items():
+            lines.append(
+                f"{stage:<16} {format_bytes(entry['peak_bytes']):>10} {format_bytes(entry['output_bytes']):>10} "
+                f"{format_bytes(entry['rss_delta']):>10}"
+            )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Segment an image and report the memory used per pipeline stage and subsystem.")
+    parser.add_argument("image", help="Image to segment")
+    parser.add_argument("--stage", default="watershed", help="Pipeline stage to compute (default: watershed)")
+    args = parser.parse_args()
+
+    from pipeline import build_segmentation_pipeline
+    from multipage import read_page
+
+    pipeline = build_segmentation_pipeline()
+    pipeline.profile_memory = True
+    pipeline.set_input("image", read_page(args.image, 0))
+    pipeline.get(args.stage)
+    print(format_report(memory.report(), pipeline.stage_memory))
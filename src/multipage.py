@@ -0,0 +1,172 @@
+from typing import List, Optional, Tuple
+from collections import OrderedDict
+import threading
+from PIL import Image
+import numpy as np
+from display import DisplayMapper, bit_depth, to_display_array
+from image_stats import percentile_from_histogram
+from memory import memory, image_nbytes
+
+# Default colours of the channels in a composite, as RGB
+CHANNEL_COLOURS = [
+    (0, 255, 0),
+    (255, 0, 255),
+    (0, 255, 255),
+    (255, 0, 0),
+    (0, 0, 255),
+    (255, 255, 0),
+]
+
+def read_page(path: str, page: int) -> np.ndarray:
+    """Decode a single page of a (multi-page) image file without decoding the others.
+
+    Args:
+        path (str): Path to the image file.
+        page (int): Zero based page index.
+
+    Returns:
+        np.ndarray: The page data as a numpy array, in its native dtype.
+
+    Raises:
+        OSError: If the file cannot be decoded or has no such page.
+    """
+    with Image.open(path) as img:
+        try:
+            img.seek(page)
+        except EOFError:
+            raise OSError(f"{path} has no page {page + 1}")
+        return np.asarray(img)
+
+
+class PageCache:
+    '''
+    LRU cache of decoded pages keyed by (path, page), bounded by a byte budget.
+
+    Unless max_bytes is given, the budget is the "pages" budget of the memory
+    tracker, or its global budget if "pages" has none, looked up on every insert so
+    budgets configured for a project apply at once.
+    '''
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._pages: "OrderedDict[Tuple[str, int], Image.Image]" = OrderedDict()
+        self._lock = threading.Lock()
+        memory.register("pages", self, measure=lambda cache: cache.nbytes)
+
+    def get(self, key: Tuple[str, int]) -> Optional[Image.Image]:
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+            return page
+
+    def put(self, key: Tuple[str, int], page: Image.Image) -> None:
+        with self._lock:
+            if key in self._pages:
+                self.nbytes -= image_nbytes(self._pages.pop(key))
+            self._pages[key] = page
+            self.nbytes += image_nbytes(page)
+            max_bytes = self.max_bytes if self.max_bytes is not None else memory.budget_for("pages")
+            # Always keep the newest page, even if it alone exceeds the budget
+            while max_bytes is not None and self.nbytes > max_bytes and len(self._pages) > 1:
+                _, evicted = self._pages.popitem(last=False)
+                self.nbytes -= image_nbytes(evicted)
+
+    def trim(self, max_bytes: int) -> int:
+        '''
+        Evict least recently used pages until at most max_bytes are held and return the bytes freed.
+        '''
+        with self._lock:
+            before = self.nbytes
+            while self.nbytes > max_bytes and self._pages:
+                _, evicted = self._pages.popitem(last=False)
+                self.nbytes -= image_nbytes(evicted)
+            return before - self.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pages.clear()
+            self.nbytes = 0
+
+
+# Cache shared by every MultiPageImage unless one is passed explicitly
+page_cache = PageCache()
+
+
+class MultiPageImage:
+    '''
+    A multi-page or multi-channel image file whose pages are decoded on demand.
+
+    Opening only reads the file header; each page is decoded the first time it is
+    requested (by seeking to it) and kept in a byte-bounded page cache.
+    '''
+    def __init__(self, path: str, cache: Optional[PageCache] = None):
+        self.path = path
+        self.cache = cache if cache is not None else page_cache
+        self._lock = threading.Lock()
+        self._file = Image.open(path)
+        self.n_pages = getattr(self._file, "n_frames", 1)
+        self.width = self._file.width
+        self.height = self._file.height
+        self.format = self._file.format
+        self.mode = self._file.mode
+
+        # One display mapping and colour per page for composites
+        self.mappers = [DisplayMapper() for _ in range(self.n_pages)]
+        self.colours = [CHANNEL_COLOURS[i % len(CHANNEL_COLOURS)] for i in range(self.n_pages)]
+
+    def page(self, index: int) -> Image.Image:
+        '''
+        Return the decoded page, reading it from the file on a cache miss.
+        '''
+        key = (self.path, index)
+        page = self.cache.get(key)
+        if page is None:
+            with self._lock:
+                self._file.seek(index)
+                page = self._file.copy()
+            # copy() returns a plain Image, which has no format
+            page.format = self.format
+            self.cache.put(key, page)
+        return page
+
+    def auto_window(self, index: int) -> None:
+        '''
+        Set the display window of a page from its 0.5 and 99.5 percentiles, unless it already has one.
+        '''
+        mapper = self.mappers[index]
+        if mapper.window is not None:
+            return
+        page = self.page(index)
+        arr = to_display_array(page.convert("L") if page.mode in ("RGB", "RGBA") else page)
+        histogram = np.bincount(arr.ravel(), minlength=2 ** bit_depth(page))
+        low = percentile_from_histogram(histogram, 0.5)
+        high = percentile_from_histogram(histogram, 99.5)
+        mapper.set_window(low, max(high, low + 1))
+
+    def render_composite(self, size: Tuple[int, int], affine_inv: tuple, channels: Optional[List[int]] = None) -> Image.Image:
+        '''
+        Render the visible region of several pages, each through its own LUT and colour, into one RGB image.
+
+        Pages without a display window are windowed from their own percentiles first, so
+        e.g. 12-bit data in 16-bit pages is not rendered nearly black.
+
+        Args:
+            size (Tuple[int, int]): Canvas size in pixels.
+            affine_inv (tuple): Canvas to image affine coefficients as used by Image.transform.
+            channels (Optional[List[int]]): Pages to combine. Defaults to all pages.
+        '''
+        if channels is None:
+            channels = list(range(self.n_pages))
+        accumulator = np.zeros((size[1], size[0], 3), dtype=np.uint16)
+        for index in channels:
+            self.auto_window(index)
+            view = self.page(index).transform(size, Image.AFFINE, affine_inv, Image.NEAREST)
+            mapped = self.mappers[index].render(view)
+            gray = to_display_array(mapped.convert("L") if mapped.mode != "L" else mapped)
+            colour = np.array(self.colours[index], dtype=np.uint16)
+            accumulator += (gray[..., None].astype(np.uint16) * colour) // 255
+        return Image.fromarray(np.minimum(accumulator, 255).astype(np.uint8))
+
+    def close(self) -> None:
+        self._file.close()
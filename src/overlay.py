@@ -0,0 +1,250 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from collections import OrderedDict
+import math
+from PIL import Image
+import numpy as np
+import cv2
+from memory import memory, image_nbytes
+
+Well = Tuple[np.ndarray, Tuple[int, int]]
+
+
+class WellOverlay:
+    '''
+    Well outlines and labels kept as vectors and rasterised into cached RGBA tiles.
+
+    Tiles are rendered per pyramid level (level L shows the image downscaled by 2**L)
+    and only for the tiles that are actually visible. Updating a well only drops the
+    tiles its old and new bounding boxes touch, so toggling or panning the layer
+    never re-draws the whole image the way annotate_wells does.
+    '''
+    TILE_SIZE = 256
+
+    def __init__(
+        self,
+        outline_colour: Tuple[int, int, int, int] = (0, 255, 0, 255),
+        label_colour: Tuple[int, int, int, int] = (255, 0, 0, 255),
+        line_width: int = 2,
+        label_max_level: int = 1,
+        max_tiles: int = 512,
+    ):
+        self.outline_colour = outline_colour
+        self.label_colour = label_colour
+        self.line_width = line_width
+        self.label_max_level = label_max_level
+        self.max_tiles = max_tiles
+        self.visible = True
+
+        self.wells: Dict[int, Well] = {}
+        self._bboxes: Dict[int, Tuple[int, int, int, int]] = {}
+        self._buckets: Dict[Tuple[int, int], Set[int]] = {}
+        self._tiles: "OrderedDict[Tuple[int, int, int], Image.Image]" = OrderedDict()
+        # Tiles resized to the current zoom, bounded by max_tiles like the tiles themselves
+        self._scaled: "OrderedDict[Tuple[int, int, int], Image.Image]" = OrderedDict()
+        self._scaled_key = None
+        memory.register("overlay_tiles", self)
+
+    def set_wells(self, wells_and_centers: Iterable[Well]) -> None:
+        '''
+        Replace all wells, numbering them from 1 like annotate_wells does.
+        '''
+        self.clear()
+        self.update_wells(dict(enumerate(wells_and_centers, start=1)))
+
+    def update_wells(self, wells: Dict[int, Well]) -> None:
+        '''
+        Add or replace wells by ID, invalidating only the tiles they touch.
+        '''
+        for well_id, (contour, center) in wells.items():
+            if well_id in self.wells:
+                self._remove(well_id)
+            self.wells[well_id] = (contour, center)
+            bbox = self._bbox(contour, center)
+            self._bboxes[well_id] = bbox
+            for bucket in self._buckets_in(bbox):
+                self._buckets.setdefault(bucket, set()).add(well_id)
+            self._invalidate(bbox)
+
+    def remove_wells(self, well_ids: Iterable[int]) -> None:
+        '''
+        Remove wells by ID, invalidating only the tiles they touched.
+        '''
+        for well_id in well_ids:
+            if well_id in self.wells:
+                self._remove(well_id)
+
+    def clear(self) -> None:
+        '''
+        Remove all wells and cached tiles.
+        '''
+        self.wells.clear()
+        self._bboxes.clear()
+        self._buckets.clear()
+        self._tiles.clear()
+        self._scaled.clear()
+
+    def nbytes(self) -> int:
+        '''
+        Bytes held by the cached tiles and their resized copies.
+        '''
+        tiles = list(self._tiles.values()) + list(self._scaled.values())
+        return sum(image_nbytes(tile) for tile in tiles if tile is not None)
+
+    def trim(self, max_bytes: int) -> int:
+        '''
+        Drop the resized tiles, then the least recently used tiles, until at most max_bytes are held.
+        '''
+        before = self.nbytes()
+        held = before
+        if held > max_bytes:
+            self._scaled.clear()
+            held = self.nbytes()
+        while held > max_bytes and self._tiles:
+            _, tile = self._tiles.popitem(last=False)
+            held -= image_nbytes(tile) if tile is not None else 0
+        return before - held
+
+    def composite(self, dst: Image.Image, mat_affine: np.ndarray) -> Image.Image:
+        '''
+        Paste the visible tiles of the layer onto the rendered canvas image.
+        '''
+        if not self.visible or not self.wells:
+            return dst
+
+        scale = mat_affine[0, 0]
+        level = self._level_for_scale(scale)
+        tile_extent = self.TILE_SIZE * 2 ** level
+
+        # Resized tiles are only valid for the current zoom
+        if self._scaled_key != scale:
+            self._scaled.clear()
+            self._scaled_key = scale
+
+        mat_inv = np.linalg.inv(mat_affine)
+        x0, y0 = np.dot(mat_inv, (0., 0., 1.))[:2]
+        x1, y1 = np.dot(mat_inv, (float(dst.width), float(dst.height), 1.))[:2]
+        tx_range = range(max(0, int(x0 // tile_extent)), int(x1 // tile_extent) + 1)
+        ty_range = range(max(0, int(y0 // tile_extent)), int(y1 // tile_extent) + 1)
+
+        if dst.mode != "RGB":
+            dst = dst.convert("RGB")
+        for ty in ty_range:
+            for tx in tx_range:
+                key = (level, tx, ty)
+                left, top = np.dot(mat_affine, (tx * tile_extent, ty * tile_extent, 1.))[:2]
+                right, bottom = np.dot(mat_affine, ((tx + 1) * tile_extent, (ty + 1) * tile_extent, 1.))[:2]
+                left, top, right, bottom = (int(round(v)) for v in (left, top, right, bottom))
+                if right <= left or bottom <= top:
+                    continue
+
+                tile = self._scaled.get(key)
+                if tile is not None:
+                    self._scaled.move_to_end(key)
+                else:
+                    tile = self._tile(level, tx, ty)
+                    if tile is None:
+                        continue
+                    if tile.size != (right - left, bottom - top):
+                        tile = tile.resize((right - left, bottom - top), Image.NEAREST)
+                    self._scaled[key] = tile
+                    if len(self._scaled) > self.max_tiles:
+                        self._scaled.popitem(last=False)
+                dst.paste(tile, (left, top), tile)
+        return dst
+
+    def _level_for_scale(self, scale: float) -> int:
+        '''
+        Pick the pyramid level whose resolution is closest to the canvas scale without being coarser.
+        '''
+        if scale >= 1.0:
+            return 0
+        return int(math.floor(math.log2(1.0 / scale)))
+
+    def _tile(self, level: int, tx: int, ty: int) -> Optional[Image.Image]:
+        '''
+        Return the cached RGBA tile, rendering it on a miss. Empty tiles return None.
+        '''
+        key = (level, tx, ty)
+        if key in self._tiles:
+            self._tiles.move_to_end(key)
+            return self._tiles[key]
+
+        tile = self._render_tile(level, tx, ty)
+        self._tiles[key] = tile
+        if len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+        return tile
+
+    def _render_tile(self, level: int, tx: int, ty: int) -> Optional[Image.Image]:
+        factor = 2 ** level
+        extent = self.TILE_SIZE * factor
+        origin = np.array([tx * extent, ty * extent])
+        well_ids = self._wells_in((origin[0], origin[1], origin[0] + extent, origin[1] + extent))
+        if not well_ids:
+            return None
+
+        rgba = np.zeros((self.TILE_SIZE, self.TILE_SIZE, 4), dtype=np.uint8)
+        for well_id in sorted(well_ids):
+            contour, center = self.wells[well_id]
+            points = np.round((contour.reshape(-1, 2) - origin) / factor).astype(np.int32)
+            cv2.polylines(rgba, [points], True, self.outline_colour, self.line_width)
+            if level <= self.label_max_level:
+                label_pos = tuple(int(v) for v in np.round((np.array(center) - origin) / factor))
+                cv2.putText(rgba, str(well_id), label_pos, cv2.FONT_HERSHEY_SIMPLEX, 0.5, self.label_colour, 2)
+        return Image.fromarray(rgba)
+
+    def _bbox(self, contour: np.ndarray, center: Tuple[int, int]) -> Tuple[int, int, int, int]:
+        '''
+        Bounding box of the outline and its label, padded for line width and text.
+        '''
+        x, y, w, h = cv2.boundingRect(contour)
+        pad = self.line_width + 1
+        left, top, right, bottom = x - pad, y - pad, x + w + pad, y + h + pad
+        # Label text extends right and up from the centre, by a fixed size in tile pixels
+        text_w, text_h = (v * 2 ** self.label_max_level for v in (40, 20))
+        return (
+            min(left, center[0]),
+            min(top, center[1] - text_h),
+            max(right, center[0] + text_w),
+            max(bottom, center[1] + pad),
+        )
+
+    def _buckets_in(self, bbox: Tuple[int, int, int, int]) -> List[Tuple[int, int]]:
+        left, top, right, bottom = bbox
+        size = self.TILE_SIZE
+        return [
+            (bx, by)
+            for by in range(int(top // size), int(bottom // size) + 1)
+            for bx in range(int(left // size), int(right // size) + 1)
+        ]
+
+    def _wells_in(self, bbox: Tuple[int, int, int, int]) -> Set[int]:
+        left, top, right, bottom = bbox
+        # Query the level 0 buckets covered by the box, exclusive of its far edges
+        found = set()
+        for bucket in self._buckets_in((left, top, right - 1, bottom - 1)):
+            found |= self._buckets.get(bucket, set())
+        return found
+
+    def _remove(self, well_id: int) -> None:
+        bbox = self._bboxes.pop(well_id)
+        for bucket in self._buckets_in(bbox):
+            ids = self._buckets.get(bucket)
+            if ids is not None:
+                ids.discard(well_id)
+                if not ids:
+                    del self._buckets[bucket]
+        del self.wells[well_id]
+        self._invalidate(bbox)
+
+    def _invalidate(self, bbox: Tuple[int, int, int, int]) -> None:
+        '''
+        Drop cached tiles of every level that intersect the box.
+        '''
+        left, top, right, bottom = bbox
+        for key in set(self._tiles) | set(self._scaled):
+            level, tx, ty = key
+            extent = self.TILE_SIZE * 2 ** level
+            if tx * extent <= right and (tx + 1) * extent > left and ty * extent <= bottom and (ty + 1) * extent > top:
+                self._tiles.pop(key, None)
+                self._scaled.pop(key, None)
@@ -0,0 +1,655 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import multiprocessing
+import os
+import threading
+import numpy as np
+import cv2
+from process_test import extract_contours_and_centers, calculate_mean_intensity
+from flat_field import apply_gain
+from image_stats import otsu_from_histogram
+from memory import memory, nbytes_of, profile_call, LOCKED_SUBSYSTEMS
+
+# Cached value of a stage whose output was trimmed; its signature and version stay valid
+_TRIMMED = object()
+
+
+class Stage:
+    """A single step of the analysis pipeline with explicit inputs and parameters."""
+
+    def __init__(self, name: str, func: Callable, inputs: Iterable[str] = (), params: Iterable[str] = ()):
+        """Initialize the stage.
+
+        Args:
+            name (str): Unique name of the stage.
+            func (Callable): Function called as func(*input_values, **param_values). Must not mutate its inputs.
+            inputs (Iterable[str]): Names of the stages (or pipeline inputs) this stage consumes.
+            params (Iterable[str]): Names of the pipeline parameters this stage depends on.
+        """
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.params = tuple(params)
+
+
+class Pipeline:
+    """A DAG of stages whose outputs are memoised on their inputs and parameters.
+
+    Every stage output is cached together with a signature made of the versions of
+    its inputs and the values of its parameters. Requesting a stage only recomputes
+    the stages whose signature changed, so changing a parameter reruns that stage
+    and everything downstream of it, and nothing else.
+
+    The cached outputs are accounted for under the "pipeline" memory subsystem. With
+    profile_memory set, every stage run records its peak allocation, output size and
+    RSS change in stage_memory.
+
+    A pipeline is used by one thread at a time, but the memory tracker may trim it
+    from another. A lock guards the cache; trim skips a pipeline that is busy instead
+    of waiting for its stage to finish.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Stage] = {}
+        self.params: Dict[str, Any] = {}
+        self.last_run: List[str] = []
+        self.profile_memory = False
+        self.stage_memory: Dict[str, Dict[str, Optional[int]]] = {}
+        self._inputs: Dict[str, Tuple[int, Any]] = {}
+        self._cache: Dict[str, Tuple[tuple, int, Any]] = {}
+        self._lock = threading.RLock()
+        memory.register("pipeline", self)
+
+    def add_input(self, name: str) -> None:
+        """Declare an external input (e.g. the source image) of the pipeline.
+
+        Args:
+            name (str): Name the stages use to refer to the input.
+        """
+        self._check_free(name)
+        self._inputs[name] = (0, None)
+
+    def add_stage(self, name: str, func: Callable, inputs: Iterable[str] = (), params: Optional[Dict[str, Any]] = None) -> None:
+        """Add a stage to the pipeline.
+
+        Args:
+            name (str): Unique name of the stage.
+            func (Callable): Function computing the stage output.
+            inputs (Iterable[str]): Names of upstream stages or inputs, in argument order.
+            params (Optional[Dict[str, Any]]): Parameters used by the stage with their default values.
+        """
+        self._check_free(name)
+        inputs = tuple(inputs)
+        for input_name in inputs:
+            if input_name not in self.stages and input_name not in self._inputs:
+                raise KeyError(f"Unknown input '{input_name}' for stage '{name}'")
+        params = params or {}
+        for param, default in params.items():
+            self.params.setdefault(param, default)
+        self.stages[name] = Stage(name, func, inputs, params.keys())
+
+    def set_input(self, name: str, value: Any) -> None:
+        """Set the value of an external input, invalidating everything downstream of it.
+
+        Args:
+            name (str): Name of the input.
+            value (Any): The new value.
+        """
+        if name not in self._inputs:
+            raise KeyError(f"Unknown input '{name}'")
+        with self._lock:
+            version = self._inputs[name][0]
+            self._inputs[name] = (version + 1, value)
+
+    def set_params(self, **params: Any) -> None:
+        """Update pipeline parameters. Only stages depending on a changed value are rerun.
+
+        Args:
+            **params: Parameter names and their new values.
+        """
+        for param in params:
+            if param not in self.params:
+                raise KeyError(f"Unknown parameter '{param}'")
+        self.params.update(params)
+
+    def get(self, name: str) -> Any:
+        """Return the output of a stage, recomputing only the stale stages it depends on.
+
+        Args:
+            name (str): Name of the stage or input.
+
+        Returns:
+            Any: The stage output.
+        """
+        with self._lock:
+            self.last_run = []
+            return self._evaluate(name, {})[1]
+
+    def downstream(self, name: str) -> Set[str]:
+        """Return the names of all stages depending directly or indirectly on the given stage, input or parameter.
+
+        Args:
+            name (str): Name of a stage, input or parameter.
+
+        Returns:
+            Set[str]: Names of the dependent stages.
+        """
+        result = set()
+        frontier = {name}
+        while frontier:
+            frontier = {
+                stage.name for stage in self.stages.values()
+                if stage.name not in result and (frontier & set(stage.inputs) or frontier & set(stage.params))
+            }
+            result |= frontier
+        return result
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """Drop cached outputs of a stage and its dependents, or of every stage if no name is given.
+
+        Args:
+            name (Optional[str]): Name of the stage to invalidate.
+        """
+        with self._lock:
+            if name is None:
+                self._cache.clear()
+                return
+            for stage_name in self.downstream(name) | {name}:
+                self._cache.pop(stage_name, None)
+
+    def nbytes(self) -> int:
+        """Return the bytes held by the cached stage outputs."""
+        return sum(self._held().values())
+
+    def trim(self, max_bytes: int) -> int:
+        """Drop cached stage outputs, largest first, until at most max_bytes are held.
+
+        Args:
+            max_bytes (int): Bytes the cache may keep.
+
+        Returns:
+            int: The bytes freed, 0 if the pipeline is busy.
+        """
+        if not self._lock.acquire(blocking=False):
+            return 0
+        try:
+            held = self._held()
+            total = sum(held.values())
+            freed = 0
+            for name, size in sorted(held.items(), key=lambda item: -item[1]):
+                if total - freed <= max_bytes or size == 0:
+                    break
+                # Keep the signature and version, so downstream stages stay valid and only this one reruns when needed
+                signature, version, _ = self._cache[name]
+                self._cache[name] = (signature, version, _TRIMMED)
+                freed += size
+            return freed
+        finally:
+            self._lock.release()
+
+    def _held(self) -> Dict[str, int]:
+        '''
+        Bytes per cached stage, not counting outputs that are an input or an earlier stage's output passed through.
+        '''
+        seen = {id(value) for _, value in self._inputs.values()}
+        held = {}
+        for name, (_, _, value) in list(self._cache.items()):
+            if id(value) in seen:
+                continue
+            seen.add(id(value))
+            held[name] = nbytes_of(value)
+        return held
+
+    def _evaluate(self, name: str, resolved: Dict[str, Tuple[int, Any]], need_value: bool = True) -> Tuple[int, Any]:
+        '''
+        Return (version, value) of a stage. Without need_value, a trimmed output that is
+        still valid is not recomputed and its value is _TRIMMED. resolved memoises the
+        stages already checked during one get.
+        '''
+        if name in self._inputs:
+            return self._inputs[name]
+        known = resolved.get(name)
+        if known is not None and (not need_value or known[1] is not _TRIMMED):
+            return known
+        stage = self.stages[name]
+
+        versions = tuple(self._evaluate(input_name, resolved, need_value=False)[0] for input_name in stage.inputs)
+        param_values = {param: self.params[param] for param in stage.params}
+        signature = (versions, tuple(param_values.items()))
+
+        cached = self._cache.get(name)
+        if cached is not None and cached[0] == signature and (not need_value or cached[2] is not _TRIMMED):
+            resolved[name] = (cached[1], cached[2])
+            return resolved[name]
+
+        args = [self._evaluate(input_name, resolved)[1] for input_name in stage.inputs]
+        if self.profile_memory:
+            value, self.stage_memory[name] = profile_call(stage.func, *args, **param_values)
+        else:
+            value = stage.func(*args, **param_values)
+        if cached is not None and cached[0] == signature:
+            # Recomputed after a trim: same inputs, same output, so downstream stages stay valid
+            version = cached[1]
+        else:
+            version = cached[1] + 1 if cached is not None else 1
+        self._cache[name] = (signature, version, value)
+        self.last_run.append(name)
+        resolved[name] = (version, value)
+        return resolved[name]
+
+    def _check_free(self, name: str) -> None:
+        if name in self.stages or name in self._inputs:
+            raise ValueError(f"Stage or input '{name}' already exists")
+
+
+def _correct(img: np.ndarray, gain: Optional[np.ndarray]) -> np.ndarray:
+    """Apply the flat-field gain if one is set and matches the image."""
+    if gain is None or gain.shape != img.shape[:2]:
+        return img
+    return apply_gain(img, gain)
+
+def _to_intensity(img: np.ndarray) -> np.ndarray:
+    """Convert an RGB(A) image, as decoded by PIL, to a single channel in its own units, passing single channel images through."""
+    if img.ndim == 2:
+        return img
+    if img.shape[2] == 1:
+        return img[..., 0]
+    if img.dtype not in (np.uint8, np.uint16, np.float32):
+        img = img.astype(np.float32)
+    return cv2.cvtColor(img, cv2.COLOR_RGBA2GRAY if img.shape[2] == 4 else cv2.COLOR_RGB2GRAY)
+
+def _to_gray(intensity: np.ndarray, intensity_range: Optional[Tuple[float, float]]) -> np.ndarray:
+    """Scale the intensity to the uint8 range the segmentation stages work on.
+
+    8-bit data passes through unchanged unless a range is given. Other data is
+    stretched from intensity_range, or from its own minimum and maximum.
+    """
+    if intensity.dtype == np.uint8 and intensity_range is None:
+        return intensity
+    if intensity_range is None:
+        low, high = float(intensity.min()), float(intensity.max())
+    else:
+        low, high = intensity_range
+    scale = 255.0 / (high - low) if high > low else 0.0
+    scaled = (intensity.astype(np.float32) - np.float32(low)) * np.float32(scale)
+    np.clip(scaled, 0, 255, out=scaled)
+    return scaled.astype(np.uint8)
+
+def _make_kernel(kernel_size: int, kernel_shape: int) -> np.ndarray:
+    """Create the structuring element used by the morphological stages."""
+    return cv2.getStructuringElement(kernel_shape, (kernel_size, kernel_size))
+
+def _otsu(gray: np.ndarray, threshold: Optional[float]) -> np.ndarray:
+    """Binarise the grayscale image with Otsu's threshold, or a precomputed one in uint8 units if given."""
+    if threshold is not None:
+        return cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY)[1]
+    return cv2.threshold(gray, 0, 255, cv2.THRESH_OTSU)[1]
+
+def _opening(bin_img: np.ndarray, kernel: np.ndarray, open_iterations: int) -> np.ndarray:
+    """Remove small specks from the binary image."""
+    return cv2.morphologyEx(bin_img, cv2.MORPH_OPEN, kernel, iterations=open_iterations)
+
+def _distance(bin_img: np.ndarray) -> np.ndarray:
+    """Distance of each foreground pixel to the nearest background pixel."""
+    return cv2.distanceTransform(bin_img, cv2.DIST_L2, 5)
+
+def _sure_bg(bin_img: np.ndarray, kernel: np.ndarray, dilate_iterations: int) -> np.ndarray:
+    """Dilate the binary image to get the area that is certainly background outside of it."""
+    return cv2.dilate(bin_img, kernel, iterations=dilate_iterations)
+
+def _sure_fg(dist_transform: np.ndarray, fg_ratio: float, fg_distance: Optional[float]) -> np.ndarray:
+    """Threshold the distance transform to get the area that is certainly foreground.
+
+    The threshold is fg_distance pixels if given, otherwise fg_ratio times the largest distance in the image.
+    """
+    threshold = fg_distance if fg_distance is not None else fg_ratio * dist_transform.max()
+    return cv2.threshold(dist_transform, threshold, 255, cv2.THRESH_BINARY)[1].astype(np.uint8)
+
+def _markers(sure_fg: np.ndarray, sure_bg: np.ndarray) -> np.ndarray:
+    """Label the sure foreground and mark the unknown region with 0 for the watershed."""
+    unknown = cv2.subtract(sure_bg, sure_fg)
+    _, markers = cv2.connectedComponents(sure_fg)
+    markers += 1
+    markers[unknown == 255] = 0
+    return markers
+
+def _watershed(gray: np.ndarray, markers: np.ndarray) -> np.ndarray:
+    """Run the watershed on a copy of the markers so the cached markers stay untouched."""
+    return cv2.watershed(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), markers.copy())
+
+def _features(intensity: np.ndarray, wells_and_centers: List[Tuple[np.ndarray, Tuple[int, int]]]) -> List[float]:
+    """Mean intensity of every well, in the units of the (flat-field corrected) image."""
+    return [calculate_mean_intensity(intensity, contour) for contour, _ in wells_and_centers]
+
+
+def build_segmentation_pipeline() -> Pipeline:
+    """Build the well segmentation pipeline of process_test.py as a memoised DAG.
+
+    The pipeline has the inputs "image" (a grayscale or RGB(A) array of any bit depth, as
+    read_page returns it) and the optional "gain" (a flat-field gain of the image's size,
+    see flat_field.py), and the stages corrected, intensity, gray, kernel, binary, opened,
+    dist, sure_bg, sure_fg, markers, watershed, wells and features.
+
+    Wells are segmented on "gray", the intensity scaled to uint8, so the threshold
+    parameter is in uint8 units. The features are measured on "intensity", the corrected
+    image in its own units, so they can be compared across images.
+
+    Returns:
+        Pipeline: The configured pipeline.
+    """
+    pipeline = Pipeline()
+    pipeline.add_input("image")
+    pipeline.add_input("gain")
+    pipeline.add_stage("corrected", _correct, ["image", "gain"])
+    pipeline.add_stage("intensity", _to_intensity, ["corrected"])
+    pipeline.add_stage("gray", _to_gray, ["intensity"], {"intensity_range": None})
+    pipeline.add_stage("kernel", _make_kernel, params={"kernel_size": 5, "kernel_shape": cv2.MORPH_RECT})
+    pipeline.add_stage("binary", _otsu, ["gray"], {"threshold": None})
+    pipeline.add_stage("opened", _opening, ["binary", "kernel"], {"open_iterations": 2})
+    pipeline.add_stage("dist", _distance, ["opened"])
+    pipeline.add_stage("sure_bg", _sure_bg, ["opened", "kernel"], {"dilate_iterations": 1})
+    pipeline.add_stage("sure_fg", _sure_fg, ["dist"], {"fg_ratio": 0.01, "fg_distance": None})
+    pipeline.add_stage("markers", _markers, ["sure_fg", "sure_bg"])
+    pipeline.add_stage("watershed", _watershed, ["gray", "markers"])
+    pipeline.add_stage("wells", extract_contours_and_centers, ["watershed"], {"max_area": None})
+    pipeline.add_stage("features", _features, ["intensity", "wells"])
+    return pipeline
+
+def measurement_rows(pipeline: Pipeline) -> List[Tuple[int, Optional[int], float, float, float, float]]:
+    """Collect the wells and features of a pipeline run as rows for DatabaseManager.save_measurements.
+
+    Args:
+        pipeline (Pipeline): A pipeline built by build_segmentation_pipeline with its image input set.
+
+    Returns:
+        List[Tuple]: One (well_index, roi_id, center_x, center_y, area, mean_intensity) row per well,
+        numbered from 1 like annotate_wells. roi_id is None.
+    """
+    wells = pipeline.get("wells")
+    intensities = pipeline.get("features")
+    return [
+        (index, None, float(center[0]), float(center[1]), float(cv2.contourArea(contour)), float(intensity))
+        for index, ((contour, center), intensity) in enumerate(zip(wells, intensities), start=1)
+    ]
+
+def merge_regions(boxes: List[Tuple[int, int, int, int]]) -> List[Tuple[int, int, int, int]]:
+    """Merge overlapping (x0, y0, x1, y1) boxes until the result is disjoint.
+
+    Overlapping boxes are replaced by their common bounding box, which may overlap
+    further boxes, so merging repeats until nothing changes. Overlaps are found for all
+    pairs at once with NumPy, so a full plate of ROIs merges quickly.
+
+    Args:
+        boxes (List[Tuple[int, int, int, int]]): Boxes to merge.
+
+    Returns:
+        List[Tuple[int, int, int, int]]: Disjoint boxes covering every input box.
+    """
+    regions = np.array(boxes, dtype=np.int64).reshape(-1, 4)
+    while len(regions) > 1:
+        overlap = (
+            (regions[:, None, 0] < regions[None, :, 2]) & (regions[None, :, 0] < regions[:, None, 2])
+            & (regions[:, None, 1] < regions[None, :, 3]) & (regions[None, :, 1] < regions[:, None, 3])
+        )
+        # Label connected groups of overlapping boxes by propagating the smallest index
+        labels = np.arange(len(regions))
+        while True:
+            updated = np.where(overlap, labels[None, :], len(regions)).min(axis=1)
+            if np.array_equal(updated, labels):
+                break
+            labels = updated
+        groups = np.unique(labels)
+        if len(groups) == len(regions):
+            break
+        regions = np.array([
+            (*regions[labels == group, :2].min(axis=0), *regions[labels == group, 2:].max(axis=0))
+            for group in groups
+        ])
+    return [tuple(int(v) for v in region) for region in regions]
+
+def roi_regions(rois: List[dict], width: int, height: int, padding: int, merge: bool = True) -> List[Tuple[int, int, int, int]]:
+    """Return the disjoint regions covering every ROI's bounding box grown by padding, clipped to the image.
+
+    With merge=False the padded boxes are returned one per ROI, without merging overlaps.
+    Incomplete ROIs (see roi_masks.is_complete_roi) are left out.
+    """
+    from roi_masks import is_complete_roi, roi_bbox
+
+    boxes = []
+    for roi in rois:
+        bbox = roi_bbox(roi, width, height) if is_complete_roi(roi) else None
+        if bbox is None:
+            continue
+        x0, y0, x1, y1 = bbox
+        boxes.append((max(0, x0 - padding), max(0, y0 - padding), min(width, x1 + padding), min(height, y1 + padding)))
+    return merge_regions(boxes) if boxes and merge else boxes
+
+def morphology_padding(pipeline: Pipeline) -> int:
+    """Padding around ROIs that keeps the morphological stages unaffected by the crop border."""
+    params = pipeline.params
+    return params["kernel_size"] * (params["open_iterations"] + params["dilate_iterations"]) + params["kernel_size"]
+
+def roi_measurement_rows(
+    image: np.ndarray,
+    roi_records: List[Tuple[int, dict]],
+    pipeline: Optional[Pipeline] = None,
+    gain: Optional[np.ndarray] = None,
+    padding: Optional[int] = None,
+) -> List[Tuple[int, Optional[int], float, float, float, float]]:
+    """Segment and measure wells only within the stored ROIs instead of the whole frame.
+
+    The segmentation runs once per region of the merged, padded ROI bounding boxes.
+    The quantities the full-frame pipeline derives from the whole image (the uint8
+    intensity scaling, the Otsu threshold and the sure foreground distance) are
+    computed jointly over the padded ROI boxes only, not over the regions they were
+    merged into, so merging or splitting regions does not change them. Wells are measured on the raw pixels, flat-field corrected if a
+    gain is given, so their intensities are in the image's own units. Each well is
+    assigned to the ROI containing its centre; wells outside every ROI are dropped.
+
+    Args:
+        image (np.ndarray): The full frame, of any dtype. Only the regions are read.
+        roi_records (List[Tuple[int, dict]]): (roi_id, roi) pairs from roi_table.
+        pipeline (Optional[Pipeline]): Segmentation pipeline whose parameters are used, the defaults if None.
+        gain (Optional[np.ndarray]): Flat-field gain of the frame's size.
+        padding (Optional[int]): Padding around each ROI, morphology_padding by default.
+
+    Returns:
+        List[Tuple]: (well_index, roi_id, center_x, center_y, area, mean_intensity) rows in frame coordinates,
+        numbered from 1.
+    """
+    from roi_masks import MaskCache, is_complete_roi
+
+    params = dict(pipeline.params) if pipeline is not None else {}
+    template = build_segmentation_pipeline()
+    template.set_params(**params)
+    params = template.params
+    padding = morphology_padding(template) if padding is None else padding
+    height, width = image.shape[:2]
+    rois = [roi for _, roi in roi_records]
+    regions = roi_regions(rois, width, height, padding)
+    if not regions:
+        return []
+    boxes = roi_regions(rois, width, height, padding, merge=False)
+
+    # One pipeline per region, so each stage runs once per region while the joint values are collected
+    pipelines = []
+    inside = []
+    for x0, y0, x1, y1 in regions:
+        # Pixels of the region that lie in a padded ROI box
+        covered = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        for bx0, by0, bx1, by1 in boxes:
+            if x0 <= bx0 and bx1 <= x1 and y0 <= by0 and by1 <= y1:
+                covered[by0 - y0:by1 - y0, bx0 - x0:bx1 - x0] = True
+        inside.append(covered)
+        region_pipeline = build_segmentation_pipeline()
+        region_pipeline.set_params(**params)
+        region_pipeline.set_input("gain", None if gain is None else gain[y0:y1, x0:x1])
+        region_pipeline.set_input("image", image[y0:y1, x0:x1])
+        pipelines.append(region_pipeline)
+
+    try:
+        joint = {}
+        if params["intensity_range"] is None and image.dtype != np.uint8:
+            values = [region_pipeline.get("intensity")[covered] for region_pipeline, covered in zip(pipelines, inside)]
+            joint["intensity_range"] = (
+                min(float(value.min()) for value in values),
+                max(float(value.max()) for value in values),
+            )
+            del values
+
+        if params["threshold"] is None:
+            histogram = np.zeros(256, dtype=np.float64)
+            for region_pipeline, covered in zip(pipelines, inside):
+                region_pipeline.set_params(**joint)
+                histogram += np.bincount(region_pipeline.get("gray")[covered], minlength=256)
+            joint["threshold"] = otsu_from_histogram(histogram)
+
+        if params["fg_distance"] is None:
+            largest = 0.0
+            for region_pipeline, covered in zip(pipelines, inside):
+                region_pipeline.set_params(**joint)
+                largest = max(largest, float(region_pipeline.get("dist")[covered].max()))
+            joint["fg_distance"] = params["fg_ratio"] * largest
+
+        for region_pipeline in pipelines:
+            region_pipeline.set_params(**joint)
+
+        masks = MaskCache()
+        bboxes = [masks.get(roi, width, height) if is_complete_roi(roi) else (None, None) for _, roi in roi_records]
+        rows = []
+        for (x0, y0, x1, y1), region_pipeline in zip(regions, pipelines):
+            # Map of which ROI covers each pixel of the region, 0 outside every ROI
+            roi_map = np.zeros((y1 - y0, x1 - x0), dtype=np.int32)
+            for index, (bbox, mask) in enumerate(bboxes, start=1):
+                if bbox is None or not (x0 <= bbox[0] and bbox[2] <= x1 and y0 <= bbox[1] and bbox[3] <= y1):
+                    continue
+                target = roi_map[bbox[1] - y0:bbox[3] - y0, bbox[0] - x0:bbox[2] - x0]
+                target[mask > 0] = index
+
+            for (contour, center), intensity in zip(region_pipeline.get("wells"), region_pipeline.get("features")):
+                index = roi_map[center[1], center[0]]
+                if index == 0:
+                    continue
+                rows.append((
+                    len(rows) + 1,
+                    roi_records[index - 1][0],
+                    float(center[0] + x0),
+                    float(center[1] + y0),
+                    float(cv2.contourArea(contour)),
+                    float(intensity),
+                ))
+            # Free the region's stages before the next one runs
+            region_pipeline.invalidate()
+    finally:
+        for region_pipeline in pipelines:
+            region_pipeline.invalidate()
+            region_pipeline.set_input("gain", None)
+            region_pipeline.set_input("image", None)
+    return rows
+
+def segment_project_rois(token, progress, db_manager, flat_field=None, page: int = 0) -> int:
+    """Scheduler job segmenting the wells inside the project's ROIs on every image.
+
+    Measurements are stored with their ROI, so they join to the drug in roi_table.
+
+    Args:
+        token (CancelToken): Cancellation token of the job.
+        progress (Callable[[int, int], None]): Progress callback of the job.
+        db_manager (DatabaseManager): The project database.
+        flat_field (Optional[FlatField]): Flat-field correction applied to images of its size.
+        page (int): Page (channel) of the images to analyse.
+
+    Returns:
+        int: The number of images analysed.
+    """
+    from multipage import read_page
+    from roi_masks import is_complete_roi
+
+    # ROIs without an end point or without an area would fail the whole run
+    roi_records = [(record[0], record[2]) for record in db_manager.get_roi_records() if is_complete_roi(record[2])]
+    images = db_manager.get_images()
+    pipeline = build_segmentation_pipeline()
+    done = 0
+    for image_id, image_path in images:
+        token.raise_if_cancelled()
+        try:
+            image = read_page(image_path, page)
+        except OSError as e:
+            print(f"Could not read {image_path}: {e}")
+            continue
+        gain = None
+        if flat_field is not None and flat_field.matches(image.shape[1], image.shape[0]):
+            gain = flat_field.gain
+        db_manager.save_measurements(image_id, roi_measurement_rows(image, roi_records, pipeline, gain), "roi_wells", page)
+        memory.enforce(LOCKED_SUBSYSTEMS)
+        done += 1
+        progress(done, len(images))
+    return done
+
+def segment_project(token, progress, db_manager, flat_field=None, max_workers: Optional[int] = None, page: int = 0) -> int:
+    """Scheduler job segmenting every project image as a whole frame in worker processes.
+
+    Frames are published once into shared memory and the workers attach to them, so
+    no pixel data is pickled. At most two frames per worker are in flight, which
+    bounds the shared memory in use. A cancelled job stops submitting, cancels the
+    frames still queued and waits for the running ones before the segments are unlinked.
+
+    Args:
+        token (CancelToken): Cancellation token of the job.
+        progress (Callable[[int, int], None]): Progress callback of the job.
+        db_manager (DatabaseManager): The project database.
+        flat_field (Optional[FlatField]): Flat-field correction applied to images of its size.
+        max_workers (Optional[int]): Worker processes, by default one less than the CPU count (at most 4).
+        page (int): Page (channel) of the images to analyse.
+
+    Returns:
+        int: The number of images segmented.
+    """
+    from multipage import read_page
+    from shared_frames import FrameRegistry, segment_shared
+
+    images = db_manager.get_images()
+    max_workers = max_workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+    registry = FrameRegistry()
+    gain = None
+    pending = {}
+    done = 0
+    # Spawned rather than forked: the application's other threads must not be copied into workers
+    pool = ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def collect():
+        nonlocal done
+        finished, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+        token.raise_if_cancelled()
+        for future in finished:
+            image_id, frame = pending.pop(future)
+            registry.release(frame)
+            db_manager.save_measurements(image_id, future.result(), "wells", page)
+            memory.enforce(LOCKED_SUBSYSTEMS)
+            done += 1
+            progress(done, len(images))
+
+    try:
+        for image_id, image_path in images:
+            while len(pending) >= max_workers * 2:
+                collect()
+            token.raise_if_cancelled()
+            try:
+                image = read_page(image_path, page)
+            except OSError as e:
+                print(f"Could not read {image_path}: {e}")
+                continue
+            frame_gain = None
+            if flat_field is not None and flat_field.matches(image.shape[1], image.shape[0]):
+                if gain is None:
+                    gain = registry.publish(flat_field.gain)
+                frame_gain = gain
+            frame = registry.publish(image)
+            del image
+            pending[pool.submit(segment_shared, frame, None, None, frame_gain)] = (image_id, frame)
+        while pending:
+            collect()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        registry.close()
+    return done
@@ -0,0 +1,84 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+# Rows and columns of the standard SBS microplate formats
+PLATE_FORMATS: Dict[int, Tuple[int, int]] = {
+    96: (8, 12),
+    384: (16, 24),
+    1536: (32, 48),
+}
+
+# Smallest well pitch in image pixels; a shorter drag (e.g. a click) cannot place a plate
+MIN_WELL_PITCH = 2.0
+
+def row_name(row: int) -> str:
+    """Return the plate row letter for a zero based row index (A..Z, then AA, AB, ...)."""
+    name = ""
+    row += 1
+    while row > 0:
+        row, remainder = divmod(row - 1, 26)
+        name = chr(ord("A") + remainder) + name
+    return name
+
+def well_name(row: int, column: int) -> str:
+    """Return the well ID, e.g. "A1", for zero based row and column indices."""
+    return f"{row_name(row)}{column + 1}"
+
+def generate_plate_rois(
+    plate_format: int,
+    first_center: Sequence[float],
+    last_center: Sequence[float],
+    well_size: Optional[float] = None,
+) -> List[dict]:
+    """Generate a rectangular ROI for every well of a plate from the centres of its corner wells.
+
+    Args:
+        plate_format (int): Number of wells on the plate, one of PLATE_FORMATS.
+        first_center (Sequence[float]): Image coordinates of the centre of well A1.
+        last_center (Sequence[float]): Image coordinates of the centre of the last well (e.g. H12).
+        well_size (Optional[float]): Side length of each ROI. Defaults to 80% of the smaller well pitch.
+
+    Returns:
+        List[dict]: ROIs in row-major order as {"start", "end", "well"} dicts, with points
+        stored as homogeneous image coordinates like the ROIs drawn on the canvas.
+
+    Raises:
+        ValueError: If the format is unknown or the layout is degenerate, i.e. the corner wells
+            are less than MIN_WELL_PITCH per well apart in either direction, or the well size
+            is not positive.
+    """
+    if plate_format not in PLATE_FORMATS:
+        raise ValueError(f"Unsupported plate format: {plate_format}")
+    rows, columns = PLATE_FORMATS[plate_format]
+    if rows < 2 or columns < 2:
+        raise ValueError(f"A {rows}x{columns} plate cannot be placed from its corner wells")
+
+    x0, y0 = float(first_center[0]), float(first_center[1])
+    x1, y1 = float(last_center[0]), float(last_center[1])
+    pitch_x = (x1 - x0) / (columns - 1)
+    pitch_y = (y1 - y0) / (rows - 1)
+    if not min(abs(pitch_x), abs(pitch_y)) >= MIN_WELL_PITCH:
+        raise ValueError(
+            f"Well pitch of {abs(pitch_x):.1f} x {abs(pitch_y):.1f} pixels is below {MIN_WELL_PITCH:g}; "
+            f"drag from the centre of A1 to the centre of {well_name(rows - 1, columns - 1)}"
+        )
+    if well_size is None:
+        well_size = 0.8 * min(abs(pitch_x), abs(pitch_y))
+    elif not well_size > 0:
+        raise ValueError(f"Well size must be positive, got {well_size}")
+    half = well_size / 2
+
+    # Compute all centres at once, row-major
+    grid_y, grid_x = np.mgrid[0:rows, 0:columns]
+    centers_x = (x0 + grid_x * pitch_x).ravel()
+    centers_y = (y0 + grid_y * pitch_y).ravel()
+
+    rois = []
+    for index, (cx, cy) in enumerate(zip(centers_x, centers_y)):
+        row, column = divmod(index, columns)
+        rois.append({
+            "start": np.array([cx - half, cy - half, 1.]),
+            "end": np.array([cx + half, cy + half, 1.]),
+            "well": well_name(row, column),
+        })
+    return rois
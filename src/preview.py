@@ -0,0 +1,193 @@
+from typing import Optional, Tuple
+import threading
+from PIL import Image
+import numpy as np
+import cv2
+from pipeline import build_segmentation_pipeline
+from scheduler import PREVIEW
+
+
+class SegmentationPreview:
+    '''
+    Runs the segmentation pipeline on the visible part of an ImageCanvas in the
+    background and keeps the latest result as a semi-transparent overlay.
+
+    Only the viewport is analysed, resampled to the current zoom, so the cost of a
+    preview depends on the canvas size rather than the image size. Previews run as
+    PREVIEW jobs of the application's JobScheduler, ahead of everything else, and
+    every pan or zoom cancels the previous job.
+    '''
+    # Modes decoded as single channel samples in their own units, which the pipeline scales itself
+    RAW_MODES = ("L", "I", "F", "I;16", "I;16B", "I;16L", "I;16N")
+
+    STAGES = ("corrected", "intensity", "gray", "binary", "opened", "dist", "sure_bg", "sure_fg", "markers", "watershed")
+
+    def __init__(self, canvas, scheduler, alpha: float = 0.45, colour: Tuple[int, int, int] = (0, 255, 0)):
+        self.canvas = canvas
+        self.scheduler = scheduler
+        self.alpha = alpha
+        self.colour = colour
+
+        self._pipeline = build_segmentation_pipeline()
+        # A cancelled job may still be finishing a stage when the next one starts
+        self._pipeline_lock = threading.Lock()
+        self._params = {}
+        self._job = None
+        self._requested = None
+        self._overlay = None
+        self._overlay_image = None
+
+    def request(self, pil_image: Image.Image, mat_affine: np.ndarray, canvas_size: Tuple[int, int], flat_field=None) -> None:
+        '''
+        Start a preview job for the current viewport unless one for the same viewport
+        is already running or done. Any older job is cancelled, but its overlay stays on
+        screen until the new one arrives, so panning and zooming do not flicker. If a
+        FlatField is given, the visible region is flat-field corrected before it is segmented.
+        '''
+        viewport = self._viewport(pil_image, mat_affine, canvas_size)
+        if viewport is None:
+            self.cancel()
+            return
+        key = (id(pil_image), viewport, id(flat_field))
+        if key == self._requested:
+            return
+
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+        if self._overlay_image != id(pil_image):
+            # The overlay of another image would be misleading
+            self._overlay = None
+        self._requested = key
+        self._job = self.scheduler.submit(
+            "Preview", self._run, pil_image, viewport, flat_field, priority=PREVIEW, on_done=self._deliver
+        )
+
+    def cancel(self) -> None:
+        '''
+        Cancel the pending job and drop the current overlay.
+        '''
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+        self._requested = None
+        self._overlay = None
+        self._overlay_image = None
+
+    def set_params(self, **params) -> None:
+        '''
+        Update segmentation parameters and recompute the preview on the next request.
+        '''
+        with self._pipeline_lock:
+            self._params.update(params)
+        self.cancel()
+
+    def composite(self, dst: Image.Image, mat_affine: np.ndarray) -> Image.Image:
+        '''
+        Paste the latest overlay onto the rendered canvas image.
+
+        An overlay computed at another zoom is scaled to the current one until its replacement arrives.
+        '''
+        if self._overlay is None:
+            return dst
+        box, overlay = self._overlay
+        x, y = np.dot(mat_affine, (box[0], box[1], 1.))[:2]
+        x1, y1 = np.dot(mat_affine, (box[2], box[3], 1.))[:2]
+        size = (max(1, int(round(x1 - x))), max(1, int(round(y1 - y))))
+        if size != overlay.size:
+            if size[0] * size[1] > dst.width * dst.height * 4:
+                # Zoomed far in on a stale overlay: not worth a huge resize
+                return dst
+            overlay = overlay.resize(size, Image.NEAREST)
+        if dst.mode != "RGB":
+            dst = dst.convert("RGB")
+        dst.paste(overlay, (int(round(x)), int(round(y))), overlay)
+        return dst
+
+    def shutdown(self) -> None:
+        '''
+        Cancel the pending job.
+        '''
+        self.cancel()
+
+    def _viewport(self, pil_image, mat_affine, canvas_size) -> Optional[tuple]:
+        '''
+        Return the visible image box, the size it is analysed at and the size it is displayed at on the canvas.
+        '''
+        canvas_width, canvas_height = canvas_size
+        mat_inv = np.linalg.inv(mat_affine)
+        x0, y0 = np.dot(mat_inv, (0., 0., 1.))[:2]
+        x1, y1 = np.dot(mat_inv, (float(canvas_width), float(canvas_height), 1.))[:2]
+
+        left = max(0, int(np.floor(x0)))
+        top = max(0, int(np.floor(y0)))
+        right = min(pil_image.width, int(np.ceil(x1)))
+        bottom = min(pil_image.height, int(np.ceil(y1)))
+        if right <= left or bottom <= top:
+            return None
+
+        # Analyse at the displayed resolution, but never upsample past 1:1
+        scale = mat_affine[0, 0]
+        display_size = (
+            max(1, int(round((right - left) * scale))),
+            max(1, int(round((bottom - top) * scale))),
+        )
+        size = (min(right - left, display_size[0]), min(bottom - top, display_size[1]))
+        return (left, top, right, bottom), size, display_size
+
+    def _run(self, token, progress, pil_image, viewport, flat_field) -> Tuple[tuple, Image.Image]:
+        '''
+        Scheduler job segmenting the viewport and returning the box and overlay image.
+        '''
+        box, size, display_size = viewport
+        if pil_image.mode in self.RAW_MODES:
+            # Resampled in the data's own units; the pipeline's gray stage stretches any bit depth to uint8
+            region = np.asarray(pil_image.crop(box))
+            if region.dtype not in (np.uint8, np.uint16, np.float32):
+                region = region.astype(np.float32)
+            if region.shape[1::-1] != size:
+                region = cv2.resize(region, size, interpolation=cv2.INTER_AREA)
+        else:
+            # Palette and colour images
+            region = np.asarray(pil_image.resize(size, Image.BILINEAR, box=box, reducing_gap=2.0).convert("L"))
+
+        gain = None
+        if flat_field is not None and flat_field.matches(pil_image.width, pil_image.height):
+            gain = flat_field.region(box, size)
+        with self._pipeline_lock:
+            if self._params:
+                self._pipeline.set_params(**self._params)
+                self._params = {}
+            self._pipeline.set_input("gain", gain)
+            self._pipeline.set_input("image", region)
+            for index, stage in enumerate(self.STAGES):
+                progress(index, len(self.STAGES))
+                self._pipeline.get(stage)
+            watershed = self._pipeline.get("watershed")
+
+        overlay = self._render_overlay(watershed)
+        if overlay.size != display_size:
+            overlay = overlay.resize(display_size, Image.NEAREST)
+        return box, overlay
+
+    def _deliver(self, job) -> None:
+        '''
+        Runs on the Tk thread: show the overlay of the latest job.
+        '''
+        if job is not self._job or job.state != "done":
+            return
+        self._job = None
+        self._overlay = job.result
+        self._overlay_image = self._requested[0]
+        self.canvas._draw_image()
+
+    def _render_overlay(self, markers: np.ndarray) -> Image.Image:
+        '''
+        Colour segmented wells and draw their boundaries into an RGBA image.
+        '''
+        rgba = np.zeros(markers.shape + (4,), dtype=np.uint8)
+        rgba[..., :3] = self.colour
+        wells = markers > 1
+        rgba[wells, 3] = int(255 * self.alpha)
+        rgba[markers == -1, 3] = 255
+        return Image.fromarray(rgba)
@@ -1,6 +1,4 @@
 from typing import Optional, Tuple, List
-import plotly.express as px
-import pandas as pd
 import numpy as np
 import cv2
 
@@ -39,23 +37,30 @@ def extract_contours_and_centers(markers: np.ndarray, max_area: Optional[float]
                     wells_and_centers.append((contour, center))
     return wells_and_centers
 
-def annotate_wells(img: np.ndarray, wells_and_centers: List[Tuple[np.ndarray, Tuple[int, int]]]) -> np.ndarray:
-    """Annotate the image with well IDs based on their contours and centers."""
-    annotated_image = img.copy()
+def annotate_wells(img: np.ndarray, wells_and_centers: List[Tuple[np.ndarray, Tuple[int, int]]], in_place: bool = False) -> np.ndarray:
+    """Annotate the image with well IDs based on their contours and centers.
+
+    A copy of the full frame is drawn on unless in_place is set, which draws on img itself.
+    """
+    annotated_image = img if in_place else img.copy()
     for index, (contour, center) in enumerate(wells_and_centers, start=1):
         cv2.drawContours(annotated_image, [contour], -1, (0, 255, 0), 2)
         cv2.putText(annotated_image, str(index), center, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
     return annotated_image
 
 def calculate_mean_intensity(img: np.ndarray, contour: np.ndarray) -> float:
-    """Calculate the mean intensity of the area inside the given contour."""
-    mask = np.zeros_like(img)
-    cv2.drawContours(mask, [contour], -1, 255, -1)
-    mean_val = cv2.mean(img, mask=mask)[0]
+    """Calculate the mean intensity of the area inside the given contour, rasterising it only within its bounding box."""
+    x, y, w, h = cv2.boundingRect(contour)
+    mask = np.zeros((h, w), dtype=np.uint8)
+    cv2.drawContours(mask, [contour], -1, 255, -1, offset=(-x, -y))
+    mean_val = cv2.mean(img[y:y + h, x:x + w], mask=mask)[0]
     return mean_val
 
 
 if __name__ == "__main__":
+    import plotly.express as px
+    import pandas as pd
+
     # Usage of the functions
     img = load_image("assets/array.jpg")
     gray, bin_img, kernel = preprocess_image(img)
@@ -69,7 +74,8 @@ if __name__ == "__main__":
 
     MAX_CONTOUR_AREA = 1000
     wells_and_centers = extract_contours_and_centers(markers, max_area=MAX_CONTOUR_AREA)
-    annotated_image = annotate_wells(img, wells_and_centers)
+    # img is not needed afterwards, so annotate it without a second full-frame copy
+    annotated_image = annotate_wells(img, wells_and_centers, in_place=True)
     cv2.imwrite("annotated_image.png", annotated_image)
 
     wells, centers = zip(*wells_and_centers)
@@ -0,0 +1,115 @@
+from typing import List, Optional, Tuple
+import math
+from PIL import Image
+import numpy as np
+import cv2
+from display import to_display_array
+from memory import memory
+
+# Quality tiers of ViewportRenderer.render
+FAST = "fast"
+FINE = "fine"
+
+
+class ViewportRenderer:
+    '''
+    Renders the visible part of an image into a reused NumPy buffer with cv2.warpAffine.
+
+    Two quality tiers are available. FAST uses nearest neighbour sampling from the
+    finest already built pyramid level and is meant for frames drawn while the user
+    drags or zooms. FINE first builds (and caches) a pyramid level downsampled with
+    INTER_AREA close to the display scale and then samples it linearly, so zoomed
+    out views average small bright spots instead of skipping them.
+    '''
+    def __init__(self):
+        self.pil_image: Optional[Image.Image] = None
+        self._levels: List[Optional[np.ndarray]] = []
+        self._buffer: Optional[np.ndarray] = None
+        memory.register("pyramids", self)
+
+    def set_image(self, pil_image: Image.Image) -> None:
+        '''
+        Set the source image. Its pixel data is converted lazily on the first render.
+        '''
+        self.pil_image = pil_image
+        self._levels = []
+
+    def level(self, index: int) -> np.ndarray:
+        '''
+        Return pyramid level index (downscaled by 2**index), building it from the level above if needed.
+        '''
+        if not self._levels:
+            self._levels = [to_display_array(self.pil_image)]
+        while len(self._levels) <= index:
+            previous = self._levels[-1]
+            height, width = previous.shape[:2]
+            if width < 2 or height < 2:
+                return previous
+            size = (max(1, width // 2), max(1, height // 2))
+            self._levels.append(cv2.resize(previous, size, interpolation=cv2.INTER_AREA))
+        return self._levels[index]
+
+    def nbytes(self) -> int:
+        '''
+        Bytes held by the pyramid levels and the viewport buffer.
+        '''
+        held = sum(level.nbytes for level in list(self._levels) if level is not None)
+        return held + (self._buffer.nbytes if self._buffer is not None else 0)
+
+    def trim(self, max_bytes: int) -> int:
+        '''
+        Drop the pyramid if more than max_bytes are held; levels are rebuilt on the next render.
+        '''
+        levels = self._levels
+        if self.nbytes() <= max_bytes or not levels:
+            return 0
+        self._levels = []
+        return sum(level.nbytes for level in levels if level is not None)
+
+    def level_for_scale(self, scale: float) -> int:
+        '''
+        Return the coarsest pyramid level that still has at least one pixel per canvas pixel.
+        '''
+        if scale >= 1.0:
+            return 0
+        return int(math.floor(math.log2(1.0 / scale)))
+
+    def render(self, mat_affine: np.ndarray, size: Tuple[int, int], quality: str = FINE) -> np.ndarray:
+        '''
+        Render the viewport of the given canvas size for the image to canvas transform.
+
+        The returned array is a reused buffer and is overwritten by the next call.
+        '''
+        scale = math.sqrt(abs(np.linalg.det(mat_affine[:2, :2])))
+        target = self.level_for_scale(scale)
+        if quality == FAST:
+            # Only use levels that are already built, so interaction never waits for a resize
+            index = min(target, max(len(self._levels) - 1, 0))
+            interpolation = cv2.INTER_NEAREST
+        else:
+            index = target
+            interpolation = cv2.INTER_LINEAR
+        source = self.level(index)
+
+        # Level pixels to canvas pixels. OpenCV puts pixel centres on integer coordinates,
+        # while mat_affine (like PIL) works on pixel corners, hence the half pixel shifts.
+        factor_x = self.pil_image.width / source.shape[1]
+        factor_y = self.pil_image.height / source.shape[0]
+        to_corner = np.array([[1.0, 0.0, 0.5], [0.0, 1.0, 0.5], [0.0, 0.0, 1.0]])
+        to_center = np.array([[1.0, 0.0, -0.5], [0.0, 1.0, -0.5], [0.0, 0.0, 1.0]])
+        mat = to_center @ mat_affine @ np.diag([factor_x, factor_y, 1.0]) @ to_corner
+
+        width, height = size
+        shape = (height, width) + source.shape[2:]
+        if self._buffer is None or self._buffer.shape != shape or self._buffer.dtype != source.dtype:
+            self._buffer = np.empty(shape, dtype=source.dtype)
+        cv2.warpAffine(
+            source,
+            mat[:2],
+            (width, height),
+            dst=self._buffer,
+            flags=interpolation,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=0,
+        )
+        return self._buffer
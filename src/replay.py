@@ -0,0 +1,401 @@
+from typing import Dict, List, Optional, Tuple
+from collections import Counter
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import time
+import tkinter as tk
+import numpy as np
+from memory import memory, format_report
+
+# Event mask bits of Tk's event state
+CONTROL_MASK = 0x0004
+BUTTON1_MASK = 0x0100
+
+# Display refresh interval frames are measured against
+FRAME_BUDGET_MS = 1000 / 60
+
+RECORDING_VERSION = 1
+
+# X display Xvfb is started on when there is none, overridden by --xvfb-display or this variable
+DEFAULT_XVFB_DISPLAY = ":97"
+XVFB_DISPLAY_ENV = "FLORO_XVFB_DISPLAY"
+
+
+class InteractionRecorder:
+    '''
+    Records the raw mouse events a widget receives to a JSON lines file.
+
+    The first line is a header with the canvas size and view transform at the start
+    of the recording, followed by one line per event with its time offset. Events
+    are captured through a bind tag placed in front of the widget's own, so the
+    recorder sees every event (including double clicks) without changing how the
+    widget handles them.
+    '''
+    TAG = "FloroRecorder"
+
+    def __init__(self, canvas, path: str, image_path: Optional[str] = None):
+        self.canvas = canvas
+        self.path = path
+        self.count = 0
+        self._file = open(path, "w")
+        self._start = time.perf_counter()
+        header = {
+            "version": RECORDING_VERSION,
+            "image": image_path,
+            "canvas_size": [canvas.winfo_width(), canvas.winfo_height()],
+            "mat_affine": np.asarray(canvas.mat_affine).tolist(),
+        }
+        self._file.write(json.dumps(header) + "\n")
+
+        canvas.bind_class(self.TAG, "<ButtonPress>", lambda event: self._record("press", event))
+        canvas.bind_class(self.TAG, "<ButtonRelease>", lambda event: self._record("release", event))
+        canvas.bind_class(self.TAG, "<Motion>", lambda event: self._record("motion", event))
+        canvas.bind_class(self.TAG, "<MouseWheel>", lambda event: self._record("wheel", event))
+        canvas.bindtags((self.TAG,) + canvas.bindtags())
+
+    def _record(self, kind: str, event) -> None:
+        entry = {
+            "t": round(time.perf_counter() - self._start, 6),
+            "type": kind,
+            "x": event.x,
+            "y": event.y,
+            "state": event.state if isinstance(event.state, int) else 0,
+            "time": event.time,
+        }
+        if kind in ("press", "release"):
+            entry["num"] = event.num
+        elif kind == "wheel":
+            entry["delta"] = event.delta
+        self._file.write(json.dumps(entry) + "\n")
+        self.count += 1
+
+    def close(self) -> None:
+        '''
+        Stop recording and close the file.
+        '''
+        self.canvas.bindtags(tuple(tag for tag in self.canvas.bindtags() if tag != self.TAG))
+        self.canvas.unbind_class(self.TAG, "<ButtonPress>")
+        self.canvas.unbind_class(self.TAG, "<ButtonRelease>")
+        self.canvas.unbind_class(self.TAG, "<Motion>")
+        self.canvas.unbind_class(self.TAG, "<MouseWheel>")
+        self._file.close()
+
+
+def load_recording(path: str) -> Tuple[dict, List[dict]]:
+    """Read a recording written by InteractionRecorder.
+
+    Args:
+        path (str): Path of the recording.
+
+    Returns:
+        Tuple[dict, List[dict]]: The header and the events in order.
+    """
+    with open(path) as f:
+        header = json.loads(f.readline())
+        events = [json.loads(line) for line in f if line.strip()]
+    if header.get("version") != RECORDING_VERSION:
+        raise ValueError(f"Unsupported recording version {header.get('version')} in {path}")
+    return header, events
+
+def synthetic_session(canvas_size: Tuple[int, int], rate: float = 120.0) -> Tuple[dict, List[dict]]:
+    """Build a representative session for when no recording is at hand.
+
+    The session pans across the image, zooms in and out with the wheel, draws an ROI
+    with Ctrl+drag and sweeps the pointer over the canvas to trigger ROI hover.
+
+    Args:
+        canvas_size (Tuple[int, int]): Canvas width and height.
+        rate (float): Events per second, roughly a mouse's motion event rate.
+
+    Returns:
+        Tuple[dict, List[dict]]: A header and events in the recording format.
+    """
+    width, height = canvas_size
+    events = []
+
+    def add(kind, x, y, state=0, **extra):
+        t = len(events) / rate
+        events.append({"t": t, "type": kind, "x": int(x), "y": int(y), "state": state, "time": int(t * 1000), **extra})
+
+    def drag(start, end, state=0, steps=60):
+        add("press", *start, state=state, num=1)
+        for x, y in np.linspace(start, end, steps):
+            add("motion", x, y, state=state | BUTTON1_MASK)
+        add("release", *end, state=state | BUTTON1_MASK, num=1)
+
+    center = (width // 2, height // 2)
+    drag(center, (width * 3 // 4, height * 3 // 4))
+    drag((width * 3 // 4, height * 3 // 4), center)
+    for delta in [-120] * 6 + [120] * 6:
+        add("wheel", *center, delta=delta)
+    drag((width // 3, height // 3), (width // 2, height // 2), state=CONTROL_MASK)
+    for x, y in np.linspace((0, 0), (width - 1, height - 1), 240):
+        add("motion", x, y)
+    header = {"version": RECORDING_VERSION, "image": None, "canvas_size": [width, height], "mat_affine": None}
+    return header, events
+
+
+class _CountingTk:
+    '''
+    Stands in for a widget's Tcl interpreter and counts the commands the widget sends through it.
+    '''
+    def __init__(self, tk_app, widget_path: str):
+        self._tk = tk_app
+        self._path = widget_path
+        self.calls = Counter()
+
+    def call(self, *args):
+        if len(args) == 1 and isinstance(args[0], tuple):
+            args = args[0]
+        if args:
+            # Canvas commands are "<path> <subcommand> ...", count them by subcommand
+            name = f"canvas {args[1]}" if args[0] == self._path and len(args) > 1 else str(args[0])
+            self.calls[name] += 1
+        return self._tk.call(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._tk, name)
+
+
+class ReplayHost(tk.Tk):
+    '''
+    A bare window hosting an ImageCanvas for replay, standing in for the Application
+    the canvas reports new ROIs to.
+    '''
+    def __init__(self, canvas_size: Tuple[int, int]):
+        super().__init__()
+        from image_canvas import ImageCanvas
+
+        width, height = canvas_size
+        self.geometry(f"{width}x{height}+0+0")
+        frame = tk.Frame(self)
+        frame.pack(expand=True, fill="both")
+        self.canvas = ImageCanvas(frame, frontend=None, width=width, height=height, background="black", highlightthickness=0)
+        self.canvas.pack(expand=True, fill="both")
+
+    def add_roi(self, roi):
+        pass
+
+    def add_rois(self, rois):
+        pass
+
+    def delete_roi(self, roi):
+        pass
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    values = np.asarray(values)
+    return {
+        "mean": round(float(values.mean()), 3),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p90": round(float(np.percentile(values, 90)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+        "max": round(float(values.max()), 3),
+    }
+
+def replay(
+    header: dict,
+    events: List[dict],
+    image,
+    rois: Optional[List[dict]] = None,
+    realtime: bool = True,
+    frame_budget_ms: float = FRAME_BUDGET_MS,
+) -> dict:
+    """Replay recorded events against a fresh ImageCanvas and measure how it responds.
+
+    Every event is dispatched synchronously and followed by update_idletasks, so its
+    frame time covers the event handler and the redraw Tk does on idle. In realtime
+    mode the recording's pacing is kept and timers (such as the full quality refine)
+    run between events as they would in a session; otherwise events are sent back
+    to back.
+
+    Args:
+        header (dict): Recording header, see InteractionRecorder.
+        events (List[dict]): Recorded events.
+        image (PIL.Image.Image): The image to show.
+        rois (Optional[List[dict]]): ROIs to draw on the image.
+        realtime (bool): Keep the recorded pacing.
+        frame_budget_ms (float): Refresh interval a frame has to fit in.
+
+    Returns:
+        dict: Frame time percentiles in ms, dropped frames, redraw statistics, Tk call counts
+        and the memory held per subsystem at the end of the replay.
+    """
+    host = ReplayHost(tuple(header["canvas_size"]))
+    canvas = host.canvas
+    try:
+        host.update()
+        canvas.set_image(image)
+        canvas.rois = list(rois or [])
+        if header.get("mat_affine") is not None:
+            canvas.mat_affine = np.array(header["mat_affine"], dtype=float)
+        canvas._draw_image()
+        host.update()
+
+        # Time every redraw, including the ones triggered by timers
+        draws = []
+        draw_image = canvas._draw_image
+
+        def timed_draw(*args, **kwargs):
+            start = time.perf_counter()
+            result = draw_image(*args, **kwargs)
+            draws.append((time.perf_counter() - start) * 1000)
+            return result
+
+        canvas._draw_image = timed_draw
+        counting = _CountingTk(canvas.tk, str(canvas))
+        canvas.tk = counting
+
+        frames = []
+        late = 0
+        time_base = 0
+        start = time.perf_counter()
+        for event in events:
+            if realtime:
+                target = start + event["t"]
+                while time.perf_counter() < target:
+                    host.update()
+                    time.sleep(0.0005)
+                if (time.perf_counter() - target) * 1000 > frame_budget_ms:
+                    late += 1
+
+            options = {"x": event["x"], "y": event["y"], "state": event["state"], "time": time_base + event["time"]}
+            kind = event["type"]
+            if kind == "press":
+                sequence = f"<ButtonPress-{event['num']}>"
+            elif kind == "release":
+                sequence = f"<ButtonRelease-{event['num']}>"
+            elif kind == "wheel":
+                sequence = "<MouseWheel>"
+                options["delta"] = event["delta"]
+            else:
+                sequence = "<Motion>"
+
+            # Dispatched through the host so only the canvas' own Tk calls are counted
+            arguments = []
+            for option, value in options.items():
+                arguments += [f"-{option}", value]
+            frame_start = time.perf_counter()
+            host.tk.call("event", "generate", str(canvas), sequence, "-when", "now", *arguments)
+            host.update_idletasks()
+            frames.append((time.perf_counter() - frame_start) * 1000)
+
+        # Let pending timers (e.g. the last refine) finish before reporting
+        if realtime:
+            settle = time.perf_counter() + 0.5
+            while time.perf_counter() < settle:
+                host.update()
+                time.sleep(0.001)
+
+        calls = counting.calls
+        return {
+            "events": len(events),
+            "frame_ms": _percentiles(frames),
+            "frame_budget_ms": round(frame_budget_ms, 3),
+            # Refresh intervals missed: a frame taking 2.5 budgets drops 2 frames
+            "dropped_frames": int(sum(int(ms // frame_budget_ms) for ms in frames)),
+            "slow_events": sum(1 for ms in frames if ms > frame_budget_ms),
+            "late_events": late,
+            "redraws": len(draws),
+            "redraw_ms": _percentiles(draws),
+            "tk_calls": sum(calls.values()),
+            "tk_calls_per_event": round(sum(calls.values()) / max(1, len(events)), 2),
+            "tk_calls_by_command": dict(calls.most_common(10)),
+            "memory": memory.report(),
+        }
+    finally:
+        host.destroy()
+
+
+def _start_virtual_display(display: Optional[str] = None) -> Optional[subprocess.Popen]:
+    '''
+    Start Xvfb when there is no display, so replays can run on headless machines.
+
+    The display number is taken from display, then FLORO_XVFB_DISPLAY, then DEFAULT_XVFB_DISPLAY.
+    '''
+    if os.name == "nt" or os.environ.get("DISPLAY"):
+        return None
+    xvfb = shutil.which("Xvfb")
+    if xvfb is None:
+        raise RuntimeError("No display available and Xvfb is not installed")
+    display = display or os.environ.get(XVFB_DISPLAY_ENV) or DEFAULT_XVFB_DISPLAY
+    process = subprocess.Popen([xvfb, display, "-screen", "0", "1920x1080x24", "-nolisten", "tcp"])
+    time.sleep(0.5)
+    if process.poll() is not None:
+        # Usually another server already owns the display
+        raise RuntimeError(f"Xvfb could not start on display {display}, choose another with --xvfb-display or {XVFB_DISPLAY_ENV}")
+    os.environ["DISPLAY"] = display
+    return process
+
+def _print_report(report: dict) -> None:
+    frame = report["frame_ms"]
+    print(f"Events:          {report['events']}")
+    if frame:
+        print(f"Frame time (ms): p50 {frame['p50']}  p90 {frame['p90']}  p95 {frame['p95']}  p99 {frame['p99']}  max {frame['max']}")
+    print(f"Dropped frames:  {report['dropped_frames']} ({report['slow_events']} events over {report['frame_budget_ms']} ms, {report['late_events']} dispatched late)")
+    redraw = report["redraw_ms"]
+    if redraw:
+        print(f"Redraws:         {report['redraws']}  p50 {redraw['p50']} ms  p95 {redraw['p95']} ms")
+    print(f"Tk calls:        {report['tk_calls']} ({report['tk_calls_per_event']} per event)")
+    for name, count in report["tk_calls_by_command"].items():
+        print(f"    {name:<22} {count}")
+    print()
+    print(format_report(report["memory"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded FLORO canvas session headlessly and report frame times.")
+    parser.add_argument("recording", nargs="?", help="Recording (.jsonl) made with File > Record Interaction")
+    parser.add_argument("--synthetic", action="store_true", help="Replay a built-in pan/zoom/draw/hover session instead of a recording")
+    parser.add_argument("--image", default=None, help="Image to replay against (defaults to the recording's image)")
+    parser.add_argument("--db", default=None, help="Project database to load the ROIs from")
+    parser.add_argument("--plate", type=int, default=None, help="Generate a plate layout of this format as the ROI set instead")
+    parser.add_argument("--size", default="1000x700", help="Canvas size for synthetic sessions, WxH")
+    parser.add_argument("--fast", action="store_true", help="Send events back to back instead of at the recorded pace")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--xvfb-display", default=None, help=f"Display to start Xvfb on when there is none, e.g. :99 (default ${XVFB_DISPLAY_ENV} or {DEFAULT_XVFB_DISPLAY})")
+    args = parser.parse_args()
+
+    from PIL import Image
+
+    if args.synthetic:
+        header, events = synthetic_session(tuple(int(v) for v in args.size.split("x")))
+    elif args.recording:
+        header, events = load_recording(args.recording)
+    else:
+        parser.error("give a recording or --synthetic")
+
+    image_path = args.image or header.get("image")
+    if not image_path:
+        parser.error("--image is required for this session")
+    image = Image.open(image_path)
+
+    rois = []
+    if args.plate:
+        from plate_layout import generate_plate_rois
+        margin = 0.05
+        rois = generate_plate_rois(
+            args.plate,
+            np.array([image.width * margin, image.height * margin, 1.0]),
+            np.array([image.width * (1 - margin), image.height * (1 - margin), 1.0]),
+        )
+    elif args.db:
+        from db_manager import DatabaseManager
+        rois = [roi for _, _, roi, _, _ in DatabaseManager(args.db).get_roi_records() if roi]
+
+    xvfb = _start_virtual_display(args.xvfb_display)
+    try:
+        report = replay(header, events, image, rois, realtime=not args.fast)
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
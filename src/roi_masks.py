@@ -0,0 +1,208 @@
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+import threading
+import numpy as np
+import cv2
+from memory import memory, LOCKED_SUBSYSTEMS
+
+# ROI shapes supported by the canvas, stored in the ROI's "shape" key (rectangles have none)
+ROI_SHAPES = ("rectangle", "ellipse", "polygon")
+
+BBox = Tuple[int, int, int, int]
+
+def roi_shape(roi: dict) -> str:
+    """Return the shape of an ROI, treating ROIs without a shape as rectangles."""
+    return roi.get("shape", "rectangle")
+
+def roi_points(roi: dict) -> np.ndarray:
+    """Return the outline defining points of an ROI in image coordinates as an (N, 2) array."""
+    if roi_shape(roi) == "polygon":
+        return np.asarray(roi["points"], dtype=np.float64).reshape(-1, 2)
+    return np.array([roi["start"][:2], roi["end"][:2]], dtype=np.float64)
+
+def is_complete_roi(roi: dict) -> bool:
+    """Whether an ROI has every point its shape needs and covers an area.
+
+    ROIs saved from a click without a drag, or by older versions, may lack an end point
+    or have zero width or height; they cannot be measured and are skipped.
+    """
+    try:
+        points = roi_points(roi)
+    except (KeyError, TypeError, IndexError, ValueError):
+        return False
+    if len(points) < (3 if roi_shape(roi) == "polygon" else 2) or not np.isfinite(points).all():
+        return False
+    return bool((points.max(axis=0) > points.min(axis=0)).all())
+
+def roi_bbox(roi: dict, width: int, height: int) -> Optional[BBox]:
+    """Return the ROI's bounding box (x0, y0, x1, y1) clipped to the image, or None if it lies outside.
+
+    x1 and y1 are exclusive, so the pixel at the ROI's maximum coordinate is inside the box.
+    """
+    points = roi_points(roi)
+    x0 = max(0, int(np.floor(points[:, 0].min())))
+    y0 = max(0, int(np.floor(points[:, 1].min())))
+    x1 = min(width, int(np.ceil(points[:, 0].max())) + 1)
+    y1 = min(height, int(np.ceil(points[:, 1].max())) + 1)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1, y1
+
+def rasterise_roi(roi: dict, bbox: BBox) -> np.ndarray:
+    """Rasterise an ROI into a uint8 mask covering only its bounding box.
+
+    Args:
+        roi (dict): The ROI.
+        bbox (BBox): Bounding box returned by roi_bbox.
+
+    Returns:
+        np.ndarray: A (y1 - y0, x1 - x0) mask with 255 inside the ROI.
+    """
+    x0, y0, x1, y1 = bbox
+    shape = roi_shape(roi)
+    if shape == "rectangle":
+        return np.full((y1 - y0, x1 - x0), 255, dtype=np.uint8)
+
+    mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    points = roi_points(roi) - (x0, y0)
+    if shape == "ellipse":
+        center = tuple(points.mean(axis=0))
+        axes = tuple(np.abs(points[1] - points[0]) / 2)
+        cv2.ellipse(mask, (center, (axes[0] * 2, axes[1] * 2), 0), 255, -1)
+    else:
+        cv2.fillPoly(mask, [np.round(points).astype(np.int32)], 255)
+    return mask
+
+
+class MaskCache:
+    '''
+    Caches bounding-box sized ROI masks by geometry and image size.
+
+    ROIs are shared by every image of a project, so a mask is rasterised once and
+    reused for every image with the same dimensions.
+    '''
+    def __init__(self, max_masks: int = 4096):
+        self.max_masks = max_masks
+        self._masks: "OrderedDict[tuple, Tuple[Optional[BBox], Optional[np.ndarray]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        memory.register("roi_masks", self)
+
+    def get(self, roi: dict, width: int, height: int) -> Tuple[Optional[BBox], Optional[np.ndarray]]:
+        '''
+        Return the ROI's clipped bounding box and mask, or (None, None) if it lies outside the image.
+        '''
+        key = (roi_shape(roi), roi_points(roi).round(3).tobytes(), width, height)
+        # Locked because the memory tracker may trim the cache from the Tk thread
+        with self._lock:
+            cached = self._masks.get(key)
+            if cached is not None:
+                self._masks.move_to_end(key)
+                return cached
+
+        bbox = roi_bbox(roi, width, height)
+        cached = (bbox, rasterise_roi(roi, bbox) if bbox is not None else None)
+        with self._lock:
+            self._masks[key] = cached
+            if len(self._masks) > self.max_masks:
+                self._masks.popitem(last=False)
+        return cached
+
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(mask.nbytes for _, mask in self._masks.values() if mask is not None)
+
+    def trim(self, max_bytes: int) -> int:
+        '''
+        Drop the least recently used masks until at most max_bytes are held.
+        '''
+        with self._lock:
+            before = held = sum(mask.nbytes for _, mask in self._masks.values() if mask is not None)
+            while held > max_bytes and self._masks:
+                _, (_, mask) = self._masks.popitem(last=False)
+                held -= mask.nbytes if mask is not None else 0
+            return before - held
+
+    def clear(self) -> None:
+        with self._lock:
+            self._masks.clear()
+
+
+def measure_rois(img: np.ndarray, rois: List[dict], cache: Optional[MaskCache] = None) -> List[Optional[Dict]]:
+    """Measure the mean intensity and area of each ROI, touching only the pixels in its bounding box.
+
+    Args:
+        img (np.ndarray): Single channel image.
+        rois (List[dict]): ROIs in image coordinates.
+        cache (Optional[MaskCache]): Mask cache shared between images.
+
+    Returns:
+        List[Optional[Dict]]: Per ROI a dict with mean_intensity, area, center_x and center_y,
+        or None for ROIs outside the image or incomplete ones (see is_complete_roi).
+    """
+    cache = cache if cache is not None else MaskCache()
+    height, width = img.shape[:2]
+    results = []
+    for roi in rois:
+        if not is_complete_roi(roi):
+            results.append(None)
+            continue
+        bbox, mask = cache.get(roi, width, height)
+        if bbox is None:
+            results.append(None)
+            continue
+        x0, y0, x1, y1 = bbox
+        results.append({
+            "mean_intensity": cv2.mean(img[y0:y1, x0:x1], mask=mask)[0],
+            "area": float(cv2.countNonZero(mask)),
+            "center_x": (x0 + x1 - 1) / 2,
+            "center_y": (y0 + y1 - 1) / 2,
+        })
+    return results
+
+
+def extract_roi_measurements(token, progress, db_manager, flat_field=None, page: int = 0) -> int:
+    """Scheduler job measuring every project ROI on every project image.
+
+    ROIs are shared by all images, so their masks are rasterised once and reused
+    through a MaskCache. Rows are written per image as (index, roi_id, center_x,
+    center_y, area, mean_intensity) with the 1-based position of the ROI as index,
+    replacing earlier ROI mask measurements of the image.
+
+    Args:
+        token (CancelToken): Cancellation token of the job.
+        progress (Callable[[int, int], None]): Progress callback of the job.
+        db_manager (DatabaseManager): The project database.
+        flat_field (Optional[FlatField]): Flat-field correction applied to images of its size.
+        page (int): Page (channel) of the images to analyse.
+
+    Returns:
+        int: The number of images measured.
+    """
+    from multipage import read_page
+
+    records = db_manager.get_roi_records()
+    rois = [record[2] for record in records]
+    images = db_manager.get_images()
+    cache = MaskCache()
+    done = 0
+    for image_id, image_path in images:
+        token.raise_if_cancelled()
+        try:
+            img = read_page(image_path, page)
+        except OSError as e:
+            print(f"Could not read {image_path}: {e}")
+            continue
+        if img.ndim == 3:
+            img = cv2.cvtColor(img[..., :3], cv2.COLOR_RGB2GRAY)
+        if flat_field is not None and flat_field.matches(img.shape[1], img.shape[0]):
+            img = flat_field.apply(img)
+        rows = [
+            (index, record[0], result["center_x"], result["center_y"], result["area"], result["mean_intensity"])
+            for index, (record, result) in enumerate(zip(records, measure_rois(img, rois, cache)), start=1)
+            if result is not None
+        ]
+        db_manager.save_measurements(image_id, rows, "roi_masks", page)
+        memory.enforce(LOCKED_SUBSYSTEMS)
+        done += 1
+        progress(done, len(images))
+    return done
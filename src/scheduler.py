@@ -0,0 +1,250 @@
+from typing import Any, Callable, List, Optional
+import heapq
+import itertools
+import queue
+import threading
+import tkinter as tk
+from memory import memory
+
+# Job priorities, lower runs first
+PREVIEW = 0
+CURRENT_IMAGE = 1
+BATCH = 2
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when its cancellation token has been cancelled."""
+
+
+class CancelToken:
+    '''
+    Cooperative cancellation flag handed to every job.
+    '''
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise JobCancelled()
+
+
+class Job:
+    '''
+    A unit of work run by the JobScheduler.
+
+    The function is called as func(token, progress, *args) on a worker thread, where
+    progress(done, total) reports progress. on_done(job) is called on the Tk thread
+    when the job finishes, fails or is cancelled. Other threads can block on wait().
+    '''
+    def __init__(self, name: str, func: Callable, args: tuple = (), priority: int = BATCH, on_done: Optional[Callable] = None):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.priority = priority
+        self.on_done = on_done
+        self.token = CancelToken()
+        self.done = 0
+        self.total = 0
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.state = "queued"
+        self._finished = threading.Event()
+
+    def cancel(self) -> None:
+        self.token.cancel()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        '''
+        Block until the job has finished, failed or been cancelled. Returns False on timeout.
+        '''
+        return self._finished.wait(timeout)
+
+
+class JobScheduler:
+    '''
+    Runs jobs on worker threads in priority order and reports back on the Tk thread.
+
+    Tk may only be called from its own thread, so workers never touch it: they put
+    finished jobs on a queue and flag progress, and the Tk thread polls both with
+    after(). One worker is reserved for jobs with a higher priority than BATCH, so a
+    long batch backlog can never delay a preview or the current image.
+    '''
+    # Milliseconds between polls of the Tk thread
+    POLL_INTERVAL = 50
+
+    def __init__(self, root, workers: int = 2, on_status: Optional[Callable[[str], None]] = None):
+        self.root = root
+        self.on_status = on_status
+        self._heap: List[tuple] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._running: List[Job] = []
+        self._finished = queue.Queue()
+        self._changed = threading.Event()
+        self._stopped = False
+
+        self._poll_id = self.root.after(self.POLL_INTERVAL, self._poll)
+        self._threads = [
+            threading.Thread(target=self._worker, args=(index == 0,), name=f"floro-job-{index}", daemon=True)
+            for index in range(max(2, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, name: str, func: Callable, *args, priority: int = BATCH, on_done: Optional[Callable] = None) -> Job:
+        '''
+        Queue a job and return it; call job.cancel() to cancel it.
+        '''
+        job = Job(name, func, args, priority, on_done)
+        with self._condition:
+            heapq.heappush(self._heap, (priority, next(self._counter), job))
+            self._condition.notify_all()
+        self._notify()
+        return job
+
+    def cancel_all(self, priority: Optional[int] = None) -> None:
+        '''
+        Cancel queued and running jobs, optionally only those of one priority.
+        '''
+        with self._condition:
+            for _, _, job in self._heap:
+                if priority is None or job.priority == priority:
+                    job.cancel()
+            for job in self._running:
+                if priority is None or job.priority == priority:
+                    job.cancel()
+
+    def shutdown(self) -> None:
+        '''
+        Cancel every job and stop the workers and the polling. Queued jobs are finished as cancelled.
+        '''
+        self.cancel_all()
+        with self._condition:
+            self._stopped = True
+            for _, _, job in self._heap:
+                job.state = "cancelled"
+                job._finished.set()
+            self._heap.clear()
+            self._condition.notify_all()
+        if self._poll_id is not None:
+            try:
+                self.root.after_cancel(self._poll_id)
+            except tk.TclError:
+                pass
+            self._poll_id = None
+
+    def status(self) -> str:
+        '''
+        One line summary of running and queued jobs for the status bar.
+        '''
+        with self._condition:
+            running = list(self._running)
+            queued = sum(1 for _, _, job in self._heap if not job.token.cancelled)
+        if not running and not queued:
+            return "Idle"
+        parts = []
+        for job in sorted(running, key=lambda job: job.priority):
+            if job.total:
+                parts.append(f"{job.name} {job.done}/{job.total}")
+            else:
+                parts.append(job.name)
+        text = ", ".join(parts) if parts else "Waiting"
+        if queued:
+            text += f" (+{queued} queued)"
+        return text
+
+    def _take(self, interactive_only: bool) -> Optional[Job]:
+        '''
+        Pop the best job this worker may run, waiting until one is available.
+        '''
+        with self._condition:
+            while not self._stopped:
+                # Drop cancelled jobs from the top of the queue
+                while self._heap and self._heap[0][2].token.cancelled:
+                    _, _, job = heapq.heappop(self._heap)
+                    job.state = "cancelled"
+                    job._finished.set()
+                    self._finished.put(job)
+                if self._heap and (not interactive_only or self._heap[0][0] < BATCH):
+                    _, _, job = heapq.heappop(self._heap)
+                    job.state = "running"
+                    self._running.append(job)
+                    return job
+                self._condition.wait()
+            return None
+
+    def _worker(self, interactive_only: bool) -> None:
+        while True:
+            job = self._take(interactive_only)
+            if job is None:
+                return
+            self._notify()
+
+            def progress(done, total, job=job):
+                job.done, job.total = done, total
+                job.token.raise_if_cancelled()
+                self._notify()
+
+            try:
+                job.token.raise_if_cancelled()
+                job.result = job.func(job.token, progress, *job.args)
+                job.state = "cancelled" if job.token.cancelled else "done"
+            except JobCancelled:
+                job.state = "cancelled"
+            except Exception as e:
+                job.error = e
+                job.state = "failed"
+                print(f"Job '{job.name}' failed: {e!r}")
+            with self._condition:
+                self._running.remove(job)
+            job._finished.set()
+            self._finished.put(job)
+            self._notify()
+
+    def _notify(self) -> None:
+        '''
+        Flag a change for the next poll of the Tk thread; safe to call from any thread.
+        '''
+        self._changed.set()
+
+    def _poll(self) -> None:
+        '''
+        Runs on the Tk thread: deliver finished jobs and refresh the status bar if anything changed.
+        '''
+        self._poll_id = None
+        if self._changed.is_set():
+            self._changed.clear()
+            self._on_update()
+        if not self._stopped:
+            self._poll_id = self.root.after(self.POLL_INTERVAL, self._poll)
+
+    def _on_update(self) -> None:
+        '''
+        Deliver finished jobs and refresh the status bar. A failing callback is reported
+        and does not keep the other jobs from being delivered. Once jobs have finished,
+        the memory budgets are enforced over every subsystem, which only the Tk thread may do.
+        '''
+        finished = False
+        while True:
+            try:
+                job = self._finished.get_nowait()
+            except queue.Empty:
+                break
+            finished = True
+            if job.on_done is None:
+                continue
+            try:
+                job.on_done(job)
+            except Exception as e:
+                print(f"Completion callback of job '{job.name}' failed: {e!r}")
+        if finished:
+            memory.enforce()
+        if self.on_status is not None:
+            self.on_status(self.status())
@@ -0,0 +1,222 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+from contextlib import ExitStack, contextmanager
+from multiprocessing import shared_memory
+import sys
+import threading
+import numpy as np
+from memory import memory
+
+
+class SharedFrame:
+    '''
+    Picklable description of a NumPy array held in a shared memory segment.
+
+    Only the segment name, shape and dtype travel to worker processes; the pixel
+    data itself is never pickled.
+    '''
+    def __init__(self, name: str, shape: Tuple[int, ...], dtype: str):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = dtype
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+    def __repr__(self):
+        return f"SharedFrame({self.name!r}, {self.shape}, {self.dtype})"
+
+
+def _open_segment(name: str) -> shared_memory.SharedMemory:
+    '''
+    Attach to an existing segment without taking ownership of it.
+    '''
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # Workers started by multiprocessing share the owner's resource tracker, where
+    # registering an already known segment is a no-op, so attaching is safe here
+    return shared_memory.SharedMemory(name=name)
+
+@contextmanager
+def attach_frame(frame: SharedFrame, writable: bool = False) -> Iterator[np.ndarray]:
+    """Attach to a shared frame from a worker process and yield a NumPy view of it.
+
+    Args:
+        frame (SharedFrame): The frame published by the owning process.
+        writable (bool): Whether the view may be written, e.g. for result label maps.
+
+    Yields:
+        np.ndarray: A view of the shared data, read-only unless writable is True.
+    """
+    segment = _open_segment(frame.name)
+    view = None
+    try:
+        view = np.ndarray(frame.shape, dtype=frame.dtype, buffer=segment.buf)
+        view.flags.writeable = writable
+        yield view
+    finally:
+        # The view must not outlive the mapping
+        view = None
+        segment.close()
+
+
+class FrameRegistry:
+    '''
+    Owns the shared memory segments used to pass frames between the UI and analysis workers.
+
+    Frames are published once and reference counted. Every job that uses a frame
+    acquires it and releases it when done or cancelled; the segment is unlinked as
+    soon as the last reference is released, so cancelled jobs do not leak segments.
+    '''
+    def __init__(self):
+        self._segments: Dict[str, shared_memory.SharedMemory] = {}
+        self._refcounts: Dict[str, int] = {}
+        self._keys: Dict[object, SharedFrame] = {}
+        self._lock = threading.Lock()
+        memory.register("shared_frames", self)
+
+    def publish(self, array: np.ndarray, key: Optional[object] = None) -> SharedFrame:
+        '''
+        Copy an array into a new segment and return its description with one reference held.
+
+        If a key is given (e.g. an image path and page) and a frame with that key is
+        still alive, it is reused and its reference count is incremented instead.
+        '''
+        # Checked, created and filled under the lock, so two publishers of one key share one
+        # segment and neither sees it before the data is in place
+        with self._lock:
+            if key is not None and key in self._keys:
+                frame = self._keys[key]
+                self._refcounts[frame.name] += 1
+                return frame
+            frame = self._create(array.shape, array.dtype, key)
+            view = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self._segments[frame.name].buf)
+            view[...] = array
+            del view
+        return frame
+
+    def allocate(self, shape: Tuple[int, ...], dtype, key: Optional[object] = None) -> SharedFrame:
+        '''
+        Create an uninitialised segment, e.g. for a worker to write a label map into.
+        '''
+        with self._lock:
+            return self._create(shape, dtype, key)
+
+    def _create(self, shape: Tuple[int, ...], dtype, key: Optional[object]) -> SharedFrame:
+        '''
+        Create a segment with one reference; the caller holds the lock.
+        '''
+        dtype = np.dtype(dtype)
+        nbytes = max(1, int(np.prod(shape)) * dtype.itemsize)
+        segment = shared_memory.SharedMemory(create=True, size=nbytes)
+        frame = SharedFrame(segment.name, shape, dtype.str)
+        self._segments[frame.name] = segment
+        self._refcounts[frame.name] = 1
+        if key is not None:
+            self._keys[key] = frame
+        return frame
+
+    def view(self, frame: SharedFrame) -> np.ndarray:
+        '''
+        Return a view of a frame owned by this registry, valid while a reference is held.
+        '''
+        return np.ndarray(frame.shape, dtype=frame.dtype, buffer=self._segments[frame.name].buf)
+
+    def acquire(self, frame: SharedFrame) -> None:
+        with self._lock:
+            self._refcounts[frame.name] += 1
+
+    def release(self, frame: SharedFrame) -> None:
+        '''
+        Drop one reference, unlinking the segment when it was the last one.
+        '''
+        with self._lock:
+            count = self._refcounts.get(frame.name)
+            if count is None:
+                return
+            if count > 1:
+                self._refcounts[frame.name] = count - 1
+                return
+            del self._refcounts[frame.name]
+            segment = self._segments.pop(frame.name)
+            for key in [key for key, value in self._keys.items() if value.name == frame.name]:
+                del self._keys[key]
+        segment.close()
+        segment.unlink()
+
+    @contextmanager
+    def lease(self, *frames: SharedFrame) -> Iterator[None]:
+        '''
+        Hold a reference to the frames for the duration of a job, releasing them even if it is cancelled.
+        '''
+        for frame in frames:
+            self.acquire(frame)
+        try:
+            yield
+        finally:
+            for frame in frames:
+                self.release(frame)
+
+    def active(self) -> int:
+        '''
+        Number of live segments.
+        '''
+        return len(self._segments)
+
+    def nbytes(self) -> int:
+        '''
+        Total bytes held in live segments.
+        '''
+        with self._lock:
+            return sum(segment.size for segment in self._segments.values())
+
+    def close(self) -> None:
+        '''
+        Unlink every segment regardless of reference counts, e.g. on application exit.
+        '''
+        with self._lock:
+            segments = list(self._segments.values())
+            self._segments.clear()
+            self._refcounts.clear()
+            self._keys.clear()
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+
+def segment_shared(
+    image: SharedFrame,
+    labels: Optional[SharedFrame] = None,
+    params: Optional[dict] = None,
+    gain: Optional[SharedFrame] = None,
+) -> List[Tuple[int, Optional[int], float, float, float, float]]:
+    """Worker entry point: segment a shared frame and measure its wells.
+
+    Args:
+        image (SharedFrame): The published frame, as read_page returns it.
+        labels (Optional[SharedFrame]): An int32 frame with the image's height and width, allocated
+            by the caller, to write the watershed labels into.
+        params (Optional[dict]): Pipeline parameters to override.
+        gain (Optional[SharedFrame]): A published flat-field gain of the image's size.
+
+    Returns:
+        List[Tuple]: The wells' rows, see pipeline.measurement_rows.
+    """
+    from pipeline import build_segmentation_pipeline, measurement_rows
+
+    pipeline = build_segmentation_pipeline()
+    if params:
+        pipeline.set_params(**params)
+    with ExitStack() as stack:
+        try:
+            pipeline.set_input("image", stack.enter_context(attach_frame(image)))
+            if gain is not None:
+                pipeline.set_input("gain", stack.enter_context(attach_frame(gain)))
+            if labels is not None:
+                stack.enter_context(attach_frame(labels, writable=True))[...] = pipeline.get("watershed")
+            return measurement_rows(pipeline)
+        finally:
+            # No view may outlive its mapping
+            pipeline.invalidate()
+            pipeline.set_input("image", None)
+            pipeline.set_input("gain", None)
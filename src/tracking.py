@@ -0,0 +1,321 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import cv2
+from PIL import Image
+from db_manager import natural_key
+from pipeline import Pipeline, build_segmentation_pipeline
+from memory import memory, nbytes_of, LOCKED_SUBSYSTEMS
+
+# Watershed labels: 1 is background, -1 marks boundaries, wells are 2 and up
+BACKGROUND = 1
+
+# TIFF/EXIF DateTime tag, "YYYY:MM:DD HH:MM:SS"
+DATETIME_TAG = 306
+
+def acquisition_time(image_path: str) -> Optional[str]:
+    """Return the DateTime tag of an image file, or None if it has none or cannot be read."""
+    try:
+        with Image.open(image_path) as img:
+            value = img.getexif().get(DATETIME_TAG)
+    except OSError:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode("ascii", "ignore")
+    if not isinstance(value, str) or not value.strip():
+        return None
+    return value.strip()
+
+def frame_order(images: Sequence[Tuple[int, str]]) -> List[Tuple[int, str]]:
+    """Order (image_id, image_path) pairs as a time series.
+
+    Frames are sorted by their DateTime tag if every one of them has it, and otherwise
+    by file name in natural order (frame_2 before frame_10). The order the images were
+    added to the project in is not used, since it follows the folder listing.
+    """
+    times = [acquisition_time(image_path) for _, image_path in images]
+    if all(times):
+        # The fixed width "YYYY:MM:DD HH:MM:SS" format sorts chronologically as text
+        keys = [(time, natural_key(image_path)) for time, (_, image_path) in zip(times, images)]
+    else:
+        keys = [natural_key(image_path) for _, image_path in images]
+    return [image for _, image in sorted(zip(keys, images), key=lambda pair: pair[0])]
+
+def well_features(labels: np.ndarray, gray: np.ndarray) -> List[Tuple[int, Optional[int], float, float, float, float]]:
+    """Measure every labelled well in one pass over the label map.
+
+    Args:
+        labels (np.ndarray): int32 watershed labels.
+        gray (np.ndarray): Single channel intensities of the same size, in the image's own units.
+
+    Returns:
+        List[Tuple]: (well_id, None, center_x, center_y, area, mean_intensity) rows for
+        DatabaseManager.save_measurements, where well_id is the label minus 1, so IDs start at 1.
+    """
+    flat = labels.ravel()
+    valid = flat > BACKGROUND
+    ids = flat[valid]
+    if ids.size == 0:
+        return []
+    length = int(ids.max()) + 1
+    ys, xs = np.divmod(np.flatnonzero(valid), labels.shape[1])
+    area = np.bincount(ids, minlength=length)
+    total = np.bincount(ids, weights=gray.ravel()[valid], minlength=length)
+    sum_x = np.bincount(ids, weights=xs, minlength=length)
+    sum_y = np.bincount(ids, weights=ys, minlength=length)
+    return [
+        (int(label) - 1, None, sum_x[label] / area[label], sum_y[label] / area[label], float(area[label]), total[label] / area[label])
+        for label in np.flatnonzero(area)
+    ]
+
+
+class WellTracker:
+    '''
+    Segments the frames of a time-lapse, propagating each frame's wells as seeds for the next.
+
+    The first frame, and any frame where the change detector fires, goes through the
+    full segmentation pipeline. Every other frame skips Otsu, the distance transform
+    and connectedComponents: the previous labels are eroded and used directly as the
+    watershed markers, so the wells keep their labels and hence their IDs from frame to
+    frame. When a frame has to be segmented from scratch, its wells are matched to the
+    previous labels by overlap. Wells that match nothing are matched to wells lost in
+    earlier frames by their last known position, so a well that drops out for a few
+    frames gets its old ID back.
+
+    Wells are measured on the raw, flat-field corrected intensities, so the traces keep
+    their units. The change detector compares a small thumbnail of each frame with the
+    previous one, each stretched to its own range, so wells getting brighter or dimmer
+    is not a change in layout. It fires on a global change (focus, plate moved) and on a
+    local one such as a single well appearing or disappearing, and also when a
+    propagated well loses most of its area.
+    '''
+    def __init__(
+        self,
+        pipeline: Optional[Pipeline] = None,
+        erode_iterations: int = 2,
+        change_threshold: float = 0.05,
+        local_threshold: float = 0.25,
+        min_area_ratio: float = 0.5,
+        thumbnail_size: int = 128,
+    ):
+        self.pipeline = pipeline if pipeline is not None else build_segmentation_pipeline()
+        self.erode_iterations = erode_iterations
+        self.change_threshold = change_threshold
+        self.local_threshold = local_threshold
+        self.min_area_ratio = min_area_ratio
+        self.thumbnail_size = thumbnail_size
+        self.labels: Optional[np.ndarray] = None
+        self.last_mode: Optional[str] = None
+        self.segmented = 0
+        self.propagated = 0
+        self._thumbnail: Optional[np.ndarray] = None
+        self._areas: Optional[np.ndarray] = None
+        # Last known (center_x, center_y, area) of every label, including wells currently lost
+        self._last_seen: Dict[int, Tuple[float, float, float]] = {}
+        self._next_label = BACKGROUND + 1
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+        # The previous frame's labels are needed for the next one, so they are accounted for but never evicted
+        memory.register("label_maps", self, measure=lambda tracker: nbytes_of((tracker.labels, tracker._thumbnail, tracker._areas)))
+
+    def reset(self) -> None:
+        '''
+        Forget the previous frame, e.g. before a new plate.
+        '''
+        self.labels = None
+        self._thumbnail = None
+        self._areas = None
+        self._last_seen = {}
+        self._next_label = BACKGROUND + 1
+
+    def track(self, image: np.ndarray, gain: Optional[np.ndarray] = None) -> List[Tuple[int, Optional[int], float, float, float, float]]:
+        """Segment the next frame of the series and measure its wells.
+
+        Args:
+            image (np.ndarray): Grayscale or RGB(A) frame of any bit depth, as read_page returns it.
+            gain (Optional[np.ndarray]): Flat-field gain of the frame's size.
+
+        Returns:
+            List[Tuple]: Measurement rows whose well IDs are stable across frames, see well_features.
+        """
+        self.pipeline.set_input("gain", gain)
+        self.pipeline.set_input("image", image)
+        intensity = self.pipeline.get("intensity")
+        thumbnail = self._make_thumbnail(intensity)
+
+        labels = None
+        if not self._changed(thumbnail):
+            labels = self._propagate(self.pipeline.get("gray"))
+        if labels is None:
+            labels = self._segment()
+            self.last_mode = "segmented"
+            self.segmented += 1
+        else:
+            self.last_mode = "propagated"
+            self.propagated += 1
+
+        rows = well_features(labels, intensity)
+        self.labels = labels
+        self._thumbnail = thumbnail
+        self._areas = np.zeros(self._next_label)
+        for well_id, _, center_x, center_y, area, _ in rows:
+            self._areas[well_id + 1] = area
+            self._last_seen[well_id + 1] = (center_x, center_y, area)
+        # Drop the frame's cached stages, the tracker keeps what it needs
+        self.pipeline.invalidate()
+        return rows
+
+    def _make_thumbnail(self, intensity: np.ndarray) -> np.ndarray:
+        height, width = intensity.shape
+        factor = self.thumbnail_size / max(height, width)
+        size = (max(1, round(width * factor)), max(1, round(height * factor)))
+        thumbnail = cv2.resize(intensity.astype(np.float32), size, interpolation=cv2.INTER_AREA)
+        # Stretched to 0-1, so only the layout is compared, not the brightness
+        low, high = float(thumbnail.min()), float(thumbnail.max())
+        return (thumbnail - low) / max(high - low, 1e-6)
+
+    def _changed(self, thumbnail: np.ndarray) -> bool:
+        '''
+        Return True if the frame has to be segmented from scratch.
+        '''
+        if self.labels is None or self._thumbnail is None or self._thumbnail.shape != thumbnail.shape:
+            return True
+        # Thumbnails are stretched to 0-1, so the thresholds are fractions of the value range
+        difference = np.abs(thumbnail - self._thumbnail)
+        if float(difference.mean()) > self.change_threshold:
+            return True
+        # Averaging over 3x3 thumbnail pixels ignores noise but not a well that changed as a whole
+        local = cv2.blur(difference, (3, 3))
+        return float(local.max()) > self.local_threshold
+
+    def _propagate(self, gray: np.ndarray) -> Optional[np.ndarray]:
+        '''
+        Run the watershed seeded with the eroded previous labels, or return None if wells were lost.
+        '''
+        if gray.shape[:2] != self.labels.shape:
+            return None
+        # Boundaries (-1) become 0, so eroding each label pulls it back from its neighbours too
+        previous = np.maximum(self.labels, 0)
+        seeds = cv2.erode((previous > 0).astype(np.uint8), self._kernel, iterations=self.erode_iterations)
+        markers = previous * seeds
+        labels = cv2.watershed(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), markers)
+
+        # A well that shrank a lot has moved or vanished, so the seeds no longer fit
+        areas = np.bincount(np.maximum(labels, 0).ravel(), minlength=len(self._areas))[:len(self._areas)]
+        tracked = self._areas > 0
+        tracked[:BACKGROUND + 1] = False
+        if np.any(areas[tracked] < self.min_area_ratio * self._areas[tracked]):
+            return None
+        return labels
+
+    def _segment(self) -> np.ndarray:
+        '''
+        Segment the frame with the full pipeline and give its wells the IDs of the wells they overlap most.
+        '''
+        labels = self.pipeline.get("watershed").copy()
+        count = int(labels.max()) + 1
+        mapping = np.arange(max(count, BACKGROUND + 1), dtype=np.int32)
+        if self.labels is not None and self.labels.shape == labels.shape:
+            wells = (labels > BACKGROUND) & (self.labels > BACKGROUND)
+            # Count overlapping pixels per (new, previous) label pair
+            pairs, overlap = np.unique(
+                labels[wells].astype(np.int64) * self._next_label + self.labels[wells], return_counts=True
+            )
+            new, previous = np.divmod(pairs, self._next_label)
+            order = np.argsort(-overlap)
+            used = set()
+            assigned = np.zeros(count, dtype=bool)
+            for index in order:
+                if assigned[new[index]] or previous[index] in used:
+                    continue
+                mapping[new[index]] = previous[index]
+                assigned[new[index]] = True
+                used.add(int(previous[index]))
+            unmatched = [label for label in range(BACKGROUND + 1, count) if not assigned[label]]
+        else:
+            used = set()
+            unmatched = list(range(BACKGROUND + 1, count))
+        unmatched = self._match_lost(labels, unmatched, used, mapping)
+        for label in unmatched:
+            mapping[label] = self._next_label
+            self._next_label += 1
+        self._next_label = max(self._next_label, int(mapping.max()) + 1)
+
+        result = labels.copy()
+        wells = labels > BACKGROUND
+        result[wells] = mapping[labels[wells]]
+        return result
+
+    def _match_lost(self, labels: np.ndarray, unmatched: List[int], used: set, mapping: np.ndarray) -> List[int]:
+        '''
+        Give unmatched new wells the label of the nearest lost well whose last known outline contains their centre.
+
+        Returns the wells that are still unmatched.
+        '''
+        lost = [label for label in self._last_seen if label not in used]
+        if not unmatched or not lost:
+            return unmatched
+        flat = labels.ravel()
+        valid = flat > BACKGROUND
+        ys, xs = np.divmod(np.flatnonzero(valid), labels.shape[1])
+        ids = flat[valid]
+        area = np.bincount(ids, minlength=len(mapping)).astype(np.float64)
+        center_x = np.bincount(ids, weights=xs, minlength=len(mapping)) / np.maximum(area, 1)
+        center_y = np.bincount(ids, weights=ys, minlength=len(mapping)) / np.maximum(area, 1)
+
+        candidates = []
+        for label in unmatched:
+            for old in lost:
+                old_x, old_y, old_area = self._last_seen[old]
+                distance = np.hypot(center_x[label] - old_x, center_y[label] - old_y)
+                # Within the radius the well had when it was last seen
+                if distance <= np.sqrt(old_area / np.pi):
+                    candidates.append((distance, label, old))
+        matched = set()
+        for _, label, old in sorted(candidates):
+            if label in matched or old in used:
+                continue
+            mapping[label] = old
+            matched.add(label)
+            used.add(old)
+        return [label for label in unmatched if label not in matched]
+
+
+def track_project(token, progress, db_manager, flat_field=None, image_ids: Optional[Sequence[int]] = None, page: int = 0) -> int:
+    """Scheduler job segmenting the project's images as one time series.
+
+    Args:
+        token (CancelToken): Cancellation token of the job.
+        progress (Callable[[int, int], None]): Progress callback of the job.
+        db_manager (DatabaseManager): The project database.
+        flat_field (Optional[FlatField]): Flat-field correction applied to images of its size.
+        image_ids (Optional[Sequence[int]]): The frames in the order to track them. Defaults to
+            every image of the project, ordered by frame_order.
+        page (int): Page (channel) of the frames to track.
+
+    Returns:
+        int: The number of frames analysed.
+    """
+    from multipage import read_page
+
+    tracker = WellTracker()
+    if image_ids is None:
+        images = frame_order(db_manager.get_images())
+    else:
+        paths = dict(db_manager.get_images())
+        images = [(image_id, paths[image_id]) for image_id in image_ids]
+    done = 0
+    for image_id, image_path in images:
+        token.raise_if_cancelled()
+        try:
+            image = read_page(image_path, page)
+        except OSError as e:
+            print(f"Could not read {image_path}: {e}")
+            continue
+        gain = None
+        if flat_field is not None and flat_field.matches(image.shape[1], image.shape[0]):
+            gain = flat_field.gain
+        db_manager.save_measurements(image_id, tracker.track(image, gain), "tracking", page)
+        memory.enforce(LOCKED_SUBSYSTEMS)
+        done += 1
+        progress(done, len(images))
+    print(f"Tracked {done} frames: {tracker.segmented} segmented, {tracker.propagated} propagated")
+    return done
@@ -0,0 +1,226 @@
+from typing import Dict, Tuple
+import os
+import queue
+import threading
+from db_manager import DatabaseManager, IMAGE_EXTENSIONS, natural_key
+from multipage import read_page
+from pipeline import build_segmentation_pipeline, measurement_rows
+from scheduler import CURRENT_IMAGE, JobCancelled
+from tracking import WellTracker
+
+# Sentinel passed down the queues to stop the stages in order
+_STOP = object()
+
+class WatchFolderIngest:
+    '''
+    Watches a project folder for new images and streams them through decode,
+    segmentation and database write.
+
+    New files are detected by polling the folder with os.scandir and are only
+    considered complete once their size and modification time stop changing between
+    two polls. Each stage runs in its own thread and the stages are connected by
+    bounded queues, so a slow stage blocks the ones before it instead of letting
+    decoded frames pile up in memory. An image is registered in the database before it
+    is queued, so once registered it is never dropped: stopping only ends the polling,
+    and every registered image, including the rest of a batch still waiting for room in
+    a full queue, is analysed and written. Frames are analysed in their own bit depth, so
+    the stored intensities can be compared across images. An image that fails in any
+    stage is counted in failed and skipped; the stage itself keeps running.
+
+    Given a JobScheduler, the analysis of each frame runs as a CURRENT_IMAGE job on its
+    workers, behind live previews and ahead of batch jobs, and the analyse stage waits
+    for it. Without one it runs on the stage's own thread.
+    '''
+    def __init__(
+        self,
+        db_manager: DatabaseManager,
+        folder_path: str,
+        poll_interval: float = 1.0,
+        queue_size: int = 4,
+        tracking: bool = False,
+        scheduler=None,
+        page: int = 0,
+    ):
+        self.db_manager = db_manager
+        self.scheduler = scheduler
+        # Treat the incoming images as a time series and propagate wells from frame to frame
+        self.tracking = tracking
+        self.folder_path = folder_path
+        self.poll_interval = poll_interval
+        # Optional FlatField applied before segmentation, may be swapped while running
+        self.flat_field = None
+        # Page (channel) of the incoming images to analyse, may be switched while running
+        self.page = page
+
+        self.registered = 0
+        self.analysed = 0
+        self.failed = 0
+
+        self._decode_queue = queue.Queue(maxsize=queue_size)
+        self._analyse_queue = queue.Queue(maxsize=queue_size)
+        self._write_queue = queue.Queue(maxsize=queue_size)
+        self._stopped = threading.Event()
+        self._known = set(db_manager.get_image_paths_from_database())
+        self._candidates: Dict[str, Tuple[int, float]] = {}
+        self._threads = [
+            threading.Thread(target=self._watch, name="floro-watch", daemon=True),
+            threading.Thread(target=self._decode, name="floro-decode", daemon=True),
+            threading.Thread(target=self._analyse, name="floro-analyse", daemon=True),
+            threading.Thread(target=self._write, name="floro-write", daemon=True),
+        ]
+
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        '''
+        Stop watching. Images already registered finish their way through the pipeline;
+        is_running() turns False once they are all written.
+        '''
+        self._stopped.set()
+
+    def is_running(self) -> bool:
+        return any(thread.is_alive() for thread in self._threads)
+
+    def pending(self) -> int:
+        '''
+        Number of images waiting between the stages.
+        '''
+        return self._decode_queue.qsize() + self._analyse_queue.qsize() + self._write_queue.qsize()
+
+    def _put(self, target: queue.Queue, item) -> None:
+        '''
+        Block until there is room downstream (backpressure), also after stop().
+
+        The stages downstream keep draining their queues until they receive _STOP, so the
+        wait always ends; giving up instead would lose an image that is already registered.
+        '''
+        target.put(item)
+
+    def _scan(self):
+        '''
+        Return the new image files whose size and modification time did not change since the last poll.
+        '''
+        completed = []
+        seen = set()
+        with os.scandir(self.folder_path) as entries:
+            for entry in entries:
+                path = os.path.join(self.folder_path, entry.name)
+                if path in self._known or os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                seen.add(path)
+                signature = (stat.st_size, stat.st_mtime)
+                if stat.st_size > 0 and self._candidates.get(path) == signature:
+                    completed.append(path)
+                else:
+                    self._candidates[path] = signature
+        # Forget files that disappeared before completing
+        for path in list(self._candidates):
+            if path not in seen or path in completed:
+                self._candidates.pop(path)
+        return sorted(completed, key=natural_key)
+
+    def _watch(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                completed = self._scan()
+                image_ids = self.db_manager.add_images(completed) if completed else []
+            except Exception as e:
+                # E.g. the folder is briefly unavailable; try again on the next poll
+                print(f"Could not scan {self.folder_path}: {e!r}")
+                completed = []
+            if completed:
+                self._known.update(completed)
+                self.registered += len(completed)
+                for image_id, image_path in zip(image_ids, completed):
+                    self._put(self._decode_queue, (image_id, image_path))
+            self._stopped.wait(self.poll_interval)
+        self._put(self._decode_queue, _STOP)
+
+    def _decode(self) -> None:
+        while True:
+            item = self._decode_queue.get()
+            if item is _STOP:
+                break
+            image_id, image_path = item
+            page = self.page
+            try:
+                image = read_page(image_path, page)
+            except Exception as e:
+                print(f"Could not decode {image_path}: {e!r}")
+                self.failed += 1
+                continue
+            self._put(self._analyse_queue, (image_id, image, page))
+        self._put(self._analyse_queue, _STOP)
+
+    def _analyse(self) -> None:
+        pipeline = build_segmentation_pipeline()
+        tracker = None
+        tracked_page = None
+        while True:
+            item = self._analyse_queue.get()
+            if item is _STOP:
+                break
+            image_id, image, page = item
+            # Tracking may be switched on or off while running; switching it on, or switching
+            # to another page, starts a new series
+            if self.tracking and (tracker is None or page != tracked_page):
+                tracker = WellTracker(pipeline)
+                tracked_page = page
+            elif not self.tracking:
+                tracker = None
+            flat_field = self.flat_field
+            gain = None
+            if flat_field is not None and flat_field.matches(image.shape[1], image.shape[0]):
+                gain = flat_field.gain
+            try:
+                if self.scheduler is None:
+                    rows = self._measure(None, None, pipeline, tracker, image, gain)
+                else:
+                    job = self.scheduler.submit(
+                        f"Analysing image {image_id}", self._measure, pipeline, tracker, image, gain,
+                        priority=CURRENT_IMAGE
+                    )
+                    job.wait()
+                    if job.state == "failed":
+                        raise job.error
+                    if job.state != "done":
+                        raise JobCancelled()
+                    rows = job.result
+            except Exception as e:
+                print(f"Could not analyse image {image_id}: {e!r}")
+                self.failed += 1
+                continue
+            self._put(self._write_queue, (image_id, rows, "wells" if tracker is None else "tracking", page))
+        # Drop the last frame held by the stage cache
+        pipeline.invalidate()
+        self._put(self._write_queue, _STOP)
+
+    def _measure(self, token, progress, pipeline, tracker, image, gain):
+        '''
+        Segment and measure one frame; also usable as a scheduler job.
+        '''
+        if tracker is not None:
+            return tracker.track(image, gain)
+        pipeline.set_input("gain", gain)
+        pipeline.set_input("image", image)
+        return measurement_rows(pipeline)
+
+    def _write(self) -> None:
+        while True:
+            item = self._write_queue.get()
+            if item is _STOP:
+                break
+            image_id, rows, source, page = item
+            try:
+                self.db_manager.save_measurements(image_id, rows, source, page)
+            except Exception as e:
+                print(f"Could not save the measurements of image {image_id}: {e!r}")
+                self.failed += 1
+                continue
+            self.analysed += 1
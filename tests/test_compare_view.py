@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from compare_view import CompareCanvas, ComparePane
+from flat_field import FlatField
+
+HEIGHT, WIDTH = 120, 160
+
+
+def gain():
+    y, x = np.mgrid[0:HEIGHT, 0:WIDTH]
+    return (1.0 + x / WIDTH + y / HEIGHT).astype(np.float32)
+
+
+def pane(tmp_path, name, value):
+    img = np.full((HEIGHT, WIDTH), 50, dtype=np.uint8)
+    img[40:60, 60:80] = value
+    path = str(tmp_path / name)
+    Image.fromarray(img).save(path)
+    return ComparePane(path)
+
+
+def canvas(flat_field):
+    # The rendering runs off the Tk thread and needs no window
+    compare = CompareCanvas.__new__(CompareCanvas)
+    compare.rois = []
+    compare.flat_field = flat_field
+    compare.roi_colour = (34, 59, 201)
+    return compare
+
+
+def transforms():
+    return [
+        np.array([[scale, 0.0, -dx], [0.0, scale, -dy], [0.0, 0.0, 1.0]])
+        for scale, dx, dy in [(1.0, 0.0, 0.0), (2.0, 60.0, 40.0), (0.5, -10.0, 5.0), (3.0, 150.0, 100.0)]
+    ]
+
+
+def test_panes_render_the_same_region_under_the_shared_transform(tmp_path):
+    panes = [pane(tmp_path, "a.tif", 120), pane(tmp_path, "b.tif", 200)]
+    compare = canvas(FlatField(gain()))
+    zoom = transforms()[1]
+    with ThreadPoolExecutor(2) as executor:
+        first, second = executor.map(lambda p: compare._render_pane(p, zoom, (WIDTH, HEIGHT), "fast"), panes)
+    # Both panes show the bright square at the same canvas position, zoomed 2x around it
+    for rgb in (first, second):
+        bright = np.argwhere(rgb[..., 0] > 150)
+        assert bright.min(axis=0).tolist() == [40, 60]
+        assert bright.max(axis=0).tolist() == [79, 99]
+    assert (first[..., 0] > 150).tolist() == (second[..., 0] > 150).tolist()
+
+
+def test_concurrent_panes_share_the_viewport_gain_safely(tmp_path):
+    panes = [pane(tmp_path, f"{index}.tif", 100) for index in range(4)]
+    # Each transform rendered on its own, with an unshared flat-field
+    expected = [canvas(FlatField(gain()))._render_pane(panes[0], mat, (WIDTH, HEIGHT), "fast") for mat in transforms()]
+
+    compare = canvas(FlatField(gain()))
+    # Panes render concurrently, one thread per pane, alternating which transform each pane sees
+    with ThreadPoolExecutor(len(panes)) as executor:
+        for frame in range(50):
+            order = [(frame + index) % 4 for index in range(len(panes))]
+            results = executor.map(lambda job: compare._render_pane(job[0], transforms()[job[1]], (WIDTH, HEIGHT), "fast"), zip(panes, order))
+            for index, rgb in zip(order, results):
+                np.testing.assert_array_equal(rgb, expected[index])
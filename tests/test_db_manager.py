@@ -0,0 +1,55 @@
+import json
+import sqlite3
+import numpy as np
+from PIL import Image
+from db_manager import DatabaseManager
+
+
+def legacy_project(tmp_path):
+    '''
+    A project as older versions left it: the bare images and roi_table tables, with the
+    project name and folder in project_data.json.
+    '''
+    folder = tmp_path / "images"
+    folder.mkdir()
+    Image.fromarray(np.zeros((8, 8), dtype=np.uint8)).save(str(folder / "a.tif"))
+    db_path = str(tmp_path / "project.sqlite3")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE images (image_id INTEGER PRIMARY KEY AUTOINCREMENT, image_path TEXT)")
+        conn.execute("CREATE TABLE roi_table (roi_id INTEGER PRIMARY KEY AUTOINCREMENT, drug_name TEXT, roi_points TEXT)")
+        conn.execute("INSERT INTO images (image_path) VALUES (?)", (str(folder / "a.tif"),))
+        conn.execute(
+            "INSERT INTO roi_table (drug_name, roi_points) VALUES (?, ?)",
+            ("Drug X", "{'start': array([0., 0., 1.]), 'end': array([4., 4., 1.])}")
+        )
+    json_path = tmp_path / "project_data.json"
+    json_path.write_text(json.dumps({"folder_path": str(folder), "project_name": "legacy"}))
+    return DatabaseManager(db_path), json_path, folder
+
+
+def test_legacy_project_is_migrated_once(tmp_path):
+    db_manager, json_path, folder = legacy_project(tmp_path)
+    assert db_manager.get_metadata() == {}
+    metadata = db_manager.migrate_legacy_project(str(json_path))
+    assert metadata == {"folder_path": str(folder), "project_name": "legacy"}
+
+    # The rest of the project loads from the old tables
+    records = db_manager.get_image_records()
+    assert [record["image_path"] for record in records] == [str(folder / "a.tif")]
+    (roi_id, drug_name, roi, well, concentration), = db_manager.get_roi_records()
+    assert drug_name == "Drug X" and well is None and concentration is None
+    assert roi["end"].tolist() == [4.0, 4.0, 1.0]
+
+    # Once migrated, the JSON file is no longer needed
+    json_path.unlink()
+    assert db_manager.migrate_legacy_project(str(json_path))["project_name"] == "legacy"
+
+
+def test_unreadable_legacy_file_leaves_the_project_empty(tmp_path):
+    db_manager, json_path, _ = legacy_project(tmp_path)
+    json_path.write_text("{not json")
+    assert db_manager.migrate_legacy_project(str(json_path)) == {}
+    assert db_manager.migrate_legacy_project(str(tmp_path / "missing.json")) == {}
+    # Without a database there is no project to migrate into
+    assert DatabaseManager(str(tmp_path / "none.sqlite3")).migrate_legacy_project(str(json_path)) == {}
+    assert not (tmp_path / "none.sqlite3").exists()
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from PIL import Image
+from display import DisplayMapper, build_lut, effective_bit_depth
+
+
+def test_effective_bit_depth():
+    assert effective_bit_depth(4095, 16) == 12
+    assert effective_bit_depth(4096, 16) == 13
+    assert effective_bit_depth(100, 16) == 8
+    assert effective_bit_depth(65535, 16) == 16
+
+
+def test_twelve_bit_data_fills_the_default_window():
+    img = Image.fromarray(np.linspace(0, 4095, 256).astype(np.uint16).reshape(16, 16))
+    mapper = DisplayMapper()
+    assert np.asarray(mapper.render(img)).max() == 16
+    mapper.set_data_range(img)
+    assert mapper.full_range(16) == (0, 4095)
+    assert np.asarray(mapper.render(img)).max() == 255
+    # A window set explicitly still wins
+    mapper.set_window(0, 8190)
+    assert np.asarray(mapper.render(img)).max() == pytest.approx(128, abs=1)
+
+
+def test_eight_bit_data_passes_through():
+    img = Image.fromarray(np.arange(256, dtype=np.uint8).reshape(16, 16))
+    mapper = DisplayMapper()
+    mapper.set_data_range(img)
+    assert mapper.render(img) is img
+
+
+def test_build_lut():
+    lut = build_lut(16, 1000, 2000)
+    assert lut.shape == (65536,)
+    assert (lut[999], lut[1500], lut[2001]) == (0, 128, 255)
+    assert build_lut(8, 0, 255, colormap="hot").shape == (256, 3)
+
+
+def test_precomputed_max_skips_the_image_scan(monkeypatch):
+    img = Image.fromarray(np.linspace(0, 4095, 256).astype(np.uint16).reshape(16, 16))
+    mapper = DisplayMapper()
+
+    def scan():
+        raise AssertionError("the precomputed maximum should be used")
+
+    monkeypatch.setattr(img, "getextrema", scan)
+    mapper.set_data_range(img, max_value=4095)
+    assert mapper.full_range(16) == (0, 4095)
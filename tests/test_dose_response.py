@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from dose_response import DoseResponseCache, fit_groups, fit_logistic4_batch, group_dose_response, logistic4
+
+CONCENTRATIONS = np.logspace(-3, 2, 8)
+
+
+def curve(bottom, top, ec50, hill, concentrations=CONCENTRATIONS):
+    return logistic4(np.log10(concentrations)[None, :], np.array([[bottom, top, np.log10(ec50), hill]]))[0]
+
+
+def test_batch_recovers_known_curves():
+    truth = np.array([
+        [100.0, 2000.0, np.log10(0.5), 1.0],
+        [1500.0, 200.0, np.log10(3.0), 1.5],
+        [0.0, 1.0, np.log10(0.02), 0.8],
+    ])
+    log_conc = np.tile(np.log10(CONCENTRATIONS), (3, 1))
+    response = logistic4(log_conc, truth)
+    params, cost = fit_logistic4_batch(log_conc, response, np.ones_like(log_conc))
+    assert params == pytest.approx(truth, rel=1e-4, abs=1e-4)
+    assert cost == pytest.approx(0, abs=1e-8)
+
+
+def test_padding_does_not_change_a_fit():
+    truth = np.array([[100.0, 2000.0, np.log10(0.5), 1.2]])
+    log_conc = np.log10(CONCENTRATIONS)[None, :]
+    response = logistic4(log_conc, truth)
+    padded_conc = np.concatenate([log_conc, np.full((1, 4), log_conc[0, -1])], axis=1)
+    padded_response = np.concatenate([response, np.full((1, 4), 12345.0)], axis=1)
+    weights = np.concatenate([np.ones((1, 8)), np.zeros((1, 4))], axis=1)
+    params, _ = fit_logistic4_batch(padded_conc, padded_response, weights)
+    assert params == pytest.approx(truth, rel=1e-4)
+
+
+def test_replicates_are_averaged_and_invalid_doses_skipped():
+    drugs = ["a", "a", "a", "b", "b", "a"]
+    concentrations = [1.0, 1.0, 10.0, 5.0, 0.0, np.nan]
+    responses = [10.0, 20.0, 30.0, 40.0, 50.0, 60.0]
+    groups = group_dose_response(drugs, concentrations, responses)
+    assert sorted(groups) == ["a", "b"]
+    conc, mean, count = groups["a"]
+    assert list(conc) == [1.0, 10.0]
+    assert list(mean) == [15.0, 30.0]
+    assert list(count) == [2, 1]
+    assert list(groups["b"][0]) == [5.0]
+
+
+def test_fit_groups_reports_ec50_and_skips_short_series():
+    drugs, concentrations, responses = [], [], []
+    for drug, ec50 in [("a", 0.5), ("b", 4.0)]:
+        values = curve(100.0, 2000.0, ec50, 1.0)
+        # Two replicates per dose, scattered symmetrically around the curve
+        for offset in (-5.0, 5.0):
+            drugs += [drug] * len(CONCENTRATIONS)
+            concentrations += list(CONCENTRATIONS)
+            responses += list(values + offset)
+    drugs += ["short"] * 3
+    concentrations += [1.0, 2.0, 3.0]
+    responses += [1.0, 2.0, 3.0]
+
+    fits = fit_groups(group_dose_response(drugs, concentrations, responses))
+    assert fits["short"] is None
+    assert fits["a"]["ec50"] == pytest.approx(0.5, rel=1e-3)
+    assert fits["b"]["ec50"] == pytest.approx(4.0, rel=1e-3)
+    assert fits["a"]["n"] == 16
+    assert fits["a"]["r2"] == pytest.approx(1.0, abs=1e-6)
+
+
+def test_cache_refits_only_changed_drugs(monkeypatch):
+    import dose_response
+
+    groups = {
+        name: (CONCENTRATIONS, curve(0.0, 1.0, ec50, 1.0), np.ones(8, dtype=int))
+        for name, ec50 in [("a", 0.1), ("b", 1.0)]
+    }
+    fitted = []
+    fit = dose_response.fit_groups
+    monkeypatch.setattr(dose_response, "fit_groups", lambda stale: fitted.append(sorted(stale)) or fit(stale))
+
+    cache = DoseResponseCache()
+    first = cache.fits(groups)
+    groups["b"] = (CONCENTRATIONS, curve(0.0, 1.0, 2.0, 1.0), np.ones(8, dtype=int))
+    second = cache.fits(groups)
+    assert fitted == [["a", "b"], ["b"]]
+    assert second["a"] is first["a"]
+    assert second["b"]["ec50"] == pytest.approx(2.0, rel=1e-3)
@@ -0,0 +1,60 @@
+import csv
+import numpy as np
+import pytest
+from PIL import Image
+from db_manager import DatabaseManager
+from export import export_measurements
+
+
+@pytest.fixture
+def project(tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    for name in ["a.tif", "b.tif"]:
+        Image.fromarray(np.zeros((8, 8), dtype=np.uint8)).save(str(folder / name))
+    db_manager = DatabaseManager(str(tmp_path / "project.sqlite3"))
+    db_manager.create_database(str(folder))
+    roi_id, = db_manager.save_rois("drug", [{"start": np.array([0., 0., 1.]), "end": np.array([4., 4., 1.])}])
+    (first, _), (second, _) = db_manager.get_images()
+    db_manager.save_measurements(first, [(index, None, index, index, 10.0, 100.0 + index) for index in range(1, 8)], "wells")
+    db_manager.save_measurements(second, [(1, roi_id, 2, 2, 25.0, 42.0)], "roi_masks")
+    return db_manager
+
+
+def test_csv_export_is_written_in_chunks(project, tmp_path):
+    path = str(tmp_path / "out.csv")
+    progress = []
+    assert export_measurements(project, path, chunk_size=3, progress=lambda written, total: progress.append((written, total))) == 8
+    # Seven well rows and one ROI row, in chunks of three
+    assert progress == [(3, 8), (6, 8), (8, 8)]
+    with open(path, newline="") as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == ["image_path", "source", "page", "well_index", "roi_id", "drug_name", "center_x", "center_y", "area", "mean_intensity"]
+    assert len(rows) == 9
+    assert rows[-1][1:6] == ["roi_masks", "0", "1", "1", "drug"]
+
+
+def test_parquet_export_writes_a_row_group_per_chunk(project, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "out.parquet")
+    assert export_measurements(project, path, chunk_size=3) == 8
+    parquet = pq.ParquetFile(path)
+    assert parquet.metadata.num_row_groups == 3
+    table = parquet.read()
+    assert table.column("source").to_pylist() == ["wells"] * 7 + ["roi_masks"]
+    assert table.column("roi_id").to_pylist() == [None] * 7 + [1]
+    assert table.column("mean_intensity").to_pylist()[-1] == 42.0
+
+
+def test_cancelled_export_stops_between_chunks(project, tmp_path):
+    chunks = []
+    written = export_measurements(
+        project, str(tmp_path / "out.csv"), chunk_size=3,
+        progress=lambda written, total: chunks.append(written), cancelled=lambda: len(chunks) >= 1,
+    )
+    assert written == 3
+
+
+def test_unknown_format_is_rejected(project, tmp_path):
+    with pytest.raises(ValueError):
+        export_measurements(project, str(tmp_path / "out.xlsx"), file_format="xlsx")
@@ -0,0 +1,85 @@
+import numpy as np
+import cv2
+import pytest
+from PIL import Image
+from flat_field import FlatField, apply_gain, estimate_flat_field
+
+HEIGHT, WIDTH = 200, 300
+
+
+def illumination():
+    y, x = np.mgrid[0:HEIGHT, 0:WIDTH]
+    r2 = ((x - WIDTH / 2) / WIDTH) ** 2 + ((y - HEIGHT / 2) / HEIGHT) ** 2
+    return 1.0 - 0.8 * r2
+
+
+@pytest.fixture
+def frames(tmp_path):
+    '''
+    Vignetted frames of a uniform background with bright wells in a different place each time.
+    '''
+    rng = np.random.default_rng(1)
+    paths = []
+    for index in range(12):
+        scene = np.full((HEIGHT, WIDTH), 1000.0)
+        for _ in range(6):
+            cv2.circle(scene, (int(rng.integers(20, WIDTH - 20)), int(rng.integers(20, HEIGHT - 20))), 12, 4000.0, -1)
+        paths.append(str(tmp_path / f"frame_{index}.tif"))
+        Image.fromarray((scene * illumination()).astype(np.uint16)).save(paths[-1])
+    return paths
+
+
+def test_estimated_gain_flattens_the_background(frames, tmp_path):
+    # A frame of another size is skipped instead of breaking the model
+    odd = str(tmp_path / "odd.tif")
+    Image.fromarray(np.zeros((50, 50), dtype=np.uint16)).save(odd)
+    progress = []
+    output = estimate_flat_field(frames + [odd], str(tmp_path / "gain.npy"), strip_height=64, progress=lambda done, total: progress.append(done))
+    assert progress == list(range(1, len(frames) + 1))
+
+    flat_field = FlatField.load(output)
+    assert flat_field.matches(WIDTH, HEIGHT)
+    assert not flat_field.matches(50, 50)
+    assert float(np.mean(flat_field.gain)) == pytest.approx(1.0, rel=0.02)
+
+    background = (1000.0 * illumination()).astype(np.uint16)
+    corrected = flat_field.apply(background)
+    assert corrected.dtype == np.uint16
+    inner = corrected[20:-20, 20:-20].astype(float)
+    # The vignette drops the corners by 40 %; corrected, the background is flat within a few percent
+    assert background.min() / background.max() < 0.65
+    assert inner.min() / inner.max() > 0.95
+
+
+def test_cancelled_estimate_writes_nothing(frames, tmp_path):
+    output = tmp_path / "gain.npy"
+    assert estimate_flat_field(frames, str(output), cancelled=lambda: True) is None
+    assert not output.exists()
+    assert FlatField.load(str(output)) is None
+
+
+def test_apply_gain_saturates_and_keeps_the_dtype():
+    img = np.array([[100, 200], [250, 10]], dtype=np.uint8)
+    gain = np.array([[1.5, 1.5], [1.5, 0.25]], dtype=np.float32)
+    corrected = apply_gain(img, gain)
+    assert corrected.dtype == np.uint8
+    assert corrected.tolist() == [[150, 255], [255, 2]]
+    colour = np.stack([img] * 3, axis=2)
+    assert apply_gain(colour, gain)[..., 1].tolist() == corrected.tolist()
+    apply_gain(img, gain, out=img)
+    assert img.tolist() == corrected.tolist()
+
+
+def test_viewport_correction_matches_the_full_frame(frames, tmp_path):
+    flat_field = FlatField.load(estimate_flat_field(frames, str(tmp_path / "gain.npy")))
+    view = np.full((HEIGHT, WIDTH), 1000, dtype=np.uint16)
+    identity = np.eye(3)
+    corrected = flat_field.apply_viewport(view.copy(), identity)
+    expected = flat_field.apply(view)
+    assert np.abs(corrected.astype(int) - expected)[5:-5, 5:-5].max() <= 10
+
+    # Zoomed in 2x on the top left quarter
+    zoom = np.diag([2.0, 2.0, 1.0])
+    zoomed = flat_field.apply_viewport(view.copy(), zoom)
+    upscaled = cv2.resize(expected[:HEIGHT // 2, :WIDTH // 2], (WIDTH, HEIGHT), interpolation=cv2.INTER_LINEAR)
+    assert np.abs(zoomed.astype(int) - upscaled)[5:-5, 5:-5].max() <= 10
@@ -0,0 +1,35 @@
+import numpy as np
+import cv2
+import pytest
+from PIL import Image
+from image_stats import compute_image_stats, threshold_to_gray
+from pipeline import build_segmentation_pipeline
+
+
+def test_stats_are_in_raw_units(tmp_path):
+    img = np.full((300, 200), 1000, dtype=np.uint16)
+    cv2.circle(img, (100, 150), 60, 9000, -1)
+    path = str(tmp_path / "plate.tif")
+    Image.fromarray(img).save(path)
+
+    # Strips smaller than the image give the same result as one strip
+    stats = compute_image_stats(path, strip_height=64)
+    whole = compute_image_stats(path, strip_height=300)
+    assert np.array_equal(stats.pop("histogram"), whole.pop("histogram"))
+    assert stats == pytest.approx(whole)
+    assert (stats["min"], stats["max"]) == (1000, 9000)
+    assert stats["mean"] == pytest.approx(img.mean())
+    assert 1000 <= stats["otsu"] < 9000
+
+    # Converted to gray units, the stored threshold splits the image like the pipeline's own Otsu
+    pipeline = build_segmentation_pipeline()
+    pipeline.set_input("image", img)
+    automatic = pipeline.get("binary")
+    pipeline.set_params(threshold=threshold_to_gray(stats["otsu"], stats["min"], stats["max"]))
+    assert np.array_equal(pipeline.get("binary"), automatic)
+
+
+def test_threshold_to_gray():
+    assert threshold_to_gray(3000, 1000, 5000) == pytest.approx(127.5)
+    assert threshold_to_gray(6000, 1000, 5000) == 255
+    assert threshold_to_gray(10, 5, 5) == 0
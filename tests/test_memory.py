@@ -0,0 +1,162 @@
+import threading
+import tracemalloc
+import numpy as np
+import pytest
+from memory import LOCKED_SUBSYSTEMS, MemoryTracker, nbytes_of, profile_call
+from pipeline import Pipeline
+from roi_masks import MaskCache
+
+
+class Cache:
+    '''
+    A tracker member holding a list of byte counts, evicting from the front.
+    '''
+    def __init__(self, *sizes):
+        self.sizes = list(sizes)
+
+    def nbytes(self):
+        return sum(self.sizes)
+
+    def trim(self, max_bytes):
+        before = self.nbytes()
+        while self.sizes and self.nbytes() > max_bytes:
+            self.sizes.pop(0)
+        return before - self.nbytes()
+
+
+def test_nbytes_of(tmp_path):
+    arrays = [np.zeros(10, dtype=np.uint8), np.zeros(5, dtype=np.float32)]
+    assert nbytes_of({"a": arrays, "b": (arrays[0], None)}) == 40
+    mapped = np.lib.format.open_memmap(str(tmp_path / "a.npy"), mode="w+", dtype=np.uint8, shape=(100,))
+    assert nbytes_of(mapped) == 0
+
+
+def test_profile_call_only_traces_during_the_call():
+    assert not tracemalloc.is_tracing()
+    result, stats = profile_call(np.ones, (1024, 1024))
+    assert stats["output_bytes"] == result.nbytes
+    assert stats["peak_bytes"] >= result.nbytes
+    assert not tracemalloc.is_tracing()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        profile_call(fail)
+    assert not tracemalloc.is_tracing()
+
+    # Tracing started by someone else keeps running
+    tracemalloc.start()
+    try:
+        profile_call(np.ones, 16)
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+def test_usage_and_dead_members():
+    tracker = MemoryTracker()
+    first, second = Cache(10, 20), Cache(5)
+    tracker.register("pages", first)
+    tracker.register("pages", second)
+    assert tracker.usage() == {"pages": 35}
+    del second
+    assert tracker.usage() == {"pages": 30}
+
+
+def test_subsystem_budget_trims_largest_member_first():
+    tracker = MemoryTracker()
+    large, small = Cache(40, 40), Cache(10)
+    tracker.register("pages", large)
+    tracker.register("pages", small)
+    tracker.configure(None, pages=60)
+    assert tracker.enforce() == 40
+    assert (large.sizes, small.sizes) == ([40], [10])
+    assert tracker.report()["subsystems"]["pages"]["evicted"] == 40
+
+
+def test_global_budget_follows_eviction_order():
+    tracker = MemoryTracker()
+    pages, tiles, labels = Cache(50, 50), Cache(30, 30), Cache(100)
+    tracker.register("pages", pages)
+    tracker.register("overlay_tiles", tiles)
+    # Not in EVICTION_ORDER, so never trimmed
+    tracker.register("label_maps", labels, trim=None)
+    tracker.configure(200)
+    assert tracker.enforce() == 60
+    assert (tiles.sizes, pages.sizes, labels.sizes) == ([], [50, 50], [100])
+    tracker.configure(150)
+    tracker.enforce()
+    assert (pages.sizes, labels.sizes) == ([50], [100])
+
+
+def test_worker_enforce_leaves_tk_subsystems_alone():
+    tracker = MemoryTracker()
+    pages, tiles = Cache(50, 50), Cache(30, 30)
+    tracker.register("pages", pages)
+    tracker.register("overlay_tiles", tiles)
+    tracker.configure(200)
+    assert tracker.usage() == {"overlay_tiles": 60, "pages": 100}
+
+    tracker.configure(110)
+    # Measuring or trimming a Tk-owned cache from a worker thread would be a bug
+    tiles.nbytes = tiles.trim = lambda *args: pytest.fail("touched a Tk subsystem")
+    tracker.enforce(LOCKED_SUBSYSTEMS)
+    # The tiles still count with their last measured size
+    assert pages.sizes == [50]
+
+
+def counted_pipeline():
+    runs = []
+    pipeline = Pipeline()
+    pipeline.add_input("x")
+    pipeline.add_stage("big", lambda x: runs.append("big") or np.zeros(1000, dtype=np.uint8) + x, ["x"])
+    pipeline.add_stage("small", lambda big: runs.append("small") or big[:10].copy(), ["big"])
+    pipeline.set_input("x", 1)
+    pipeline.get("small")
+    runs.clear()
+    return pipeline, runs
+
+
+def test_pipeline_trim_drops_largest_stage():
+    pipeline, runs = counted_pipeline()
+    assert pipeline.nbytes() == 1010
+    assert pipeline.trim(100) == 1000
+    assert pipeline.nbytes() == 10
+    # The small stage stays valid; asking for the big one recomputes it
+    pipeline.get("small")
+    assert runs == []
+    assert pipeline.get("big")[0] == 1
+    assert runs == ["big"]
+
+
+def test_busy_pipeline_is_not_trimmed():
+    pipeline, _ = counted_pipeline()
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with pipeline._lock:
+            held.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait(5)
+    try:
+        assert pipeline.trim(0) == 0
+    finally:
+        release.set()
+        thread.join()
+    assert pipeline.trim(0) == 1010
+
+
+def test_mask_cache_trims_least_recently_used():
+    cache = MaskCache()
+    rois = [{"start": np.array([0, 0, 1.0]), "end": np.array([9, 9, 1.0])} for _ in range(3)]
+    for offset, roi in enumerate(rois):
+        roi["start"][0] = offset
+    sizes = [cache.get(roi, 100, 100)[1].nbytes for roi in rois]
+    cache.get(rois[0], 100, 100)
+    assert cache.nbytes() == sum(sizes)
+    assert cache.trim(sizes[0]) == sizes[1] + sizes[2]
+    assert cache.nbytes() == sizes[0]
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from PIL import Image
+from memory import memory
+from multipage import MultiPageImage, PageCache
+
+
+@pytest.fixture
+def stack(tmp_path):
+    '''
+    A two page 16-bit TIFF holding 12-bit data, like many camera stacks.
+    '''
+    ramp = np.tile(np.linspace(0, 4095, 64).astype(np.uint16), (32, 1))
+    pages = [Image.fromarray(ramp), Image.fromarray(ramp[:, ::-1].copy())]
+    path = str(tmp_path / "stack.tif")
+    pages[0].save(path, save_all=True, append_images=pages[1:])
+    return MultiPageImage(path, cache=PageCache())
+
+
+def test_pages_keep_their_format(stack):
+    assert stack.n_pages == 2
+    assert stack.page(1).format == "TIFF"
+    assert stack.page(1).format == stack.format
+
+
+def test_composite_windows_each_channel(stack):
+    identity = (1, 0, 0, 0, 1, 0)
+    composite = np.asarray(stack.render_composite((64, 32), identity))
+    assert stack.mappers[0].window == pytest.approx((20, 4075), abs=25)
+    # The brightest 12-bit values reach full brightness instead of 4095 / 65535 of it
+    assert composite[..., 1].max() == 255
+    assert composite[..., 0].max() == 255
+
+
+def test_page_cache_follows_the_memory_budget(stack):
+    page_bytes = 64 * 32 * 2
+    budget = memory.budget
+    memory.configure(budget, pages=page_bytes)
+    try:
+        cache = PageCache()
+        cache.put(("a", 0), stack.page(0))
+        cache.put(("a", 1), stack.page(1))
+        assert cache.nbytes == page_bytes
+        assert cache.get(("a", 0)) is None
+    finally:
+        memory.configure(budget, pages=None)
+
+
+def test_analysis_reads_the_selected_page(tmp_path):
+    from db_manager import DatabaseManager
+    from multipage import read_page
+    from roi_masks import extract_roi_measurements
+    from scheduler import CancelToken
+
+    folder = tmp_path / "images"
+    folder.mkdir()
+    channels = [np.full((40, 40), value, dtype=np.uint16) for value in (1000, 3000)]
+    path = str(folder / "plate.tif")
+    Image.fromarray(channels[0]).save(path, save_all=True, append_images=[Image.fromarray(channels[1])])
+    np.testing.assert_array_equal(read_page(path, 1), channels[1])
+    with pytest.raises(OSError):
+        read_page(path, 2)
+
+    db_manager = DatabaseManager(str(tmp_path / "project.sqlite3"))
+    db_manager.create_database(str(folder))
+    roi_id, = db_manager.save_rois("drug", [{"start": np.array([5.0, 5.0, 1.0]), "end": np.array([20.0, 20.0, 1.0])}])
+    db_manager.update_concentration(roi_id, 1.0)
+    for page in (0, 1):
+        extract_roi_measurements(CancelToken(), lambda done, total: None, db_manager, page=page)
+    # Each page keeps its own measurements
+    rows = [row for _, chunk in db_manager.iter_measurements() for row in chunk]
+    assert sorted((row[2], row[-1]) for row in rows) == [(0, 1000.0), (1, 3000.0)]
+    assert list(db_manager.get_dose_response_data("roi_masks", page=1)[2]) == [3000.0]
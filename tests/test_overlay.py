@@ -0,0 +1,36 @@
+import numpy as np
+from PIL import Image
+from overlay import WellOverlay
+
+
+def grid_wells(columns, rows, spacing=256):
+    wells = []
+    for row in range(rows):
+        for column in range(columns):
+            x, y = column * spacing + 128, row * spacing + 128
+            contour = np.array([[[x - 20, y - 20]], [[x + 20, y - 20]], [[x + 20, y + 20]], [[x - 20, y + 20]]], dtype=np.int32)
+            wells.append((contour, (x, y)))
+    return wells
+
+
+def test_resized_tiles_are_bounded():
+    overlay = WellOverlay(max_tiles=4)
+    overlay.set_wells(grid_wells(4, 4))
+    # Zoomed in 1.5x over a 4 x 4 tile grid, every visible tile needs a resized copy
+    mat_affine = np.array([[1.5, 0, 0], [0, 1.5, 0], [0, 0, 1]])
+    dst = overlay.composite(Image.new("RGB", (1536, 1536)), mat_affine)
+    assert len(overlay._tiles) <= 4
+    assert len(overlay._scaled) <= 4
+    # Outlines were drawn everywhere, not only in the cached tiles
+    assert np.asarray(dst)[..., 1].reshape(4, 384, 4, 384).max(axis=(1, 3)).min() == 255
+
+
+def test_update_invalidates_touched_tiles_only():
+    overlay = WellOverlay()
+    overlay.set_wells(grid_wells(2, 1))
+    overlay.composite(Image.new("RGB", (512, 256)), np.eye(3))
+    assert {key for key, tile in overlay._tiles.items() if tile is not None} == {(0, 0, 0), (0, 1, 0)}
+    contour, center = grid_wells(1, 1)[0]
+    overlay.update_wells({1: (contour + 5, center)})
+    assert (0, 0, 0) not in overlay._tiles
+    assert overlay._tiles[(0, 1, 0)] is not None
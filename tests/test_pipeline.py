@@ -0,0 +1,112 @@
+import numpy as np
+import cv2
+import pytest
+from pipeline import Pipeline, build_segmentation_pipeline, measurement_rows
+
+
+def well_plate(shape=(240, 320), value=200, background=20, dtype=np.uint8):
+    '''
+    A synthetic plate with a 3x4 grid of round wells.
+    '''
+    img = np.full(shape, background, dtype=dtype)
+    for row in range(3):
+        for column in range(4):
+            cv2.circle(img, (40 + column * 80, 40 + row * 80), 22, int(value), -1)
+    return img
+
+
+def counting_pipeline():
+    calls = []
+
+    def stage(tag):
+        def func(*args, **params):
+            calls.append(tag)
+            return (tag, args, tuple(sorted(params.items())))
+        return func
+
+    pipeline = Pipeline()
+    pipeline.add_input("x")
+    pipeline.add_stage("a", stage("a"), ["x"], {"p": 1})
+    pipeline.add_stage("b", stage("b"), ["a"], {"q": 2})
+    pipeline.add_stage("c", stage("c"), ["x"])
+    return pipeline, calls
+
+
+def test_get_memoises_stages():
+    pipeline, calls = counting_pipeline()
+    pipeline.set_input("x", 1)
+    pipeline.get("b")
+    pipeline.get("b")
+    assert calls == ["a", "b"]
+    assert pipeline.last_run == []
+
+
+def test_param_change_reruns_only_dependents():
+    pipeline, calls = counting_pipeline()
+    pipeline.set_input("x", 1)
+    pipeline.get("b")
+    pipeline.get("c")
+    calls.clear()
+
+    pipeline.set_params(q=3)
+    pipeline.get("b")
+    pipeline.get("c")
+    assert calls == ["b"]
+
+    # Setting a parameter to its current value changes nothing
+    pipeline.set_params(p=1)
+    pipeline.get("b")
+    assert calls == ["b"]
+
+
+def test_input_change_reruns_downstream():
+    pipeline, calls = counting_pipeline()
+    pipeline.set_input("x", 1)
+    pipeline.get("b")
+    calls.clear()
+    pipeline.set_input("x", 2)
+    assert pipeline.get("b")[1][0][1] == (2,)
+    assert calls == ["a", "b"]
+
+
+def test_invalidate_and_downstream():
+    pipeline, calls = counting_pipeline()
+    assert pipeline.downstream("x") == {"a", "b", "c"}
+    assert pipeline.downstream("p") == {"a", "b"}
+    pipeline.set_input("x", 1)
+    pipeline.get("b")
+    calls.clear()
+    pipeline.invalidate("a")
+    pipeline.get("b")
+    assert calls == ["a", "b"]
+
+
+def test_unknown_names_raise():
+    pipeline, _ = counting_pipeline()
+    with pytest.raises(KeyError):
+        pipeline.set_input("y", 1)
+    with pytest.raises(KeyError):
+        pipeline.set_params(r=1)
+    with pytest.raises(KeyError):
+        pipeline.add_stage("d", lambda v: v, ["missing"])
+    with pytest.raises(ValueError):
+        pipeline.add_stage("a", lambda v: v, ["x"])
+
+
+def test_segmentation_finds_wells():
+    pipeline = build_segmentation_pipeline()
+    pipeline.set_input("image", well_plate())
+    rows = measurement_rows(pipeline)
+    assert len(rows) == 12
+    assert [row[0] for row in rows] == list(range(1, 13))
+    assert all(row[5] == pytest.approx(200, abs=1) for row in rows)
+
+
+def test_threshold_change_keeps_upstream_cache():
+    pipeline = build_segmentation_pipeline()
+    pipeline.set_input("image", well_plate())
+    pipeline.get("wells")
+    pipeline.set_params(threshold=100)
+    pipeline.get("wells")
+    assert "gray" not in pipeline.last_run
+    assert pipeline.last_run[0] == "binary"
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from plate_layout import MIN_WELL_PITCH, generate_plate_rois, row_name, well_name
+
+
+def centers(rois):
+    return np.array([(roi["start"][:2] + roi["end"][:2]) / 2 for roi in rois])
+
+
+def test_well_names():
+    assert [row_name(row) for row in (0, 7, 25, 26, 27, 31)] == ["A", "H", "Z", "AA", "AB", "AF"]
+    assert well_name(0, 0) == "A1"
+    assert well_name(7, 11) == "H12"
+    assert well_name(31, 47) == "AF48"
+
+
+def test_96_well_layout():
+    # A1 at (100, 50), H12 at (1200, 750): a 100 x 100 pixel pitch
+    rois = generate_plate_rois(96, (100, 50), (1200, 750))
+    assert len(rois) == 96
+    assert [roi["well"] for roi in rois[:13]] == [f"A{column}" for column in range(1, 13)] + ["B1"]
+    assert rois[-1]["well"] == "H12"
+    np.testing.assert_allclose(centers(rois)[[0, 1, 12, 95]], [(100, 50), (200, 50), (100, 150), (1200, 750)])
+    # Wells default to 80 % of the pitch
+    np.testing.assert_allclose(rois[0]["end"] - rois[0]["start"], [80, 80, 0])
+
+
+def test_384_well_layout():
+    rois = generate_plate_rois(384, (0, 0), (230, 150), well_size=6)
+    assert len(rois) == 384
+    assert rois[23]["well"] == "A24" and rois[24]["well"] == "B1" and rois[-1]["well"] == "P24"
+    np.testing.assert_allclose(centers(rois)[[1, 24, 383]], [(10, 0), (0, 10), (230, 150)])
+    np.testing.assert_allclose(rois[0]["end"] - rois[0]["start"], [6, 6, 0])
+
+
+@pytest.mark.parametrize("last_center", [
+    (100, 50),                            # A click without a drag
+    (1200, 50),                           # A drag along one row only
+    (100 + 11 * MIN_WELL_PITCH / 2, 60),  # A drag shorter than the minimum pitch
+])
+def test_degenerate_layouts_are_rejected(last_center):
+    with pytest.raises(ValueError):
+        generate_plate_rois(96, (100, 50), last_center)
+
+
+def test_invalid_format_and_well_size_are_rejected():
+    with pytest.raises(ValueError):
+        generate_plate_rois(48, (0, 0), (100, 100))
+    with pytest.raises(ValueError):
+        generate_plate_rois(96, (0, 0), (1100, 700), well_size=0)
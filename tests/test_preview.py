@@ -0,0 +1,72 @@
+import numpy as np
+import cv2
+import pytest
+from PIL import Image
+from preview import SegmentationPreview
+from scheduler import JobScheduler
+from test_scheduler import FakeRoot
+
+
+class FakeCanvas:
+    def __init__(self):
+        self.draws = 0
+
+    def _draw_image(self):
+        self.draws += 1
+
+
+@pytest.fixture
+def preview():
+    root = FakeRoot()
+    scheduler = JobScheduler(root)
+    preview = SegmentationPreview(FakeCanvas(), scheduler)
+    yield root, preview
+    scheduler.shutdown()
+
+
+def wells_12bit():
+    '''
+    A 12-bit fluorescence frame stored as 16-bit: dim background with four bright wells.
+    '''
+    img = np.full((200, 200), 300, dtype=np.uint16)
+    for x, y in [(50, 50), (150, 50), (50, 150), (150, 150)]:
+        cv2.circle(img, (x, y), 30, 3500, -1)
+    return img
+
+
+def well_coverage(overlay):
+    return np.mean(np.asarray(overlay)[..., 3] > 0)
+
+
+def test_16_bit_frames_are_segmented_in_their_own_range(preview):
+    root, preview = preview
+    image = Image.fromarray(wells_12bit())
+    assert image.mode.startswith("I;16")
+    preview.request(image, np.eye(3), (200, 200))
+    root.run_until(lambda: preview._overlay is not None)
+    box, overlay = preview._overlay
+    assert box == (0, 0, 200, 200)
+    # Four wells of radius 30 cover about 28 % of the frame, not all of it
+    assert well_coverage(overlay) == pytest.approx(4 * np.pi * 30 ** 2 / 200 ** 2, abs=0.06)
+    assert preview.canvas.draws == 1
+
+
+def test_overlay_stays_until_the_next_result(preview):
+    root, preview = preview
+    image = Image.fromarray(wells_12bit())
+    preview.request(image, np.eye(3), (200, 200))
+    root.run_until(lambda: preview._overlay is not None)
+    first = preview._overlay
+
+    # Panning keeps the stale overlay on screen, scaled into place, until the new one arrives
+    panned = np.array([[1.0, 0.0, -20.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]])
+    preview.request(image, panned, (200, 200))
+    assert preview._overlay is first
+    dst = preview.composite(Image.new("RGB", (200, 200)), panned)
+    assert np.asarray(dst)[50, 30, 1] > 0
+    root.run_until(lambda: preview._overlay is not first)
+    assert preview._overlay[0] == (20, 0, 200, 200)
+
+    # A different image does not show the old overlay
+    preview.request(Image.fromarray(wells_12bit()), np.eye(3), (200, 200))
+    assert preview._overlay is None
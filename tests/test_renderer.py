@@ -0,0 +1,81 @@
+import numpy as np
+import cv2
+import pytest
+from PIL import Image
+from renderer import FAST, FINE, ViewportRenderer
+
+
+@pytest.fixture
+def image():
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (120, 160), dtype=np.uint8))
+
+
+def transform(scale, offset_x=0.0, offset_y=0.0):
+    return np.array([[scale, 0.0, offset_x], [0.0, scale, offset_y], [0.0, 0.0, 1.0]])
+
+
+def direct(image, mat_affine, size):
+    '''
+    The canvas' original path: PIL's affine transform with the inverse matrix.
+    '''
+    inverse = np.linalg.inv(mat_affine)
+    return np.asarray(image.transform(size, Image.AFFINE, tuple(inverse[:2].flatten()), Image.NEAREST))
+
+
+def sample_positions(mat_affine, length, axis):
+    '''
+    Continuous source coordinate sampled by each canvas pixel centre along one axis.
+    '''
+    return (np.arange(length) + 0.5 - mat_affine[axis, 2]) / mat_affine[axis, axis]
+
+
+@pytest.mark.parametrize("mat_affine", [transform(1.0), transform(3.0, -40, -25), transform(1.5, 17, 9), transform(1.3, -7.4, 3.2)])
+def test_zoomed_in_matches_the_direct_transform(mat_affine):
+    # Images whose values are their own column and row, so a render shows which pixel was sampled
+    columns = Image.fromarray(np.tile(np.arange(160, dtype=np.uint8), (120, 1)))
+    rows = Image.fromarray(np.tile(np.arange(120, dtype=np.uint8)[:, None], (1, 160)))
+    size = (200, 150)
+    xs, ys = sample_positions(mat_affine, size[0], 0), sample_positions(mat_affine, size[1], 1)
+    inside = ((xs >= 0) & (xs < 160))[None, :] & ((ys >= 0) & (ys < 120))[:, None]
+    # Centres landing exactly on a pixel edge may go either way
+    ties = (np.isclose(xs, np.round(xs))[None, :]) | (np.isclose(ys, np.round(ys))[:, None])
+
+    # Linear sampling blends in the black border within half a pixel of the edge
+    interior = ((xs >= 0.5) & (xs <= 159.5))[None, :] & ((ys >= 0.5) & (ys <= 119.5))[:, None]
+
+    renderer = ViewportRenderer()
+    for image in (columns, rows):
+        renderer.set_image(image)
+        rendered = renderer.render(mat_affine, size, FAST).astype(int)
+        expected = direct(image, mat_affine, size).astype(int)
+        assert (rendered == expected)[inside & ~ties].all()
+        assert (np.abs(rendered - expected) <= 1)[inside].all()
+        # Linear sampling at most blends the two nearest pixels
+        fine = renderer.render(mat_affine, size, FINE).astype(int)
+        assert (np.abs(fine - expected) <= 1)[interior].all()
+
+
+def test_zoomed_out_averages_like_a_resize(image):
+    renderer = ViewportRenderer()
+    renderer.set_image(image)
+    rendered = renderer.render(transform(0.25), (40, 30), FINE)
+    expected = cv2.resize(np.asarray(image), (40, 30), interpolation=cv2.INTER_AREA)
+    assert np.abs(rendered.astype(int) - expected).max() <= 2
+
+
+def test_fast_frames_only_use_built_levels(image):
+    renderer = ViewportRenderer()
+    renderer.set_image(image)
+    renderer.render(transform(0.25), (40, 30), FAST)
+    assert len(renderer._levels) == 1
+    renderer.render(transform(0.25), (40, 30), FINE)
+    assert len(renderer._levels) == 3
+
+
+def test_outside_the_image_is_black_and_the_buffer_is_reused(image):
+    renderer = ViewportRenderer()
+    renderer.set_image(image)
+    first = renderer.render(transform(1.0, 100, 100), (300, 300))
+    assert not first[250:, 250:].any()
+    assert renderer.render(transform(2.0), (300, 300)) is first
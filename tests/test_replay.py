@@ -0,0 +1,65 @@
+import json
+import os
+import shutil
+import numpy as np
+import pytest
+from PIL import Image
+from replay import InteractionRecorder, ReplayHost, _start_virtual_display, load_recording, replay, synthetic_session
+
+
+@pytest.fixture(scope="module")
+def display():
+    '''
+    A usable X display: the current one, or Xvfb started on $FLORO_XVFB_DISPLAY (default :97).
+    '''
+    if os.name != "nt" and not os.environ.get("DISPLAY") and shutil.which("Xvfb") is None:
+        pytest.skip("no display and Xvfb is not installed")
+    try:
+        xvfb = _start_virtual_display()
+    except RuntimeError as e:
+        pytest.skip(str(e))
+    yield
+    if xvfb is not None:
+        xvfb.terminate()
+        del os.environ["DISPLAY"]
+
+
+@pytest.fixture
+def image():
+    return Image.fromarray(np.tile(np.linspace(0, 255, 400).astype(np.uint8), (300, 1)))
+
+
+def test_synthetic_replay_reports_frame_times(display, image):
+    header, events = synthetic_session((400, 300))
+    rois = [{"start": np.array([50., 50., 1.]), "end": np.array([150., 120., 1.])}]
+    report = replay(header, events, image, rois, realtime=False)
+    assert report["events"] == len(events)
+    assert report["frame_ms"]["p50"] <= report["frame_ms"]["max"]
+    assert report["redraws"] > 0
+    assert report["tk_calls"] > 0
+    json.dumps(report)
+
+
+def test_recording_round_trip(display, image, tmp_path):
+    host = ReplayHost((400, 300))
+    try:
+        host.update()
+        host.canvas.set_image(image)
+        path = str(tmp_path / "session.jsonl")
+        recorder = InteractionRecorder(host.canvas, path, image_path="image.tif")
+        for x in range(10, 60, 10):
+            host.canvas.event_generate("<Motion>", x=x, y=20, when="now")
+        recorder.close()
+    finally:
+        host.destroy()
+
+    header, events = load_recording(path)
+    assert header["canvas_size"] == [400, 300]
+    assert [event["x"] for event in events] == [10, 20, 30, 40, 50]
+
+
+def test_unknown_recording_version_is_rejected(tmp_path):
+    path = tmp_path / "session.jsonl"
+    path.write_text(json.dumps({"version": 99}) + "\n")
+    with pytest.raises(ValueError):
+        load_recording(str(path))
@@ -0,0 +1,130 @@
+import sqlite3
+import numpy as np
+import pytest
+from PIL import Image
+from db_manager import DatabaseManager, parse_roi_points
+from roi_masks import MaskCache, extract_roi_measurements, is_complete_roi, measure_rois, rasterise_roi, roi_bbox
+from scheduler import CancelToken
+
+
+def rectangle(x0, y0, x1, y1):
+    return {"start": np.array([x0, y0, 1.0]), "end": np.array([x1, y1, 1.0])}
+
+
+def test_bbox_includes_the_last_row_and_column():
+    polygon = {"shape": "polygon", "points": [[10, 10], [20, 10], [20, 20], [10, 20]]}
+    assert roi_bbox(polygon, 100, 100) == (10, 10, 21, 21)
+    mask = rasterise_roi(polygon, roi_bbox(polygon, 100, 100))
+    assert mask.shape == (11, 11)
+    # fillPoly includes the outline, so the square covers 11 x 11 pixels
+    assert mask[-1].all() and mask[:, -1].all()
+
+    ellipse = dict(rectangle(10, 10, 30, 20), shape="ellipse")
+    mask = rasterise_roi(ellipse, roi_bbox(ellipse, 100, 100))
+    assert mask[:, -1].any() and mask[-1].any()
+
+
+def test_bbox_is_clipped_to_the_image():
+    assert roi_bbox(rectangle(90, 90, 120, 120), 100, 100) == (90, 90, 100, 100)
+    assert roi_bbox(rectangle(110, 110, 120, 120), 100, 100) is None
+
+
+def test_measure_rois():
+    img = np.zeros((100, 100), dtype=np.uint16)
+    img[10:31, 10:31] = 1000
+    results = measure_rois(img, [rectangle(10, 10, 30, 30), rectangle(200, 200, 210, 210)], MaskCache())
+    assert results[1] is None
+    assert results[0]["mean_intensity"] == pytest.approx(1000)
+    assert results[0]["area"] == 21 * 21
+    assert (results[0]["center_x"], results[0]["center_y"]) == (20, 20)
+
+
+@pytest.fixture
+def project(tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    img = np.full((100, 100), 100, dtype=np.uint16)
+    img[10:31, 10:31] = 2000
+    img[50:71, 50:71] = 4000
+    Image.fromarray(img).save(str(folder / "a.tif"))
+    db_manager = DatabaseManager(str(tmp_path / "project.sqlite3"))
+    db_manager.create_database(str(folder))
+    db_manager.save_rois("drug", [rectangle(10, 10, 30, 30), rectangle(50, 50, 70, 70)])
+    return db_manager
+
+
+def test_roi_rows_are_one_based(project):
+    assert extract_roi_measurements(CancelToken(), lambda done, total: None, project) == 1
+    rows = [row for _, chunk in project.iter_measurements() for row in chunk]
+    assert [(row[1], row[3]) for row in rows] == [("roi_masks", 1), ("roi_masks", 2)]
+    assert [row[-1] for row in rows] == pytest.approx([2000, 4000])
+
+
+def test_sources_do_not_replace_each_other(project):
+    (image_id, _), = project.get_images()
+    roi_ids = [record[0] for record in project.get_roi_records()]
+    for roi_id, concentration in zip(roi_ids, [1.0, 10.0]):
+        project.update_concentration(roi_id, concentration)
+    project.save_measurements(image_id, [(1, roi_ids[0], 20, 20, 441, 2000.0), (2, roi_ids[1], 60, 60, 441, 4000.0)], "roi_masks")
+    project.save_measurements(image_id, [(1, roi_ids[0], 20, 20, 300, 2500.0)], "roi_wells")
+    project.save_measurements(image_id, [(1, None, 20, 20, 300, 2500.0)], "wells")
+    assert project.count_measurements() == 4
+
+    # Measuring again replaces only the rows of the same source
+    project.save_measurements(image_id, [(1, roi_ids[0], 20, 20, 300, 2600.0)], "roi_wells")
+    assert project.count_measurements() == 4
+
+    _, _, responses = project.get_dose_response_data("roi_masks")
+    assert sorted(responses) == [2000, 4000]
+    _, _, responses = project.get_dose_response_data("roi_wells")
+    assert list(responses) == [2600]
+    with pytest.raises(ValueError):
+        project.save_measurements(image_id, [], "unknown")
+
+
+def test_roi_points_round_trip(tmp_path):
+    db_manager = DatabaseManager(str(tmp_path / "project.sqlite3"))
+    db_manager.create_database(str(tmp_path))
+    rois = [
+        dict(rectangle(10.123456789012, 20.987654321098, 30.5, 40.25), well="A1"),
+        {"shape": "polygon", "points": np.array([[1.000000001, 2.5], [3.25, 4.123456789], [5.0, 6.0]])},
+    ]
+    db_manager.save_rois("drug", rois)
+    stored = [record[2] for record in db_manager.get_roi_records()]
+    np.testing.assert_array_equal(stored[0]["start"], rois[0]["start"])
+    np.testing.assert_array_equal(stored[0]["end"], rois[0]["end"])
+    assert stored[0]["well"] == "A1"
+    assert stored[1]["shape"] == "polygon"
+    np.testing.assert_array_equal(stored[1]["points"], rois[1]["points"])
+
+    # A reloaded ROI matches its stored row, so it can be deleted
+    roi_id = db_manager.get_roi_records()[1][0]
+    assert db_manager.delete_roi(stored[1]) == roi_id
+    assert len(db_manager.get_roi_records()) == 1
+
+
+def test_legacy_roi_strings_are_parsed(tmp_path):
+    legacy = rectangle(10, 20, 30, 40)
+    legacy["well"] = "B2"
+    roi = parse_roi_points(str(legacy))
+    np.testing.assert_array_equal(roi["start"], [10, 20, 1])
+    assert roi["well"] == "B2"
+
+    db_manager = DatabaseManager(str(tmp_path / "project.sqlite3"))
+    db_manager.create_database(str(tmp_path))
+    with sqlite3.connect(db_manager.db_path) as conn:
+        conn.execute("INSERT INTO roi_table (drug_name, roi_points) VALUES (?, ?)", ("drug", str(legacy)))
+    assert db_manager.delete_roi(legacy) is not None
+    assert db_manager.get_roi_records() == []
+
+
+def test_incomplete_rois_are_skipped(project):
+    # A click without a drag stores no end point; a zero width rectangle covers nothing
+    project.save_rois("drug", [{"start": np.array([5.0, 5.0, 1.0]), "end": None}, rectangle(40, 40, 40, 60)])
+    assert not is_complete_roi({"start": np.array([5.0, 5.0, 1.0]), "end": None})
+    assert not is_complete_roi({"shape": "polygon", "points": [[1, 1], [5, 5]]})
+    assert is_complete_roi(rectangle(10, 10, 30, 30))
+
+    assert extract_roi_measurements(CancelToken(), lambda done, total: None, project) == 1
+    rows = [row for _, chunk in project.iter_measurements() for row in chunk]
+    assert [row[3] for row in rows] == [1, 2]
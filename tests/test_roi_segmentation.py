@@ -0,0 +1,76 @@
+import numpy as np
+import cv2
+import pytest
+import pipeline
+from pipeline import merge_regions, roi_measurement_rows
+
+CENTERS = [(60, 60), (150, 60), (60, 150), (300, 300)]
+
+
+def plate():
+    img = np.full((400, 400), 500, dtype=np.uint16)
+    for index, center in enumerate(CENTERS):
+        cv2.circle(img, center, 25, 3000 + 400 * index, -1)
+    return img
+
+
+def rois():
+    return [
+        (index + 1, {"start": np.array([x - 40, y - 40, 1.0]), "end": np.array([x + 40, y + 40, 1.0])})
+        for index, (x, y) in enumerate(CENTERS)
+    ]
+
+
+def test_merge_regions():
+    assert merge_regions([(0, 0, 10, 10), (5, 5, 20, 20), (30, 30, 40, 40)]) == [(0, 0, 20, 20), (30, 30, 40, 40)]
+    # Merging two boxes can create an overlap with a third
+    assert merge_regions([(0, 0, 10, 10), (8, 0, 20, 10), (15, 5, 30, 30)]) == [(0, 0, 30, 30)]
+
+
+def test_wells_are_measured_in_raw_units():
+    rows = roi_measurement_rows(plate(), rois())
+    assert [row[1] for row in rows] == [1, 2, 3, 4]
+    assert [row[0] for row in rows] == [1, 2, 3, 4]
+    assert [row[5] for row in rows] == pytest.approx([3000, 3400, 3800, 4200])
+
+
+def test_flat_field_gain_is_applied_to_measurements():
+    gain = np.full((400, 400), 0.5, dtype=np.float32)
+    rows = roi_measurement_rows(plate(), rois(), gain=gain)
+    assert [row[5] for row in rows] == pytest.approx([1500, 1700, 1900, 2100])
+
+
+def test_results_do_not_depend_on_region_grouping(monkeypatch):
+    separate = roi_measurement_rows(plate(), rois())
+
+    # Force every ROI into one region covering all of them
+    def single_region(boxes):
+        boxes = np.array(boxes)
+        return [(*boxes[:, :2].min(axis=0), *boxes[:, 2:].max(axis=0))]
+
+    monkeypatch.setattr(pipeline, "merge_regions", single_region)
+    merged = roi_measurement_rows(plate(), rois())
+    assert [row[1:] for row in merged] == [row[1:] for row in separate]
+
+
+def test_wells_outside_rois_are_dropped():
+    rows = roi_measurement_rows(plate(), rois()[:2])
+    assert [row[1] for row in rows] == [1, 2]
+
+
+def test_incomplete_rois_do_not_fail_the_project(tmp_path):
+    from PIL import Image
+    from db_manager import DatabaseManager
+    from scheduler import CancelToken
+
+    folder = tmp_path / "images"
+    folder.mkdir()
+    Image.fromarray(plate()).save(str(folder / "plate.tif"))
+    db_manager = DatabaseManager(str(tmp_path / "project.sqlite3"))
+    db_manager.create_database(str(folder))
+    db_manager.save_rois("drug", [roi for _, roi in rois()] + [{"start": np.array([5.0, 5.0, 1.0]), "end": None}])
+
+    # Incomplete ROIs passed directly are ignored too
+    assert len(roi_measurement_rows(plate(), rois() + [(9, {"start": np.array([5.0, 5.0, 1.0]), "end": None})])) == 4
+    assert pipeline.segment_project_rois(CancelToken(), lambda done, total: None, db_manager) == 1
+    assert db_manager.count_measurements() == 4
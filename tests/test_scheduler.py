@@ -0,0 +1,108 @@
+import itertools
+import threading
+import time
+import pytest
+from scheduler import BATCH, CURRENT_IMAGE, PREVIEW, JobScheduler
+
+
+class FakeRoot:
+    '''
+    Stands in for the Tk root: records after() callbacks and runs them on the test thread.
+    '''
+    def __init__(self):
+        self.callbacks = {}
+        self._ids = itertools.count()
+
+    def after(self, ms, func):
+        assert threading.current_thread() is threading.main_thread()
+        after_id = next(self._ids)
+        self.callbacks[after_id] = func
+        return after_id
+
+    def after_cancel(self, after_id):
+        self.callbacks.pop(after_id, None)
+
+    def run_until(self, condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            pending, self.callbacks = self.callbacks, {}
+            for func in pending.values():
+                func()
+            time.sleep(0.01)
+        assert condition()
+
+
+@pytest.fixture
+def scheduler():
+    root = FakeRoot()
+    scheduler = JobScheduler(root)
+    yield root, scheduler
+    scheduler.shutdown()
+
+
+def blocker(started, release):
+    def func(token, progress):
+        started.release()
+        release.wait(5)
+    return func
+
+
+def occupy_workers(scheduler):
+    started = threading.Semaphore(0)
+    releases = [threading.Event(), threading.Event()]
+    for release in releases:
+        scheduler.submit("blocker", blocker(started, release), priority=CURRENT_IMAGE)
+    assert started.acquire(timeout=5) and started.acquire(timeout=5)
+    return releases
+
+
+def test_jobs_run_in_priority_order(scheduler):
+    root, scheduler = scheduler
+    releases = occupy_workers(scheduler)
+    order = []
+    jobs = [
+        scheduler.submit(name, lambda token, progress, name=name: order.append(name), priority=priority)
+        for name, priority in [("batch", BATCH), ("current", CURRENT_IMAGE), ("preview", PREVIEW)]
+    ]
+    # Free one worker at a time, so the queue is drained in order
+    releases[0].set()
+    assert jobs[1].wait(5)
+    releases[1].set()
+    assert all(job.wait(5) for job in jobs)
+    assert order == ["preview", "current", "batch"]
+
+
+def test_callbacks_run_on_the_tk_thread_and_survive_errors(scheduler):
+    root, scheduler = scheduler
+    delivered = []
+
+    def broken(job):
+        raise RuntimeError("callback bug")
+
+    def record(job):
+        assert threading.current_thread() is threading.main_thread()
+        delivered.append((job.name, job.state, job.result, job.error))
+
+    def fail(token, progress):
+        raise ValueError("job bug")
+
+    scheduler.submit("broken", lambda token, progress: 1, on_done=broken)
+    scheduler.submit("ok", lambda token, progress: 2, on_done=record)
+    scheduler.submit("failing", fail, on_done=record)
+    root.run_until(lambda: len(delivered) == 2)
+    results = {name: (state, result, error) for name, state, result, error in delivered}
+    assert results["ok"] == ("done", 2, None)
+    assert results["failing"][0] == "failed"
+    assert isinstance(results["failing"][2], ValueError)
+
+
+def test_shutdown_finishes_queued_jobs(scheduler):
+    root, scheduler = scheduler
+    releases = occupy_workers(scheduler)
+    queued = scheduler.submit("queued", lambda token, progress: None)
+    scheduler.shutdown()
+    assert queued.wait(5)
+    assert queued.state == "cancelled"
+    assert not root.callbacks
+    for release in releases:
+        release.set()
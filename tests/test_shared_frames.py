@@ -0,0 +1,124 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import cv2
+import pytest
+from PIL import Image
+from db_manager import DatabaseManager
+from pipeline import build_segmentation_pipeline, measurement_rows, segment_project
+from scheduler import CancelToken, JobCancelled
+from shared_frames import FrameRegistry, attach_frame, segment_shared
+
+
+def wells(value=3000):
+    img = np.full((120, 160), 200, dtype=np.uint16)
+    for x, y in [(40, 40), (120, 40), (40, 90), (120, 90)]:
+        cv2.circle(img, (x, y), 18, value, -1)
+    return img
+
+
+def is_linked(name):
+    try:
+        shared_memory.SharedMemory(name=name).close()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def test_last_release_unlinks():
+    registry = FrameRegistry()
+    frame = registry.publish(wells())
+    registry.acquire(frame)
+    registry.release(frame)
+    assert registry.active() == 1 and is_linked(frame.name)
+    registry.release(frame)
+    assert registry.active() == 0
+    assert not is_linked(frame.name)
+
+
+def test_publishers_of_one_key_share_a_segment():
+    registry = FrameRegistry()
+    frames = []
+    threads = [threading.Thread(target=lambda: frames.append(registry.publish(wells(), key=("a.tif", 0)))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({frame.name for frame in frames}) == 1
+    assert registry.active() == 1
+    for frame in frames:
+        registry.release(frame)
+    assert registry.active() == 0
+
+
+def test_cancelled_job_releases_its_lease():
+    registry = FrameRegistry()
+    frame = registry.publish(wells())
+    with pytest.raises(JobCancelled):
+        with registry.lease(frame):
+            token = CancelToken()
+            token.cancel()
+            token.raise_if_cancelled()
+    registry.release(frame)
+    assert not is_linked(frame.name)
+
+
+def test_worker_process_attaches_and_writes_labels():
+    registry = FrameRegistry()
+    image = wells()
+    frame = registry.publish(image)
+    labels = registry.allocate(image.shape, np.int32)
+    try:
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            rows = pool.submit(segment_shared, frame, labels).result(timeout=60)
+        pipeline = build_segmentation_pipeline()
+        pipeline.set_input("image", image)
+        assert rows == measurement_rows(pipeline)
+        assert len(rows) == 4
+        np.testing.assert_array_equal(registry.view(labels), pipeline.get("watershed"))
+        # Workers only get read-only views of published frames
+        with attach_frame(frame) as view:
+            assert not view.flags.writeable
+    finally:
+        registry.close()
+
+
+@pytest.fixture
+def project(tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    for index, value in enumerate([3000, 3500, 4000]):
+        Image.fromarray(wells(value)).save(str(folder / f"frame_{index}.tif"))
+    db_manager = DatabaseManager(str(tmp_path / "project.sqlite3"))
+    db_manager.create_database(str(folder))
+    return db_manager
+
+
+def shared_segments():
+    return set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+
+
+def test_segment_project_in_worker_processes(project):
+    before = shared_segments()
+    assert segment_project(CancelToken(), lambda done, total: None, project, max_workers=1) == 3
+    means = sorted(row[-1] for _, chunk in project.iter_measurements() for row in chunk)
+    assert len(means) == 12
+    assert means == pytest.approx([3000] * 4 + [3500] * 4 + [4000] * 4, rel=0.02)
+    assert shared_segments() == before
+
+
+def test_cancelled_segment_project_leaks_no_segments(project):
+    before = shared_segments()
+    token = CancelToken()
+
+    def progress(done, total):
+        token.cancel()
+
+    with pytest.raises(JobCancelled):
+        segment_project(token, progress, project, max_workers=1)
+    # Frames already segmented when the job was cancelled are kept, the rest are not
+    assert project.count_measurements() in (4, 8)
+    assert shared_segments() == before
@@ -0,0 +1,91 @@
+import os
+import numpy as np
+import cv2
+import pytest
+from PIL import Image
+from db_manager import DatabaseManager
+from scheduler import CancelToken
+from tracking import WellTracker, frame_order, track_project
+
+CENTERS = [(40 + column * 80, 40 + row * 80) for row in range(3) for column in range(4)]
+
+
+def frame(value=3000, shift=0, missing=()):
+    img = np.full((240, 320), 500, dtype=np.uint16)
+    for index, (x, y) in enumerate(CENTERS):
+        if index not in missing:
+            cv2.circle(img, (x + shift, y), 22, value, -1)
+    return img
+
+
+def ids_by_center(rows):
+    return {(round(row[2]), round(row[3])): row[0] for row in rows}
+
+
+def test_unchanged_layout_is_propagated():
+    tracker = WellTracker()
+    first = tracker.track(frame())
+    assert tracker.last_mode == "segmented"
+    # A uniform change in brightness is not a change in layout
+    second = tracker.track(frame(value=4500))
+    assert tracker.last_mode == "propagated"
+    assert ids_by_center(second) == ids_by_center(first)
+    assert [row[5] for row in second] == pytest.approx([4500] * 12, rel=0.02)
+
+
+def test_moved_plate_falls_back_to_segmentation():
+    tracker = WellTracker()
+    first = tracker.track(frame())
+    moved = tracker.track(frame(shift=12))
+    assert tracker.last_mode == "segmented"
+    assert len(moved) == 12
+    # Wells overlapping their previous position keep their IDs
+    assert sorted(row[0] for row in moved) == sorted(row[0] for row in first)
+
+
+def test_lost_well_gets_its_id_back():
+    tracker = WellTracker()
+    first = ids_by_center(tracker.track(frame()))
+    tracker.track(frame())
+    tracker.track(frame())
+    gap = tracker.track(frame(missing=(4,)))
+    assert tracker.last_mode == "segmented"
+    assert len(gap) == 11
+    back = tracker.track(frame())
+    assert len(back) == 12
+    assert ids_by_center(back) == first
+    assert max(row[0] for row in back) == 12
+
+
+def test_frame_order(tmp_path):
+    paths = []
+    for name in ["frame_10.tif", "frame_2.tif", "frame_1.tif"]:
+        paths.append(str(tmp_path / name))
+        Image.fromarray(frame()).save(paths[-1])
+    images = list(enumerate(paths, start=1))
+    assert [image_id for image_id, _ in frame_order(images)] == [3, 2, 1]
+
+    # Acquisition times take precedence over names once every frame has one
+    for path, time in zip(paths, ["2024:01:01 10:00:00", "2024:01:01 12:00:00", "2024:01:01 11:00:00"]):
+        exif = Image.Exif()
+        exif[306] = time
+        Image.fromarray(frame()).save(path, exif=exif)
+    assert [image_id for image_id, _ in frame_order(images)] == [1, 3, 2]
+
+
+def test_track_project_stores_raw_kinetics(tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    for index, value in enumerate([3000, 3600, 4200]):
+        Image.fromarray(frame(value=value)).save(str(folder / f"t{index + 1}.tif"))
+    db_manager = DatabaseManager(str(tmp_path / "project.sqlite3"))
+    db_manager.create_database(str(folder))
+
+    assert track_project(CancelToken(), lambda done, total: None, db_manager) == 3
+    means = {}
+    for _, rows in db_manager.iter_measurements():
+        for path, _, _, well_index, _, _, _, _, _, mean in rows:
+            means.setdefault(os.path.basename(path), {})[well_index] = mean
+    assert sorted(means["t1.tif"]) == list(range(1, 13))
+    for name, value in [("t1.tif", 3000), ("t2.tif", 3600), ("t3.tif", 4200)]:
+        assert list(means[name].values()) == pytest.approx([value] * 12, rel=0.02)
@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import time
+import numpy as np
+import cv2
+import pytest
+from PIL import Image
+import watch_folder
+from db_manager import DatabaseManager
+from scheduler import JobScheduler
+from watch_folder import WatchFolderIngest
+from test_scheduler import FakeRoot
+
+
+def write_plate(path, value, mode="I;16"):
+    img = np.full((120, 160), 100, dtype=np.uint16)
+    for column in range(2):
+        cv2.circle(img, (40 + column * 80, 60), 20, value, -1)
+    if mode == "RGB":
+        rgb = np.zeros((120, 160, 3), dtype=np.uint8)
+        # Pure red wells: RGB weighting gives 0.299 * 200, BGR weighting would give 0.114 * 200
+        rgb[img == value, 0] = 200
+        Image.fromarray(rgb).save(path)
+    else:
+        Image.fromarray(img).save(path)
+
+
+def run_until(watcher, condition, timeout=10.0):
+    watcher.start()
+    deadline = time.monotonic() + timeout
+    try:
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        watcher.stop()
+        for thread in watcher._threads:
+            thread.join(timeout)
+
+
+@pytest.fixture
+def project(tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    db_manager = DatabaseManager(str(tmp_path / "project.sqlite3"))
+    db_manager.create_database(str(folder))
+    return folder, db_manager
+
+
+def stored_means(db_manager):
+    with sqlite3.connect(db_manager.db_path) as conn:
+        rows = conn.execute(
+            "SELECT images.image_path, mean_intensity FROM measurements JOIN images USING (image_id) ORDER BY measurement_id"
+        ).fetchall()
+    means = {}
+    for path, mean in rows:
+        means.setdefault(os.path.basename(path), []).append(mean)
+    return means
+
+
+def test_frames_are_measured_in_raw_units(project):
+    folder, db_manager = project
+    write_plate(str(folder / "a.tif"), 3000)
+    write_plate(str(folder / "b.tif"), 6000)
+    watcher = WatchFolderIngest(db_manager, str(folder), poll_interval=0.05)
+    run_until(watcher, lambda: watcher.analysed == 2)
+    means = stored_means(db_manager)
+    assert means["a.tif"] == pytest.approx([3000, 3000])
+    assert means["b.tif"] == pytest.approx([6000, 6000])
+
+
+def test_frames_are_analysed_as_scheduler_jobs(project):
+    folder, db_manager = project
+    write_plate(str(folder / "a.tif"), 3000)
+    scheduler = JobScheduler(FakeRoot())
+    watcher = WatchFolderIngest(db_manager, str(folder), poll_interval=0.05, scheduler=scheduler)
+    try:
+        run_until(watcher, lambda: watcher.analysed == 1)
+    finally:
+        scheduler.shutdown()
+    assert stored_means(db_manager)["a.tif"] == pytest.approx([3000, 3000])
+
+
+def test_colour_frames_use_rgb_weights(project):
+    folder, db_manager = project
+    write_plate(str(folder / "a.png"), 3000, mode="RGB")
+    watcher = WatchFolderIngest(db_manager, str(folder), poll_interval=0.05)
+    run_until(watcher, lambda: watcher.analysed == 1)
+    assert stored_means(db_manager)["a.png"] == pytest.approx([0.299 * 200] * 2, abs=1)
+
+
+def test_failing_image_does_not_stop_the_stages(project, monkeypatch):
+    folder, db_manager = project
+    write_plate(str(folder / "a.tif"), 3000)
+    write_plate(str(folder / "b.tif"), 3000)
+    write_plate(str(folder / "c.tif"), 3000)
+    measure = watch_folder.measurement_rows
+    calls = []
+
+    def flaky(pipeline):
+        calls.append(1)
+        if len(calls) == 2:
+            raise ValueError("broken frame")
+        return measure(pipeline)
+
+    monkeypatch.setattr(watch_folder, "measurement_rows", flaky)
+    watcher = WatchFolderIngest(db_manager, str(folder), poll_interval=0.05)
+    run_until(watcher, lambda: watcher.analysed + watcher.failed == 3)
+    assert watcher.analysed == 2
+    assert watcher.failed == 1
+    assert not watcher.is_running()
+
+
+def test_stopping_under_backpressure_loses_no_image(project, monkeypatch):
+    folder, db_manager = project
+    for index in range(8):
+        write_plate(str(folder / f"frame_{index}.tif"), 3000)
+    measure = watch_folder.measurement_rows
+
+    def slow(pipeline):
+        # Slow enough that the stages are still waiting for room in full queues after stop()
+        time.sleep(0.3)
+        return measure(pipeline)
+
+    monkeypatch.setattr(watch_folder, "measurement_rows", slow)
+    # Queues of one frame each fill up long before the batch of eight is handed over
+    watcher = WatchFolderIngest(db_manager, str(folder), poll_interval=0.05, queue_size=1)
+    watcher.start()
+    deadline = time.monotonic() + 10
+    while watcher.registered < 8 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    watcher.stop()
+    assert watcher.analysed < 8
+    for thread in watcher._threads:
+        thread.join(10)
+    assert not watcher.is_running()
+    assert watcher.analysed == 8 and watcher.failed == 0
+    assert len(stored_means(db_manager)) == 8